@@ -0,0 +1,52 @@
+"""
+Throughput of loading archived KuntoTurku payloads with the backfill loader.
+
+Benchmarks are not collected in normal test runs, run with
+
+    py.test -s benchmarks/bench_backfill.py
+"""
+import gzip
+import json
+import random
+import time
+from datetime import datetime, timedelta
+
+from vehicles.importers.backfill import BackfillLoader, read_payloads
+from vehicles.importers.kuntoturku import KuntoTurkuImporter
+from vehicles.models import Location
+
+VEHICLES = 1000
+PAYLOADS = 200
+
+
+def write_payloads(path):
+    start = datetime(2017, 1, 1)
+    with gzip.open(path, 'wt', encoding='utf-8') as f:
+        for i in range(PAYLOADS):
+            timestamp = (start + timedelta(seconds=i * 5)).strftime('%Y-%m-%d %H:%M:%S')
+            f.write(json.dumps([{
+                'id': vehicle_id,
+                'machine_type': 'kuorma-auto',
+                'last_location': {
+                    'timestamp': timestamp,
+                    'coords': '(%r %r)' % (22.2 + random.random() / 10, 60.4 + random.random() / 10),
+                    'events': ['Auraus'],
+                },
+            } for vehicle_id in range(VEHICLES)]) + '\n')
+
+
+def test_backfill_throughput(tmpdir, settings):
+    settings.STREET_MAINTENANCE_DELAY = None
+    path = str(tmpdir.join('payloads.jsonl.gz'))
+    write_payloads(path)
+    loader = BackfillLoader(KuntoTurkuImporter({'URL': 'https://api.dummy.com/v1/'}))
+
+    started = time.perf_counter()
+    loader.load(read_payloads(path))
+    elapsed = time.perf_counter() - started
+
+    assert Location.objects.count() == VEHICLES * PAYLOADS
+    print()
+    print('loaded %d locations in %.1f s, %.0f locations/s' % (
+        loader.stats['new_locations'], elapsed, loader.stats['new_locations'] / elapsed
+    ))
@@ -0,0 +1,59 @@
+"""
+Rendering time of a 10k point location history with the DRF serializers and with vehicles.rendering.
+
+Benchmarks are not collected in normal test runs, run with
+
+    py.test -s benchmarks/bench_rendering.py
+"""
+import random
+import time
+from datetime import timedelta
+
+from django.contrib.gis.geos import Point
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from vehicles.api import VehicleSerializer
+from vehicles.factories import VehicleFactory
+from vehicles.models import Location, Vehicle
+from vehicles.rendering import get_location_values, render_vehicle_detail
+
+HISTORY = 10000
+ROUNDS = 5
+
+
+def measure(func):
+    started = time.perf_counter()
+    for i in range(ROUNDS):
+        content = func()
+    return content, (time.perf_counter() - started) / ROUNDS
+
+
+def test_rendering_10k_history(settings):
+    settings.STREET_MAINTENANCE_DELAY = None
+    vehicle = VehicleFactory.create()
+    start = timezone.now() - timedelta(days=1)
+    Location.objects.bulk_create(
+        Location(
+            vehicle=vehicle, timestamp=start + timedelta(seconds=i * 5),
+            coords=Point(22.2 + random.random() / 10, 60.4 + random.random() / 10), event_mask=random.choice((0, 2, 6)),
+        ) for i in range(HISTORY)
+    )
+    vehicle.update_last_location()
+    vehicle = Vehicle.objects.select_related('last_location').get(id=vehicle.id)
+
+    def render_with_serializers():
+        context = {'location_history': vehicle.get_location_history(history=HISTORY)}
+        return JSONRenderer().render(VehicleSerializer(vehicle, context=context).data)
+
+    def render_fast():
+        location_history = vehicle.get_location_history(history=HISTORY, values=True)
+        return render_vehicle_detail(vehicle.id, get_location_values(vehicle.last_location), location_history)
+
+    serializer_content, serializer_time = measure(render_with_serializers)
+    fast_content, fast_time = measure(render_fast)
+
+    assert fast_content == serializer_content
+    print()
+    print('serializers: %7.1f ms' % (serializer_time * 1000))
+    print('fast path:   %7.1f ms (%.1fx)' % (fast_time * 1000, serializer_time / fast_time))
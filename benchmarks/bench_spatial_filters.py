@@ -0,0 +1,64 @@
+"""
+Response size and latency of the vehicle list with spatial filters, for different fleet sizes and visible areas.
+
+Benchmarks are not collected in normal test runs, run with
+
+    py.test -s benchmarks/bench_spatial_filters.py
+"""
+import random
+import time
+
+import pytest
+from django.contrib.gis.geos import Point
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from vehicles.factories import DataSourceFactory
+from vehicles.models import Location, Vehicle
+from vehicles.publication import publish_new_locations
+from vehicles.tests.utils import VEHICLE_LIST_URL
+
+# an area of roughly 20 x 20 km around Turku
+X_MIN, Y_MIN, X_MAX, Y_MAX = 22.1, 60.4, 22.46, 60.58
+
+ROUNDS = 20
+
+
+def create_fleet(size):
+    data_source = DataSourceFactory.create()
+    vehicles = Vehicle.objects.bulk_create(
+        Vehicle(data_source=data_source, origin_id=str(i)) for i in range(size)
+    )
+    locations = Location.objects.bulk_create(
+        Location(
+            vehicle=vehicle, timestamp=timezone.now(),
+            coords=Point(random.uniform(X_MIN, X_MAX), random.uniform(Y_MIN, Y_MAX)),
+        ) for vehicle in vehicles
+    )
+    publish_new_locations((location.id, location.vehicle_id, location.timestamp) for location in locations)
+
+
+def get_bbox(fraction):
+    width = (X_MAX - X_MIN) * fraction ** 0.5
+    height = (Y_MAX - Y_MIN) * fraction ** 0.5
+    return '%f,%f,%f,%f' % (X_MIN, Y_MIN, X_MIN + width, Y_MIN + height)
+
+
+@pytest.mark.parametrize('fleet_size', (100, 1000, 5000))
+def test_bbox_in_list(settings, fleet_size):
+    settings.STREET_MAINTENANCE_DELAY = None
+    random.seed(fleet_size)
+    create_fleet(fleet_size)
+    client = APIClient()
+
+    print()
+    for fraction in (0.01, 0.1, 1):
+        params = {'limit': fleet_size, 'bbox': get_bbox(fraction)}
+        started = time.perf_counter()
+        for i in range(ROUNDS):
+            response = client.get(VEHICLE_LIST_URL, params)
+        elapsed = (time.perf_counter() - started) / ROUNDS
+        assert response.status_code == 200
+        print('fleet %5d, visible area %4d %%: %7d bytes, %6.1f ms' % (
+            fleet_size, fraction * 100, len(response.content), elapsed * 1000
+        ))
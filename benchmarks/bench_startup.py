@@ -0,0 +1,33 @@
+"""
+Cost of registering the importers at app startup, which happens in every process loading Django.
+
+Benchmarks are not collected in normal test runs, run with
+
+    py.test -s benchmarks/bench_startup.py
+"""
+import time
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from vehicles import importers
+
+ROUNDS = 100
+
+
+def test_importer_registration(settings):
+    settings.STREET_MAINTENANCE_IMPORTERS = {
+        'vehicles.importers.kuntoturku.KuntoTurkuImporter': {'URL': 'https://api.dummy.com/v1/'},
+        'vehicles.importers.maponturku.MaponImporter': {'URL': 'https://api.dummy.com/v1/'},
+    }
+
+    started = time.perf_counter()
+    with CaptureQueriesContext(connection) as context:
+        for i in range(ROUNDS):
+            importers._importers = {}
+            importers.register_importers_from_settings()
+    elapsed = (time.perf_counter() - started) / ROUNDS
+
+    assert len(context) == 0
+    print()
+    print('registration of %d importers: %.2f ms without queries' % (len(importers.get_importers()), elapsed * 1000))
@@ -2,8 +2,12 @@ import logging
 import os
 
 from celery import Celery
+from django.conf import settings
 
+from vehicles.constants import PUBLICATION_INTERVAL_SETTING
 from vehicles.importers import get_importer_by_id, get_importers
+from vehicles.partitions import manage_location_partitions
+from vehicles.publication import publish_due_locations
 
 # set the default Django settings module for the 'celery' program.
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'streetmaintenance.settings')
@@ -13,6 +17,8 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 
 logger = logging.getLogger(__name__)
 
+PARTITION_MANAGEMENT_INTERVAL = 60 * 60  # in seconds
+
 
 @app.task(ignore_result=True)
 def run_importer(importer_id):
@@ -22,8 +28,36 @@ def run_importer(importer_id):
     logger.info('Import completed successfully')
 
 
+@app.task(ignore_result=True)
+def publish_locations():
+    vehicle_ids = publish_due_locations()
+    if vehicle_ids:
+        logger.info('Published new locations for %d vehicles' % len(vehicle_ids))
+
+
+@app.task(ignore_result=True)
+def manage_partitions():
+    created, dropped = manage_location_partitions()
+    logger.info('Location partitions created %s dropped %s' % (created, dropped))
+
+
 @app.on_after_finalize.connect
 def setup_periodic_tasks(sender, **kwargs):
+    sender.add_periodic_task(
+        PARTITION_MANAGEMENT_INTERVAL,
+        manage_partitions.s(),
+        name='manage_partitions',
+    )
+
+    publication_interval = getattr(settings, PUBLICATION_INTERVAL_SETTING, 5.0)
+    logger.debug('Adding periodic task, publication, run interval %s' % publication_interval)
+    sender.add_periodic_task(
+        publication_interval,
+        publish_locations.s(),
+        name='publish_locations',
+        expires=5,
+    )
+
     for importer in get_importers():
         logger.debug('Adding periodic task, importer %s, run interval %s' % (importer.id, importer.run_interval))
         sender.add_periodic_task(
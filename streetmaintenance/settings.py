@@ -81,10 +81,15 @@ REST_FRAMEWORK = {
 
 
 STREET_MAINTENANCE_DEFAULT_LIMIT = 10
+STREET_MAINTENANCE_MAX_PAGE_SIZE = 1000
 STREET_MAINTENANCE_DELAY = 15 * 60  # in seconds
+STREET_MAINTENANCE_PUBLICATION_INTERVAL = 5.0  # in seconds
 STREET_MAINTENANCE_IGNORE_LOCATIONS_WITHOUT_EVENTS = True
+STREET_MAINTENANCE_LOCATION_RETENTION_MONTHS = None
 
 STREET_MAINTENANCE_IMPORTERS = {}
+STREET_MAINTENANCE_REDIS_URL = None
+STREET_MAINTENANCE_CAPTURE_DIRECTORY = None
 
 
 # local_settings.py can be used to override environment-specific settings
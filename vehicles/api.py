@@ -1,16 +1,34 @@
+import base64
+import binascii
 import logging
-from collections import defaultdict
 from datetime import datetime, timedelta
 
 import dateutil.parser
+import pytz
 from django.conf import settings
+from django.contrib.gis.geos import GEOSGeometry, Point, Polygon
+from django.db.models import Q
+from django.http import HttpResponse, StreamingHttpResponse
 from django.utils import timezone
-from rest_framework import exceptions, serializers, viewsets
+from rest_framework import exceptions, serializers, status, viewsets
+from rest_framework.decorators import list_route
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
 
 import timelib
 
-from .constants import DEFAULT_LIMIT_SETTING
-from .models import EventType, Location, Vehicle
+from . import cache
+from .constants import DEFAULT_LIMIT_SETTING, MAX_PAGE_SIZE_SETTING
+from .events import encode_events
+from .models import CoverageCell, Location, Vehicle, VehicleState
+from .rendering import (
+    get_location_values, render_coverage, render_coverage_geojson, render_vehicle_detail,
+    render_vehicle_detail_geojson, render_vehicle_detail_polyline, render_vehicle_detail_stream,
+    render_vehicle_histories, render_vehicle_list, render_vehicle_list_geojson, thin_locations
+)
+from .simplification import get_simplified_indices, simplify_location_histories
 
 logger = logging.getLogger(__name__)
 
@@ -33,99 +51,102 @@ class LocationSerializer(serializers.ModelSerializer):
         return [instance.coords.x, instance.coords.y]
 
     def get_events(self, instance):
-        prefetched_events = self.context.get('prefetched_events')
-
-        if prefetched_events is None:
-            # Fallback to fetching events here. This should not normally happen.
-            logger.debug("Something seems to be wrong, LocationSerializer didn't get prefetched events.")
-            return [event.identifier for event in instance.events.all()]
-
-        return prefetched_events[instance.id]
+        return instance.events
 
 
 class VehicleSerializer(serializers.ModelSerializer):
     last_location = serializers.SerializerMethodField()
     location_history = serializers.SerializerMethodField()
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-
-        # Prefetch event identifiers for faster access
-
-        self._prefetched_events = defaultdict(list)
-
-        if self.context['action'] == 'list':
-            location_ids = [vehicle.last_location.id for vehicle in self.instance]
-        else:
-            locations = self.instance.available_locations.order_by('-id')
-            location_ids = locations.values_list('id', flat=True).distinct()
-
-        event_dict = {ev.id: ev.identifier for ev in EventType.objects.all()}
-        self._prefetched_events = defaultdict(list)
-
-        through_objects = Location.events.through.objects.filter(location_id__in=location_ids)
-        for key, value in through_objects.values_list('location_id', 'eventtype_id'):
-            self._prefetched_events[key].append(event_dict[value])
-
     class Meta:
         model = Vehicle
         fields = ('id', 'last_location', 'location_history')
 
     def get_last_location(self, instance):
-        return LocationSerializer(
-            instance.last_location, context={'prefetched_events': self._prefetched_events}
-        ).data
+        return LocationSerializer(instance.last_location).data
 
     def get_location_history(self, instance):
-        if self.context['action'] == 'list':
-            return []
+        return LocationSerializer(self.context.get('location_history', []), many=True).data
 
-        query_params = self.context['query_params']
-        since = query_params.get('since')
-        history = query_params.get('history')
 
-        if not (since or history):
-            return []
+EPOCH = datetime(1970, 1, 1, tzinfo=pytz.utc)
 
-        locations = instance.available_locations.order_by('-timestamp')
 
-        if since:
-            locations = locations.filter(timestamp__gte=since)
-        if history:
-            locations = locations[:history]
+def encode_cursor(timestamp, id=None):
+    """
+    Return an opaque pagination cursor pointing to the given timestamp and optionally ID.
+    """
+    cursor = str((timestamp - EPOCH) // timedelta(microseconds=1))
+    if id is not None:
+        cursor += ':%d' % id
+    return base64.urlsafe_b64encode(cursor.encode('ascii')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """
+    Return a (timestamp, id) tuple of a pagination cursor, id being None if the cursor doesn't have one.
+
+    Raises ValueError if the cursor is invalid.
+    """
+    try:
+        values = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('ascii').split(':')
+    except (binascii.Error, UnicodeError):
+        raise ValueError('Invalid cursor')
+    if len(values) > 2:
+        raise ValueError('Invalid cursor')
 
-        data = LocationSerializer(
-            reversed(locations), many=True, context={'prefetched_events': self._prefetched_events}
-        ).data
+    try:
+        timestamp = EPOCH + timedelta(microseconds=int(values[0]))
+    except OverflowError:
+        raise ValueError('Invalid cursor')
+    id = int(values[1]) if len(values) == 2 else None
+    return timestamp, id
 
-        return data
 
-    def to_representation(self, instance):
-        representation = super().to_representation(instance)
+class GeoJSONRenderer(JSONRenderer):
+    """
+    GeoJSON format of the vehicle API, the content is rendered by the view.
+    """
+    media_type = 'application/geo+json'
+    format = 'geojson'
 
-        temporal_resolution = self.context['query_params'].get('temporal_resolution')
-        if temporal_resolution:
-            out = []
-            for location in representation['location_history']:
-                if not out:
-                    out.append(location)
-                    continue
-                delta = location['timestamp'] - out[-1]['timestamp']
-                if delta < timedelta(seconds=temporal_resolution):
-                    continue
-                out.append(location)
-            representation['location_history'] = out
 
-        return representation
+class PolylineRenderer(JSONRenderer):
+    """
+    Compact encoded polyline format of the vehicle API, the content is rendered by the view.
+    """
+    format = 'polyline'
 
 
 class VehicleViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Vehicle.objects.exclude(last_location__isnull=True).select_related('last_location')
     serializer_class = VehicleSerializer
+    renderer_classes = tuple(api_settings.DEFAULT_RENDERER_CLASSES) + (GeoJSONRenderer, PolylineRenderer)
+
+    # functions rendering the formats without the serializers, None meaning the format is not available
+    list_renderers = {
+        'json': render_vehicle_list,
+        'geojson': render_vehicle_list_geojson,
+        'polyline': None,
+    }
+    detail_renderers = {
+        'json': render_vehicle_detail,
+        'geojson': render_vehicle_detail_geojson,
+        'polyline': render_vehicle_detail_polyline,
+    }
+    coverage_renderers = {
+        'json': render_coverage,
+        'geojson': render_coverage_geojson,
+        'polyline': None,
+    }
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.parsed_query_params = {}
+        self.response_cache_key = None
+        self.response_from_cache = False
+        self.location_history = []
+        self.next_cursor = None
 
     def parse_query_params(self):  # noqa C901
         query_params = {}
@@ -149,7 +170,7 @@ class VehicleViewSet(viewsets.ReadOnlyModelViewSet):
 
             query_params['since'] = since_datetime
 
-        for int_param in ('history', 'limit', 'temporal_resolution'):
+        for int_param in ('history', 'limit', 'temporal_resolution', 'page_size'):
             value = self.request.query_params.get(int_param)
             if value:
                 try:
@@ -157,32 +178,413 @@ class VehicleViewSet(viewsets.ReadOnlyModelViewSet):
                 except ValueError:
                     raise exceptions.ValidationError('Invalid value for %s parameter.' % int_param)
 
+        stream = self.request.query_params.get('stream')
+        if stream:
+            if stream not in ('0', '1', 'false', 'true'):
+                raise exceptions.ValidationError('Invalid value for stream parameter.')
+            query_params['stream'] = stream in ('1', 'true')
+
+        simplify = self.request.query_params.get('simplify')
+        if simplify:
+            try:
+                query_params['simplify'] = float(simplify)
+            except ValueError:
+                raise exceptions.ValidationError('Invalid value for simplify parameter.')
+            if not 0 <= query_params['simplify'] < float('inf'):
+                raise exceptions.ValidationError('Invalid value for simplify parameter.')
+            if query_params.get('stream'):
+                raise exceptions.ValidationError('simplify parameter cannot be used with stream parameter.')
+
+        event = self.request.query_params.get('event')
+        if event:
+            try:
+                query_params['event'] = encode_events(event.split(','))
+            except ValueError:
+                raise exceptions.ValidationError('Invalid value for event parameter.')
+
+        query_params.update(self.parse_spatial_query_params())
+        query_params.update(self.parse_pagination_query_params(query_params))
+
         self.parsed_query_params = query_params
 
+    def parse_pagination_query_params(self, query_params):
+        pagination_params = {}
+
+        if query_params.get('page_size', 1) < 1:
+            raise exceptions.ValidationError('Invalid value for page_size parameter.')
+
+        cursor = self.request.query_params.get('cursor')
+        if cursor:
+            try:
+                pagination_params['cursor'] = decode_cursor(cursor)
+            except ValueError:
+                raise exceptions.ValidationError('Invalid value for cursor parameter.')
+            # list cursors point to a vehicle, detail cursors only to a timestamp of the vehicle's location
+            if (pagination_params['cursor'][1] is None) == (self.action == 'list'):
+                raise exceptions.ValidationError('Invalid value for cursor parameter.')
+
+        if 'history' in query_params and ('page_size' in query_params or cursor):
+            raise exceptions.ValidationError('history parameter cannot be used with pagination.')
+        if query_params.get('stream') and ('page_size' in query_params or cursor):
+            raise exceptions.ValidationError('stream parameter cannot be used with pagination.')
+
+        return pagination_params
+
+    def parse_coordinates(self, param, count):
+        value = self.request.query_params.get(param)
+        try:
+            coordinates = [float(coordinate) for coordinate in value.split(',')]
+        except ValueError:
+            coordinates = []
+        if len(coordinates) != count:
+            raise exceptions.ValidationError('Invalid value for %s parameter.' % param)
+        return coordinates
+
+    def parse_spatial_query_params(self):
+        query_params = {}
+
+        if self.request.query_params.get('bbox'):
+            x_min, y_min, x_max, y_max = self.parse_coordinates('bbox', 4)
+            if x_min > x_max or y_min > y_max:
+                raise exceptions.ValidationError('Invalid value for bbox parameter.')
+            query_params['bbox'] = Polygon.from_bbox((x_min, y_min, x_max, y_max))
+            query_params['bbox'].srid = 4326
+
+        radius = self.request.query_params.get('radius')
+        if self.request.query_params.get('near'):
+            query_params['near'] = Point(*self.parse_coordinates('near', 2), srid=4326)
+            try:
+                query_params['radius'] = float(radius)
+            except (TypeError, ValueError):
+                raise exceptions.ValidationError('Invalid value for radius parameter.')
+            if query_params['radius'] < 0:
+                raise exceptions.ValidationError('Invalid value for radius parameter.')
+        elif radius:
+            raise exceptions.ValidationError('radius parameter requires near parameter.')
+
+        return query_params
+
+    def get_location_filter(self):
+        """
+        Return a Q object of the location filters given in the query parameters.
+
+        The filters work for both locations and vehicle states.
+        """
+        location_filter = Q()
+
+        bbox = self.parsed_query_params.get('bbox')
+        if bbox:
+            location_filter &= Q(coords__intersects=bbox)
+
+        near = self.parsed_query_params.get('near')
+        if near:
+            radius = self.parsed_query_params['radius']
+            location_filter &= Q(coords__within_distance=(near, radius))
+
+        event_mask = self.parsed_query_params.get('event')
+        if event_mask:
+            location_filter &= Q(event_mask__has_any_bit=event_mask)
+
+        return location_filter
+
     def get_serializer_context(self):
         context = super().get_serializer_context()
-        context['query_params'] = self.parsed_query_params
-        context['action'] = self.action
+        context['location_history'] = self.location_history
         return context
 
+    def get_page_size(self):
+        """
+        Return the page size if the response should be paginated, otherwise None.
+        """
+        if not ('page_size' in self.parsed_query_params or 'cursor' in self.parsed_query_params):
+            return None
+        max_page_size = getattr(settings, MAX_PAGE_SIZE_SETTING, 1000)
+        return min(self.parsed_query_params.get('page_size') or max_page_size, max_page_size)
+
     def get_queryset(self):
-        queryset = super().get_queryset()
+        if self.action != 'list':
+            return super().get_queryset()
 
-        if self.action == 'list':
-            since = self.parsed_query_params.get('since')
-            if since:
-                queryset = queryset.filter(last_location__timestamp__gte=since)
+        # the list is served from the published vehicle states alone, without touching locations
+        queryset = VehicleState.objects.all()
+        since = self.parsed_query_params.get('since')
+        if since:
+            queryset = queryset.filter(timestamp__gte=since)
+        queryset = queryset.filter(self.get_location_filter())
 
+        if not self.get_page_size():
             default_limit = getattr(settings, DEFAULT_LIMIT_SETTING, 10)
             limit = self.parsed_query_params.get('limit') or default_limit
             queryset = queryset[:limit]
 
         return queryset
 
+    def get_vehicle_states(self):
+        """
+        Return the vehicle states of the list endpoint.
+
+        The states are ordered by their timestamp and vehicle ID. When paginating, a page is fetched with a single
+        indexable comparison to the cursor regardless of its position.
+        """
+        queryset = self.filter_queryset(self.get_queryset())
+        page_size = self.get_page_size()
+        if not page_size:
+            return list(queryset)
+
+        cursor = self.parsed_query_params.get('cursor')
+        if cursor:
+            timestamp, vehicle_id = cursor
+            queryset = queryset.filter(
+                Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, vehicle_id__lt=vehicle_id)
+            )
+
+        states = list(queryset[:page_size + 1])
+        if len(states) > page_size:
+            states = states[:page_size]
+            self.next_cursor = encode_cursor(states[-1].timestamp, states[-1].vehicle_id)
+        return states
+
+    def get_location_history(self, vehicle, values=False, stream=False):
+        """
+        Return the location history of the detail endpoint.
+
+        When paginating, a page is the next locations after the cursor's timestamp in chronological order. Timestamps
+        are unique per vehicle, so they are enough for the cursor and the (vehicle, timestamp) index is used for
+        fetching a page.
+        """
+        query_params = self.parsed_query_params
+        since = query_params.get('since')
+        history = query_params.get('history')
+        page_size = self.get_page_size()
+
+        if not (since or history or page_size):
+            return []
+
+        cursor = query_params.get('cursor')
+        locations = vehicle.get_location_history(
+            since=since, history=history, temporal_resolution=query_params.get('temporal_resolution'),
+            location_filter=self.get_location_filter(), values=values, after=cursor[0] if cursor else None,
+            limit=page_size + 1 if page_size else None, stream=stream,
+        )
+
+        if page_size and len(locations) > page_size:
+            locations = locations[:page_size]
+            self.next_cursor = encode_cursor(locations[-1][0] if values else locations[-1].timestamp)
+
+        if 'simplify' in query_params:
+            locations = self.simplify_locations(locations, query_params['simplify'], values)
+        return locations
+
+    def simplify_locations(self, locations, tolerance, values=False):
+        """
+        Simplify a location history keeping every location where the events change.
+
+        The last location is always kept, so a page's cursor stays valid.
+        """
+        location_values = locations if values else [get_location_values(location) for location in locations]
+        return [locations[index] for index in get_simplified_indices(location_values, tolerance)]
+
+    def get_request_key(self):
+        """
+        Return a string identifying the requested representation based on the normalized query parameters.
+        """
+        params = []
+        for name, value in sorted(self.parsed_query_params.items()):
+            if isinstance(value, GEOSGeometry):
+                value = value.wkt
+            elif isinstance(value, datetime):
+                value = value.isoformat()
+            params.append('%s=%s' % (name, value))
+        return '%s %s %s %s %s' % (
+            self.action, self.kwargs.get('pk'), self.request.accepted_renderer.format, self.request.accepted_media_type,
+            '&'.join(params)
+        )
+
+    def get_cached_response(self):
+        """
+        Return a 304 or a cached response if possible, otherwise None.
+
+        Only JSON responses are cached, the browsable API is always rendered.
+        """
+        if not isinstance(self.request.accepted_renderer, JSONRenderer):
+            return None
+
+        response_cache = cache.get_response_cache()
+        self.response_cache_key = response_cache.get_key(self.get_request_key())
+        if not self.response_cache_key:
+            return None
+
+        if_none_match = self.request.META.get('HTTP_IF_NONE_MATCH', '')
+        etags = [etag.strip() for etag in if_none_match.split(',')]
+        if self.get_etag() in etags or '*' in etags:
+            return Response(status=status.HTTP_304_NOT_MODIFIED)
+
+        cached = response_cache.get(self.response_cache_key)
+        if cached is not None:
+            self.response_from_cache = True
+            content, headers = cached
+            response = HttpResponse(content, content_type=self.request.accepted_renderer.media_type)
+            for header, value in headers.items():
+                response[header] = value
+            return response
+
+        return None
+
+    def get_etag(self):
+        return '"%s"' % self.response_cache_key
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+
+        headers = {}
+        if self.next_cursor:
+            next_url = replace_query_param(request.build_absolute_uri(), 'cursor', self.next_cursor)
+            headers['Link'] = '<%s>; rel="next"' % next_url
+            response['Link'] = headers['Link']
+
+        if self.response_cache_key and response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+            if response.status_code == status.HTTP_200_OK and not self.response_from_cache:
+                if isinstance(response, Response):
+                    response.render()
+                cache.get_response_cache().set(self.response_cache_key, response.content, headers)
+            response['ETag'] = self.get_etag()
+
+        return response
+
+    def get_fast_renderer(self, renderers):
+        """
+        Return a function from vehicles.rendering for rendering the response, or None if serializers should be used.
+        """
+        output_format = self.request.accepted_renderer.format
+        if output_format not in renderers:
+            return None
+        if not renderers[output_format]:
+            raise exceptions.NotAcceptable('Format %s is not available for this endpoint.' % output_format)
+        return renderers[output_format]
+
     def list(self, request):
         self.parse_query_params()
-        return super().list(request)
+        render = self.get_fast_renderer(self.list_renderers)
+
+        response = self.get_cached_response()
+        if response:
+            return response
+
+        states = self.get_vehicle_states()
+        if not render:
+            return Response(self.get_serializer([state.get_vehicle() for state in states], many=True).data)
+
+        content = render([(state.vehicle_id, get_location_values(state)) for state in states])
+        return HttpResponse(content, content_type=request.accepted_renderer.media_type)
 
     def retrieve(self, request, pk=None):
         self.parse_query_params()
-        return super().retrieve(request, pk)
+        render = self.get_fast_renderer(self.detail_renderers)
+        if self.parsed_query_params.get('stream'):
+            return self.get_streaming_response()
+
+        response = self.get_cached_response()
+        if response:
+            return response
+
+        vehicle = self.get_object()
+        self.location_history = self.get_location_history(vehicle, values=bool(render))
+        if not render:
+            return Response(self.get_serializer(vehicle).data)
+
+        content = render(vehicle.id, get_location_values(vehicle.last_location), self.location_history)
+        return HttpResponse(content, content_type=request.accepted_renderer.media_type)
+
+    def get_streaming_response(self):
+        """
+        Return the detail endpoint response streamed while the location history is read from the database.
+        """
+        if self.request.accepted_renderer.format != 'json':
+            raise exceptions.NotAcceptable('Only JSON is available with stream parameter.')
+
+        vehicle = self.get_object()
+        location_history = self.get_location_history(vehicle, stream=True)
+        content = render_vehicle_detail_stream(vehicle.id, get_location_values(vehicle.last_location), location_history)
+        return StreamingHttpResponse(content, content_type=self.request.accepted_renderer.media_type)
+
+    @list_route(methods=['get'])
+    def history(self, request):
+        """
+        Location histories of multiple vehicles, selected by IDs or data source.
+
+        The histories of all the vehicles are fetched with a single query and streamed grouped by vehicle.
+        """
+        self.parse_query_params()
+        if request.accepted_renderer.format != 'json':
+            raise exceptions.NotAcceptable('Only JSON is available for this endpoint.')
+        vehicle_filter = self.parse_vehicle_query_params()
+
+        query_params = self.parsed_query_params
+        if not (query_params.get('since') or query_params.get('history')):
+            raise exceptions.ValidationError('since or history parameter is required.')
+        if self.get_page_size():
+            raise exceptions.ValidationError('Pagination is not available for this endpoint.')
+
+        vehicles = list(super().get_queryset().filter(vehicle_filter).order_by('id'))
+        locations = Vehicle.iterate_location_histories(
+            vehicles, since=query_params.get('since'), history=query_params.get('history'),
+            location_filter=self.get_location_filter(),
+        )
+        if query_params.get('temporal_resolution'):
+            locations = thin_locations(locations, query_params['temporal_resolution'])
+        if 'simplify' in query_params:
+            locations = simplify_location_histories(locations, query_params['simplify'])
+
+        content = render_vehicle_histories(
+            [(vehicle.id, get_location_values(vehicle.last_location)) for vehicle in vehicles], locations
+        )
+        return StreamingHttpResponse(content, content_type=request.accepted_renderer.media_type)
+
+    def parse_vehicle_query_params(self):
+        """
+        Return a Q object of the vehicles selected with ids or data_source parameter.
+        """
+        ids = self.request.query_params.get('ids')
+        data_source = self.request.query_params.get('data_source')
+        if not (ids or data_source):
+            raise exceptions.ValidationError('ids or data_source parameter is required.')
+
+        vehicle_filter = Q()
+        if ids:
+            try:
+                vehicle_filter &= Q(id__in=[int(vehicle_id) for vehicle_id in ids.split(',')])
+            except ValueError:
+                raise exceptions.ValidationError('Invalid value for ids parameter.')
+        if data_source:
+            vehicle_filter &= Q(data_source_id=data_source)
+        return vehicle_filter
+
+    @list_route(methods=['get'])
+    def coverage(self, request):
+        """
+        Latest time of every event in the grid cells intersecting a bounding box.
+
+        Served from the coverage cells kept up to date by publication, so the cost depends only on the number of cells
+        in the bounding box.
+        """
+        self.parse_query_params()
+        render = self.get_fast_renderer(self.coverage_renderers)
+        if not render:
+            raise exceptions.NotAcceptable('Only JSON and GeoJSON are available for this endpoint.')
+
+        query_params = self.parsed_query_params
+        if 'bbox' not in query_params:
+            raise exceptions.ValidationError('bbox parameter is required.')
+
+        response = self.get_cached_response()
+        if response:
+            return response
+
+        cell_filter = Q(bounds__intersects=query_params['bbox'])
+        if query_params.get('event'):
+            cell_filter &= Q(event__has_any_bit=query_params['event'])
+        if query_params.get('since'):
+            cell_filter &= Q(timestamp__gte=query_params['since'])
+
+        content = render(CoverageCell.get_values(cell_filter))
+        return HttpResponse(content, content_type=request.accepted_renderer.media_type)
@@ -13,5 +13,11 @@ class VehiclesConfig(AppConfig):
     def ready(self):
         post_migrate.connect(post_migrate_callback, sender=self)
 
+        from .cache import invalidate_responses
+        from .live import publish_live_locations
+        from .signals import locations_published
+        locations_published.connect(invalidate_responses)
+        locations_published.connect(publish_live_locations)
+
         from vehicles.importers import register_importers_from_settings
         register_importers_from_settings()
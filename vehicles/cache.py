@@ -0,0 +1,102 @@
+"""
+Shared cache of API responses.
+
+Published data changes only when publication changes vehicles' last locations, and every such change increments a
+generation counter kept in Redis. Cached responses and their ETags are bound to the generation, so incrementing it
+invalidates all of them at once and old entries just expire. Responses are not cached if Redis isn't configured.
+"""
+import hashlib
+import json
+import logging
+
+from django.db import transaction
+from redis.exceptions import RedisError
+
+from .utils import get_redis_connection
+
+logger = logging.getLogger(__name__)
+
+GENERATION_KEY = 'streetmaintenance:generation'
+RESPONSE_KEY_PREFIX = 'streetmaintenance:response:'
+RESPONSE_TIMEOUT = 60 * 60  # in seconds
+
+_response_cache = None
+
+
+class ResponseCache:
+    """
+    Rendered responses stored in Redis.
+
+    Redis errors are logged and otherwise ignored, responses are then rendered as if they weren't cached.
+    """
+
+    def __init__(self, redis=None):
+        self.redis = redis
+
+    def get_generation(self):
+        """
+        Return the current generation, or None if it cannot be fetched.
+        """
+        if not self.redis:
+            return None
+
+        try:
+            return int(self.redis.get(GENERATION_KEY) or 0)
+        except RedisError as e:
+            logger.warning('Cannot fetch response cache generation from Redis: %s' % e)
+            return None
+
+    def increment_generation(self):
+        if not self.redis:
+            return
+
+        try:
+            self.redis.incr(GENERATION_KEY)
+        except RedisError as e:
+            logger.warning('Cannot increment response cache generation in Redis: %s' % e)
+
+    def get_key(self, request_key):
+        """
+        Return a cache key for a request key, or None if responses cannot be cached right now.
+
+        The request key should identify the requested representation, for example by the normalized query parameters.
+        """
+        generation = self.get_generation()
+        if generation is None:
+            return None
+        return hashlib.sha1(('%d %s' % (generation, request_key)).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """
+        Return a (content, headers) tuple of a cached response, or None if there isn't one.
+        """
+        try:
+            value = self.redis.get(RESPONSE_KEY_PREFIX + key)
+        except RedisError as e:
+            logger.warning('Cannot fetch a cached response from Redis: %s' % e)
+            return None
+
+        if value is None:
+            return None
+        headers, content = value.split(b'\n', 1)
+        return content, json.loads(headers.decode('utf-8'))
+
+    def set(self, key, content, headers=None):
+        # headers are stored as a line of JSON before the content
+        value = json.dumps(headers or {}).encode('utf-8') + b'\n' + content
+        try:
+            self.redis.set(RESPONSE_KEY_PREFIX + key, value, ex=RESPONSE_TIMEOUT)
+        except RedisError as e:
+            logger.warning('Cannot store a response to Redis: %s' % e)
+
+
+def get_response_cache():
+    global _response_cache
+    if _response_cache is None:
+        _response_cache = ResponseCache(get_redis_connection())
+    return _response_cache
+
+
+def invalidate_responses(sender, **kwargs):
+    # responses rendered before the commit would otherwise be cached with the new generation
+    transaction.on_commit(lambda: get_response_cache().increment_generation())
@@ -64,7 +64,12 @@ EVENT_TYPES = (
     },
 )
 
+CAPTURE_DIRECTORY_SETTING = 'STREET_MAINTENANCE_CAPTURE_DIRECTORY'
 DELAY_SETTING = 'STREET_MAINTENANCE_DELAY'
 DEFAULT_LIMIT_SETTING = 'STREET_MAINTENANCE_DEFAULT_LIMIT'
 IGNORE_LOCATIONS_WITHOUT_EVENTS_SETTING = 'STREET_MAINTENANCE_IGNORE_LOCATIONS_WITHOUT_EVENTS'
 IMPORTERS_SETTING = 'STREET_MAINTENANCE_IMPORTERS'
+LOCATION_RETENTION_MONTHS_SETTING = 'STREET_MAINTENANCE_LOCATION_RETENTION_MONTHS'
+MAX_PAGE_SIZE_SETTING = 'STREET_MAINTENANCE_MAX_PAGE_SIZE'
+PUBLICATION_INTERVAL_SETTING = 'STREET_MAINTENANCE_PUBLICATION_INTERVAL'
+REDIS_URL_SETTING = 'STREET_MAINTENANCE_REDIS_URL'
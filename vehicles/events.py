@@ -0,0 +1,31 @@
+"""
+Event bitmasks.
+
+Events of a location are stored as a bitmask, every event type in constants.EVENT_TYPES having its own bit based on
+its position there. New event types must therefore always be added to the end of EVENT_TYPES.
+"""
+from .constants import EVENT_TYPES
+
+EVENT_IDENTIFIERS = tuple(event_type['identifier'] for event_type in EVENT_TYPES)
+
+EVENT_BITS = {identifier: 1 << index for index, identifier in enumerate(EVENT_IDENTIFIERS)}
+
+# event identifiers of every possible mask, in the same order as in EVENT_TYPES
+DECODED_EVENT_MASKS = tuple(
+    tuple(identifier for identifier in EVENT_IDENTIFIERS if mask & EVENT_BITS[identifier])
+    for mask in range(1 << len(EVENT_IDENTIFIERS))
+)
+
+
+def encode_events(identifiers):
+    mask = 0
+    for identifier in identifiers:
+        try:
+            mask |= EVENT_BITS[identifier]
+        except KeyError:
+            raise ValueError('Unknown event type "%s".' % identifier)
+    return mask
+
+
+def decode_events(mask):
+    return list(DECODED_EVENT_MASKS[mask])
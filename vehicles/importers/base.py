@@ -1,14 +1,49 @@
 import logging
+from collections import namedtuple
 
 from django.conf import settings as django_settings
+from django.db import connection, transaction
 
-from vehicles.constants import DELAY_SETTING
-from vehicles.models import DataSource, Vehicle
+from vehicles.constants import IGNORE_LOCATIONS_WITHOUT_EVENTS_SETTING
+from vehicles.models import DataSource
+from vehicles.publication import publish_new_locations
+from vehicles.utils import get_redis_connection
+
+from .capture import get_payload_capture
+from .fingerprints import FingerprintCache
+from .http import FeedSession
 
 logger = logging.getLogger(__name__)
 
+# A normalized location coming from an importer. coords is a (x, y) tuple in WGS84 and events an event bitmask.
+LocationRecord = namedtuple('LocationRecord', ('origin_id', 'timestamp', 'coords', 'events'))
+
+# A conflicting row is updated instead of skipped, so that it is returned even if it was committed by a concurrent
+# transaction after this statement started and is therefore invisible to it otherwise.
+UPSERT_VEHICLES_SQL = '''
+INSERT INTO vehicles_vehicle (data_source_id, origin_id)
+SELECT %s, origin_id FROM unnest(%s::varchar[]) AS origin_id
+ON CONFLICT (data_source_id, origin_id) DO UPDATE SET origin_id = EXCLUDED.origin_id
+RETURNING id, origin_id, xmax = 0
+'''
+
+INSERT_LOCATIONS_SQL = '''
+INSERT INTO vehicles_location (timestamp, coords, vehicle_id, event_mask)
+SELECT timestamp, ST_SetSRID(ST_MakePoint(x, y), 4326), vehicle_id, event_mask
+FROM unnest(%s::timestamptz[], %s::float8[], %s::float8[], %s::integer[], %s::smallint[])
+    AS new (timestamp, x, y, vehicle_id, event_mask)
+ON CONFLICT (timestamp, vehicle_id) DO NOTHING
+RETURNING id, vehicle_id, timestamp
+'''
+
 
 class BaseVehicleImporter:
+    """
+    Base class of importers.
+
+    Importers are instantiated when the app is loaded in every process, so the constructor must not touch the
+    database. Database backed state like the data source is fetched on first use instead.
+    """
     id = None
 
     def __init__(self, settings=None):
@@ -16,14 +51,170 @@ class BaseVehicleImporter:
 
         logger.debug('Initializing importer %s' % self.id)
         settings = settings or {}
-        self.data_source, _ = DataSource.objects.get_or_create(id=self.id)
+        self._data_source = None
         self.run_interval = settings.get('RUN_INTERVAL', 5.0)
         self.settings = settings
+        self.fingerprints = FingerprintCache(self.id, get_redis_connection())
+        self.http = FeedSession(timeout=self.run_interval / 2.0, capture=get_payload_capture(self.id))
+        self.stats = {}
+
+    @property
+    def data_source(self):
+        if self._data_source is None:
+            self._data_source, _ = DataSource.objects.get_or_create(id=self.id)
+        return self._data_source
 
     def base_run(self):
-        if getattr(django_settings, DELAY_SETTING, True):
-            Vehicle.update_last_locations()
         self.run()
 
     def run(self):
+        vehicle_data = self.fetch_data()
+        if vehicle_data is None:
+            logger.info('No changes')
+            return
+
+        self.import_data(vehicle_data)
+
+    def import_data(self, vehicle_data):
+        """
+        Save fetched vehicle data in a single transaction.
+        """
+        with transaction.atomic():
+            self.update_models(vehicle_data)
+
+        self.http.confirm()
+
+    def replay_data(self, vehicle_data):
+        """
+        Save archived vehicle data, for example a captured payload, in a single transaction.
+
+        Works like import_data() but converts the data with get_archived_location_records(), so old data isn't
+        skipped as stale.
+        """
+        with transaction.atomic():
+            self.update_location_records(self.get_archived_location_records(vehicle_data))
+
+    def fetch_data(self):
+        """
+        Fetch vehicle data from the upstream, or return None if it hasn't changed since the previous run.
+
+        Importers using the default run() need to implement this, preferably using self.http.
+        """
         raise NotImplementedError
+
+    def get_location_records(self, vehicle_data):
+        """
+        Convert fetched vehicle data into LocationRecords.
+
+        Importers using update_models() need to implement this.
+        """
+        raise NotImplementedError
+
+    def get_archived_location_records(self, vehicle_data):
+        """
+        Convert archived vehicle data into LocationRecords for backfilling and replaying captured payloads, see
+        vehicles.importers.backfill and replay_data().
+
+        Importers whose get_location_records() skips stale data need to override this.
+        """
+        return self.get_location_records(vehicle_data)
+
+    def update_models(self, vehicle_data):
+        self.update_location_records(self.get_location_records(vehicle_data))
+
+    def update_location_records(self, location_records):
+        """
+        Save the changed ones of the given LocationRecords and update the fingerprints once the transaction commits.
+        """
+        logger.debug('Updating models')
+        num_of_ignored_locations = 0
+        ignore_locations_without_events = getattr(django_settings, IGNORE_LOCATIONS_WITHOUT_EVENTS_SETTING, True)
+
+        all_records = list(location_records)
+        changed_records = self.fingerprints.filter_changed(all_records)
+
+        records = []
+        for record in changed_records:
+            if not record.events and ignore_locations_without_events:
+                num_of_ignored_locations += 1
+                continue
+            records.append(record)
+
+        num_of_new_locations = self.save_locations(records)
+
+        # fingerprints must not be updated if the transaction is rolled back
+        transaction.on_commit(lambda: self.fingerprints.update(changed_records))
+
+        num_of_locations = len(all_records)
+        num_of_unchanged_locations = num_of_locations - len(changed_records)
+        self.stats = {
+            'locations': num_of_locations,
+            'unchanged_locations': num_of_unchanged_locations,
+            'ignored_locations': num_of_ignored_locations,
+            'new_locations': num_of_new_locations,
+        }
+
+        if num_of_new_locations:
+            logger.info(
+                'Number of new locations %d (total %s unchanged %s ignored %s)' %
+                (num_of_new_locations, num_of_locations, num_of_unchanged_locations, num_of_ignored_locations)
+            )
+        else:
+            ignored_msg = ' (%d unchanged, %d ignored)' % (num_of_unchanged_locations, num_of_ignored_locations)
+            logger.info('No locations' + ignored_msg)
+
+    def save_locations(self, records):
+        """
+        Save the given LocationRecords and publish them when possible.
+
+        Everything is done in a fixed number of queries no matter how many records there are, so this should be
+        called once per import run with all the records. Returns the number of new locations.
+        """
+        if not records:
+            return 0
+
+        with connection.cursor() as cursor:
+            vehicle_ids = self.upsert_vehicles(cursor, {record.origin_id for record in records})
+            new_locations = self._insert_locations(cursor, records, vehicle_ids)
+
+        if new_locations:
+            publish_new_locations(
+                (location_id, vehicle_ids[record.origin_id], record.timestamp)
+                for location_id, record in new_locations.items()
+            )
+
+        return len(new_locations)
+
+    def upsert_vehicles(self, cursor, origin_ids):
+        """
+        Create the missing vehicles of the given origin IDs in a single query.
+
+        Returns a dict of vehicle IDs by origin ID, including vehicles created concurrently by other transactions.
+        """
+        cursor.execute(UPSERT_VEHICLES_SQL, (self.data_source.id, list(origin_ids)))
+
+        vehicle_ids = {}
+        for vehicle_id, origin_id, created in cursor.fetchall():
+            if created:
+                logger.debug('New vehicle %s' % vehicle_id)
+            vehicle_ids[origin_id] = vehicle_id
+        return vehicle_ids
+
+    def _insert_locations(self, cursor, records, vehicle_ids):
+        records_by_key = {}
+        for record in records:
+            records_by_key.setdefault((vehicle_ids[record.origin_id], record.timestamp), record)
+        items = list(records_by_key.items())
+
+        cursor.execute(INSERT_LOCATIONS_SQL, (
+            [timestamp for (_, timestamp), _ in items],
+            [record.coords[0] for _, record in items],
+            [record.coords[1] for _, record in items],
+            [vehicle_id for (vehicle_id, _), _ in items],
+            [record.events for _, record in items],
+        ))
+
+        return {
+            location_id: records_by_key[(vehicle_id, timestamp)]
+            for location_id, vehicle_id, timestamp in cursor.fetchall()
+        }
@@ -0,0 +1,170 @@
+"""
+Capture of raw feed payloads.
+
+When a capture directory is configured, every payload fetched by an importer is appended to gzip compressed segment
+files of its data source, one JSON record with the fetch timestamp and the raw content per line. Segments are rotated
+by size and age and named after the time they were started, so they sort chronologically. Writing is done in a
+background thread, a full queue drops payloads instead of blocking the import.
+
+Captured payloads can be replayed through an importer with the replay_payloads management command.
+"""
+import atexit
+import gzip
+import json
+import logging
+import os
+import queue
+import threading
+from datetime import datetime
+
+import pytz
+from django.conf import settings
+
+from vehicles.constants import CAPTURE_DIRECTORY_SETTING
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_SUFFIX = '.jsonl.gz'
+SEGMENT_NAME_FORMAT = '%Y%m%dT%H%M%S%fZ'
+FETCHED_AT_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
+SEGMENT_SIZE = 64 * 1024 * 1024  # uncompressed, in bytes
+SEGMENT_DURATION = 60 * 60  # in seconds
+QUEUE_SIZE = 1000
+
+
+def get_payload_capture(data_source_id):
+    """
+    Return a PayloadCapture for the data source, or None if capture isn't configured.
+    """
+    directory = getattr(settings, CAPTURE_DIRECTORY_SETTING, None)
+    if not directory:
+        return None
+    return PayloadCapture(os.path.join(directory, data_source_id))
+
+
+class PayloadCapture:
+    """
+    Append-only segment files of a data source's payloads, written by a background thread.
+
+    The thread is started on the first write, so instantiating this is cheap.
+    """
+
+    def __init__(self, directory, segment_size=SEGMENT_SIZE, segment_duration=SEGMENT_DURATION):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.segment_duration = segment_duration
+        self.queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._segment = None
+        self._segment_started = None
+        self._segment_bytes = 0
+
+    def write(self, content, fetched_at=None):
+        """
+        Queue raw content of a fetched payload to be written.
+        """
+        self._ensure_thread()
+        try:
+            self.queue.put_nowait((fetched_at or datetime.now(pytz.utc), content))
+        except queue.Full:
+            logger.warning('Payload capture queue of %s is full, dropping a payload' % self.directory)
+
+    def close(self):
+        """
+        Write the queued payloads and close the current segment.
+        """
+        with self._lock:
+            if not self._thread:
+                return
+            self.queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread:
+                return
+            self._thread = threading.Thread(target=self._run, name='payload-capture', daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            try:
+                self._write_record(*item)
+                if self.queue.empty():
+                    # make everything written so far readable even if the segment is never closed properly
+                    self._segment.flush()
+            except OSError as e:
+                logger.error('Cannot write captured payload to %s: %s' % (self.directory, e))
+                self._close_segment()
+
+        self._close_segment()
+
+    def _write_record(self, fetched_at, content):
+        if self._segment and (
+            self._segment_bytes >= self.segment_size or
+            (fetched_at - self._segment_started).total_seconds() >= self.segment_duration
+        ):
+            self._close_segment()
+        if not self._segment:
+            self._open_segment(fetched_at)
+
+        record = {'fetched_at': fetched_at.astimezone(pytz.utc).strftime(FETCHED_AT_FORMAT), 'content': content}
+        line = (json.dumps(record) + '\n').encode('utf-8')
+        self._segment.write(line)
+        self._segment_bytes += len(line)
+
+    def _open_segment(self, started):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, started.astimezone(pytz.utc).strftime(SEGMENT_NAME_FORMAT) + SEGMENT_SUFFIX)
+        self._segment = gzip.open(path, 'ab')
+        self._segment_started = started
+        self._segment_bytes = 0
+
+    def _close_segment(self):
+        if self._segment:
+            try:
+                self._segment.close()
+            except OSError as e:
+                logger.error('Cannot close payload capture segment in %s: %s' % (self.directory, e))
+            self._segment = None
+
+
+def get_segment_paths(paths):
+    """
+    Return segment file paths of the given files and directories in chronological order.
+    """
+    segment_paths = []
+    for path in paths:
+        if os.path.isdir(path):
+            segment_paths.extend(
+                os.path.join(path, name) for name in os.listdir(path) if name.endswith(SEGMENT_SUFFIX)
+            )
+        else:
+            segment_paths.append(path)
+    return sorted(segment_paths, key=os.path.basename)
+
+
+def read_captured_payloads(paths, since=None, until=None):
+    """
+    Yield (fetched_at, content) tuples of the given segment files and directories in chronological order.
+
+    Payloads can be limited to the ones fetched at or after since and before until. Segments which were not closed
+    properly are read as far as they were written.
+    """
+    for path in get_segment_paths(paths):
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            try:
+                for line in f:
+                    record = json.loads(line)
+                    fetched_at = pytz.utc.localize(datetime.strptime(record['fetched_at'], FETCHED_AT_FORMAT))
+                    if (since and fetched_at < since) or (until and fetched_at >= until):
+                        continue
+                    yield fetched_at, record['content']
+            except (EOFError, ValueError):
+                logger.warning('Segment %s ends unexpectedly' % path)
@@ -0,0 +1,95 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import close_old_connections
+
+from vehicles.partitions import manage_location_partitions
+from vehicles.publication import publish_due_locations
+
+logger = logging.getLogger(__name__)
+
+
+def _run_in_db_thread(func, *args):
+    try:
+        return func(*args)
+    finally:
+        close_old_connections()
+
+
+class IngestDaemon:
+    """
+    Run importers and publication of due locations from a single asyncio event loop.
+
+    Every importer runs at its own interval independently of the others. Fetches are done concurrently in a fetch
+    thread pool and database writes in a bounded pool of DB threads. A single importer never has more than one run
+    going on, so a slow upstream only delays its own data source.
+    """
+
+    def __init__(self, importers, db_workers=2, publication_interval=5.0, partition_interval=60 * 60, loop=None):
+        self.importers = importers
+        self.publication_interval = publication_interval
+        self.partition_interval = partition_interval
+        self.loop = loop or asyncio.get_event_loop()
+        self.fetch_executor = ThreadPoolExecutor(max_workers=max(len(importers), 1))
+        self.db_executor = ThreadPoolExecutor(max_workers=db_workers)
+        self._future = None
+
+    def run_forever(self):
+        coroutines = [self._run_periodically(importer.id, importer.run_interval, self._run_importer, importer)
+                      for importer in self.importers]
+        if self.publication_interval:
+            coroutines.append(self._run_periodically('publication', self.publication_interval, self._publish))
+        if self.partition_interval:
+            coroutines.append(
+                self._run_periodically('partition management', self.partition_interval, self._manage_partitions)
+            )
+
+        self._future = asyncio.gather(*[self.loop.create_task(coroutine) for coroutine in coroutines])
+        try:
+            self.loop.run_until_complete(self._future)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.fetch_executor.shutdown(wait=True)
+            self.db_executor.shutdown(wait=True)
+
+    def stop(self):
+        if self._future:
+            self._future.cancel()
+
+    async def _run_periodically(self, name, interval, func, *args):
+        next_run = self.loop.time()
+
+        while True:
+            started = self.loop.time()
+            try:
+                await func(*args)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('Error in %s' % name)
+
+            elapsed = self.loop.time() - started
+            next_run += interval
+            if next_run < self.loop.time():
+                logger.warning('%s took %.2f s which is longer than its interval %.2f s' % (name, elapsed, interval))
+                next_run = self.loop.time()
+
+            await asyncio.sleep(next_run - self.loop.time())
+
+    async def _run_importer(self, importer):
+        vehicle_data = await self.loop.run_in_executor(self.fetch_executor, importer.fetch_data)
+        if vehicle_data is None:
+            logger.debug('No changes from %s' % importer.id)
+            return
+
+        await self.loop.run_in_executor(self.db_executor, _run_in_db_thread, importer.import_data, vehicle_data)
+
+    async def _publish(self):
+        vehicle_ids = await self.loop.run_in_executor(self.db_executor, _run_in_db_thread, publish_due_locations)
+        if vehicle_ids:
+            logger.info('Published new locations for %d vehicles' % len(vehicle_ids))
+
+    async def _manage_partitions(self):
+        await self.loop.run_in_executor(self.db_executor, _run_in_db_thread, manage_location_partitions)
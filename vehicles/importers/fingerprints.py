@@ -0,0 +1,67 @@
+import logging
+
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
+
+
+def get_fingerprint(record):
+    return '%r %r %r' % (record.timestamp.timestamp(), record.coords[0], record.coords[1])
+
+
+class FingerprintCache:
+    """
+    Fingerprints of the latest ingested location of every vehicle of a data source.
+
+    Fingerprints are kept in process memory and, if a Redis connection is given, also in a Redis hash so that they
+    survive worker restarts. Redis errors are logged and otherwise ignored, the cache is only an optimization.
+    """
+
+    def __init__(self, data_source_id, redis=None):
+        self.key = 'streetmaintenance:fingerprints:%s' % data_source_id
+        self.redis = redis
+        self._fingerprints = {}
+
+    def filter_changed(self, records):
+        """
+        Return the records which differ from the already ingested ones.
+        """
+        self._load_missing({record.origin_id for record in records if record.origin_id not in self._fingerprints})
+        return [record for record in records if self._fingerprints.get(record.origin_id) != get_fingerprint(record)]
+
+    def update(self, records):
+        fingerprints = {record.origin_id: get_fingerprint(record) for record in records}
+        if not fingerprints:
+            return
+
+        self._fingerprints.update(fingerprints)
+
+        if self.redis:
+            try:
+                self.redis.hmset(self.key, fingerprints)
+            except RedisError as e:
+                logger.warning('Cannot store fingerprints to Redis: %s' % e)
+
+    def clear(self):
+        self._fingerprints = {}
+
+        if self.redis:
+            try:
+                self.redis.delete(self.key)
+            except RedisError as e:
+                logger.warning('Cannot clear fingerprints from Redis: %s' % e)
+
+    def _load_missing(self, origin_ids):
+        if not (origin_ids and self.redis):
+            return
+
+        origin_ids = list(origin_ids)
+        try:
+            values = self.redis.hmget(self.key, origin_ids)
+        except RedisError as e:
+            logger.warning('Cannot fetch fingerprints from Redis: %s' % e)
+            return
+
+        for origin_id, value in zip(origin_ids, values):
+            if value is not None:
+                self._fingerprints[origin_id] = value.decode('utf-8')
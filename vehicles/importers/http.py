@@ -0,0 +1,80 @@
+import logging
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+VALIDATOR_HEADERS = (
+    # (response header, conditional request header)
+    ('ETag', 'If-None-Match'),
+    ('Last-Modified', 'If-Modified-Since'),
+)
+
+
+class FeedSession:
+    """
+    A long-lived HTTP session for fetching an upstream feed.
+
+    Connections are kept alive and pooled, compressed transfers are negotiated and responses' ETag and Last-Modified
+    headers are used for conditional requests so that unchanged content isn't transferred again.
+
+    Validators of a response are taken into use only after confirm() has been called, which should be done after
+    the content has been processed successfully. Otherwise a failed import would never be retried.
+    """
+
+    def __init__(self, timeout, pool_size=2, capture=None):
+        self.timeout = timeout
+        self.capture = capture
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({
+            'Accept': 'application/json',
+            'Accept-Encoding': 'gzip, deflate',
+            'Connection': 'keep-alive',
+        })
+        self._validators = {}
+        self._new_validators = {}
+
+    def get_json(self, url):
+        """
+        Fetch and decode JSON content from the given URL.
+
+        Returns None if the content hasn't changed since the last confirmed fetch.
+        """
+        response = self.session.get(url, headers=self._get_conditional_headers(url), timeout=self.timeout)
+
+        if response.status_code == 304:
+            logger.debug('%s not modified' % url)
+            return None
+
+        response.raise_for_status()
+
+        if self.capture:
+            self.capture.write(response.text)
+
+        self._new_validators[url] = {
+            request_header: response.headers[response_header]
+            for response_header, request_header in VALIDATOR_HEADERS if response.headers.get(response_header)
+        }
+
+        return response.json()
+
+    def confirm(self):
+        """
+        Use validators of the fetched responses in the following requests.
+        """
+        self._validators.update(self._new_validators)
+        self._new_validators = {}
+
+    def reset(self):
+        self._validators = {}
+        self._new_validators = {}
+
+    def close(self):
+        self.session.close()
+
+    def _get_conditional_headers(self, url):
+        return self._validators.get(url, {})
@@ -1,15 +1,12 @@
 import logging
 from datetime import datetime
 
-import requests
-from django.conf import ImproperlyConfigured, settings
-from django.db import transaction
+from django.conf import ImproperlyConfigured
 from django.utils import timezone
 
-from vehicles.constants import IGNORE_LOCATIONS_WITHOUT_EVENTS_SETTING
-from vehicles.models import EventType, Location, Vehicle
+from vehicles.events import EVENT_BITS
 
-from .base import BaseVehicleImporter
+from .base import BaseVehicleImporter, LocationRecord
 
 logger = logging.getLogger(__name__)
 
@@ -65,74 +62,33 @@ class KuntoTurkuImporter(BaseVehicleImporter):
         if not self.url:
             raise ImproperlyConfigured('"URL" is required.')
 
-        self.event_mapping = {
-            key: EventType.objects.get(identifier=value)
-            for key, value in EVENT_MAPPING.items() if value
-        }
+        self.event_mapping = {key: EVENT_BITS[value] for key, value in EVENT_MAPPING.items() if value}
 
     def fetch_data(self):
         logger.debug('Fetching data from %s' % self.url)
-        response = requests.get(self.url, timeout=self.run_interval / 2.0)
-        response.raise_for_status()
-        return response.json()
-
-    def update_models(self, vehicle_data):
-        logger.debug('Updating models')
-        num_of_new_locations = 0
-        num_of_ignored_locations = 0
-        ignore_locations_without_events = getattr(settings, IGNORE_LOCATIONS_WITHOUT_EVENTS_SETTING, True)
+        return self.http.get_json(self.url)
 
+    def get_location_records(self, vehicle_data):
         for vehicle_datum in vehicle_data:
             location_datum = vehicle_datum['last_location']
 
-            events = []
+            events = 0
 
             for original_event in location_datum['events']:
                 event = self.event_mapping.get(original_event)
                 if event:
-                    events.append(event)
+                    events |= event
                 else:
                     logger.debug('Unknown event %s' % original_event)
 
-            if not events and ignore_locations_without_events:
-                num_of_ignored_locations += 1
-                continue
-
             timestamp = timezone.make_aware(datetime.strptime(location_datum['timestamp'], '%Y-%m-%d %H:%M:%S'))
 
-            vehicle, created = Vehicle.objects.get_or_create(
-                data_source=self.data_source,
-                origin_id=vehicle_datum['id'],
-            )
+            # coords are in form "(x y)"
+            x, y = location_datum['coords'].strip('()').split()
 
-            if created:
-                logger.debug('New vehicle %s' % vehicle)
-
-            location, created = Location.objects.get_or_create(
-                vehicle=vehicle,
+            yield LocationRecord(
+                origin_id=str(vehicle_datum['id']),
                 timestamp=timestamp,
-                defaults=dict(
-                    coords='POINT %s' % location_datum['coords'],
-                )
-            )
-
-            if created:
-                location.events = events
-                num_of_new_locations += 1
-
-        num_of_locations = len(vehicle_data)
-
-        if num_of_new_locations:
-            logger.info(
-                'Number of new locations %d (total %s ignored %s)' %
-                (num_of_new_locations, num_of_locations, num_of_ignored_locations)
+                coords=(float(x), float(y)),
+                events=events,
             )
-        else:
-            ignored_msg = ' (%d ignored)' % num_of_ignored_locations if num_of_ignored_locations else ''
-            logger.info('No locations' + ignored_msg)
-
-    def run(self):
-        vehicle_data = self.fetch_data()
-
-        with transaction.atomic():
-            self.update_models(vehicle_data)
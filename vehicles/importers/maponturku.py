@@ -1,20 +1,12 @@
 import logging
-import pytz
-from datetime import datetime
-
-import requests
-from django.conf import ImproperlyConfigured, settings
-from django.db import transaction
-from django.utils import timezone
-from datetime import timedelta
+from datetime import datetime, timedelta
 
-import time
-import datetime as dt
+import pytz
+from django.conf import ImproperlyConfigured
 
-from vehicles.constants import IGNORE_LOCATIONS_WITHOUT_EVENTS_SETTING
-from vehicles.models import EventType, Location, Vehicle
+from vehicles.events import EVENT_BITS
 
-from .base import BaseVehicleImporter
+from .base import BaseVehicleImporter, LocationRecord
 
 logger = logging.getLogger(__name__)
 
@@ -41,80 +33,36 @@ class MaponImporter(BaseVehicleImporter):
         if not self.url:
             raise ImproperlyConfigured('"URL" is required.')
 
-        self.event_mapping = {
-            key: EventType.objects.get(identifier=value)
-            for key, value in EVENT_MAPPING.items() if value
-        }
+        self.event_mapping = {key: EVENT_BITS[value] for key, value in EVENT_MAPPING.items() if value}
 
     def fetch_data(self):
         logger.debug('Fetching data from %s' % self.url)
-        response = requests.get(self.url, timeout=self.run_interval / 2.0)
-        response.raise_for_status()
-        return response.json()
+        return self.http.get_json(self.url)
 
-    def update_models(self, vehicle_data):
-        logger.debug('Updating models')
-        num_of_new_locations = 0
-        num_of_ignored_locations = 0
-        ignore_locations_without_events = getattr(settings, IGNORE_LOCATIONS_WITHOUT_EVENTS_SETTING, True)
+    def get_location_records(self, vehicle_data):
+        return self._get_location_records(vehicle_data, updated_after=datetime.utcnow() - timedelta(minutes=1))
 
-        now = dt.datetime.utcnow()
-        updated_after = now - timedelta(minutes=1)
+    def get_archived_location_records(self, vehicle_data):
+        return self._get_location_records(vehicle_data)
 
+    def _get_location_records(self, vehicle_data, updated_after=None):
         for vehicle_datum in vehicle_data['data']['units']:
-            datet = datetime.strptime(vehicle_datum['last_update'], "%Y-%m-%dT%H:%M:%SZ")
-            if updated_after < datet:
-                events = []
-                for state in vehicle_datum.get('io_din',[]):
-                    if state['state']==1:
-                        event = self.event_mapping.get(str(state['label']))
-                        if event:
-                            events.append(event)
-                        else:
-                            logger.debug('Unknown event %s' % state['label'])
-
-                if not events and ignore_locations_without_events:
-                    num_of_ignored_locations += 1
-                    continue
-
-                vehicle, created = Vehicle.objects.get_or_create(
-                    data_source=self.data_source,
-                    origin_id=vehicle_datum['unit_id'],
-                )
-
-                if created:
-                    logger.debug('New vehicle_datum %s' % vehicle)
-                    
-                utc = pytz.utc
-                
-                ts = datet
-                ts = datet.replace(tzinfo=pytz.UTC)
-
-                location, created = Location.objects.get_or_create(
-                    vehicle=vehicle,
-                    timestamp=ts,
-                    defaults=dict(
-                        coords='POINT ('+str(vehicle_datum['lng'])+' '+str(vehicle_datum['lat'])+')' 
-                    )
-                )
-
-                if created:
-                    location.events = events
-                    num_of_new_locations += 1
-
-        num_of_locations = len(vehicle_data['data']['units'])
-
-        if num_of_new_locations:
-            logger.info(
-                'Number of new locations %d (total %s ignored %s)' %
-                (num_of_new_locations, num_of_locations, num_of_ignored_locations)
+            last_update = datetime.strptime(vehicle_datum['last_update'], '%Y-%m-%dT%H:%M:%SZ')
+            if updated_after and last_update <= updated_after:
+                continue
+
+            events = 0
+            for state in vehicle_datum.get('io_din', []):
+                if state['state'] == 1:
+                    event = self.event_mapping.get(str(state['label']))
+                    if event:
+                        events |= event
+                    else:
+                        logger.debug('Unknown event %s' % state['label'])
+
+            yield LocationRecord(
+                origin_id=str(vehicle_datum['unit_id']),
+                timestamp=last_update.replace(tzinfo=pytz.UTC),
+                coords=(float(vehicle_datum['lng']), float(vehicle_datum['lat'])),
+                events=events,
             )
-        else:
-            ignored_msg = ' (%d ignored)' % num_of_ignored_locations if num_of_ignored_locations else ''
-            logger.info('No locations' + ignored_msg)
-
-    def run(self):
-        vehicle_data = self.fetch_data()
-
-        with transaction.atomic():
-            self.update_models(vehicle_data)
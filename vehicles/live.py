@@ -0,0 +1,222 @@
+"""
+Live push of published locations over Server-Sent Events.
+
+Whenever publication changes vehicles' last locations, the changed vehicles are rendered once like in the list
+endpoint and published to a Redis channel. The live server, run with the serve_live_locations management command,
+subscribes to the channel and fans the messages out to any number of mostly idle SSE connections from a single
+asyncio event loop without touching the database.
+
+Only last locations are pushed, and those are set by publication only after STREET_MAINTENANCE_DELAY has passed, so
+the live stream never shows anything the API wouldn't.
+"""
+import asyncio
+import logging
+import threading
+import time
+from urllib.parse import urlsplit
+
+from django.db import transaction
+from redis.exceptions import RedisError
+
+from .models import VehicleState
+from .rendering import get_location_values, render_vehicle_list
+from .utils import get_redis_connection
+
+logger = logging.getLogger(__name__)
+
+LIVE_CHANNEL = 'streetmaintenance:live'
+LIVE_PATH = '/v1/vehicles/live/'
+
+KEEPALIVE_INTERVAL = 15.0  # in seconds
+REQUEST_TIMEOUT = 10.0  # in seconds
+RECONNECT_INTERVAL = 5.0  # in seconds
+# clients having more than this many bytes of unsent messages are considered dead and disconnected
+MAX_WRITE_BUFFER_SIZE = 1024 * 1024
+
+RESPONSE_HEADERS = (
+    b'HTTP/1.1 200 OK\r\n'
+    b'Content-Type: text/event-stream\r\n'
+    b'Cache-Control: no-cache\r\n'
+    b'Connection: keep-alive\r\n'
+    b'Access-Control-Allow-Origin: *\r\n'
+    b'X-Accel-Buffering: no\r\n'
+    b'\r\n'
+    b'retry: 5000\n\n'
+)
+ERROR_RESPONSE = 'HTTP/1.1 %s\r\nContent-Type: text/plain\r\nContent-Length: %d\r\nConnection: close\r\n\r\n%s'
+KEEPALIVE_MESSAGE = b': keepalive\n\n'
+
+_live_publisher = None
+
+
+class LivePublisher:
+    """
+    Publisher of changed vehicles to the live channel.
+
+    Redis errors are logged and otherwise ignored, nothing is published if Redis isn't configured.
+    """
+
+    def __init__(self, redis=None):
+        self.redis = redis
+
+    def publish(self, vehicle_ids):
+        if not self.redis:
+            return
+
+        states = VehicleState.objects.filter(vehicle__in=vehicle_ids).order_by('vehicle')
+        content = render_vehicle_list([(state.vehicle_id, get_location_values(state)) for state in states])
+        try:
+            self.redis.publish(LIVE_CHANNEL, content)
+        except RedisError as e:
+            logger.warning('Cannot publish live locations to Redis: %s' % e)
+
+
+def get_live_publisher():
+    global _live_publisher
+    if _live_publisher is None:
+        _live_publisher = LivePublisher(get_redis_connection())
+    return _live_publisher
+
+
+def publish_live_locations(sender, vehicle_ids, **kwargs):
+    if not vehicle_ids or not get_live_publisher().redis:
+        return
+    # the new last locations are visible to the query only after the commit
+    transaction.on_commit(lambda: get_live_publisher().publish(vehicle_ids))
+
+
+def format_message(data):
+    """
+    Format a published JSON array of vehicles as an SSE message.
+    """
+    return b'event: vehicles\ndata: ' + data + b'\n\n'
+
+
+class LiveLocationServer:
+    """
+    Minimal HTTP server streaming the live channel to SSE clients at LIVE_PATH.
+
+    Every message is a JSON array of vehicles whose last location has changed, in the format of the list endpoint.
+    The Redis subscription runs in a thread of its own and hands the messages over to the event loop.
+    """
+
+    def __init__(self, redis, host='0.0.0.0', port=8001, keepalive_interval=KEEPALIVE_INTERVAL, loop=None):
+        self.redis = redis
+        self.host = host
+        self.port = port
+        self.keepalive_interval = keepalive_interval
+        self.loop = loop or asyncio.get_event_loop()
+        self.clients = set()
+        self._server = None
+        self._future = None
+        self._stopped = threading.Event()
+
+    async def start(self):
+        self._server = await self.loop.create_server(
+            lambda: asyncio.StreamReaderProtocol(asyncio.StreamReader(), self._handle_client), self.host, self.port
+        )
+        return self._server.sockets[0].getsockname()[1]
+
+    def run_forever(self):
+        port = self.loop.run_until_complete(self.start())
+        logger.info('Serving live locations at %s:%d%s' % (self.host, port, LIVE_PATH))
+
+        subscriber = threading.Thread(target=self._subscribe, name='live-subscriber', daemon=True)
+        subscriber.start()
+
+        self._future = self.loop.create_task(self._send_keepalives())
+        try:
+            self.loop.run_until_complete(self._future)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._stopped.set()
+            self._server.close()
+            for writer in list(self.clients):
+                writer.close()
+            self.loop.run_until_complete(self._server.wait_closed())
+            subscriber.join()
+
+    def stop(self):
+        if self._future:
+            self._future.cancel()
+
+    def broadcast(self, message):
+        for writer in list(self.clients):
+            if writer.transport.get_write_buffer_size() > MAX_WRITE_BUFFER_SIZE:
+                logger.debug('Disconnecting a slow live client')
+                self.clients.discard(writer)
+                writer.transport.abort()
+            else:
+                writer.write(message)
+
+    async def _send_keepalives(self):
+        # keepalives keep proxies from closing idle connections and reveal dead ones
+        while True:
+            await asyncio.sleep(self.keepalive_interval)
+            self.broadcast(KEEPALIVE_MESSAGE)
+
+    def _subscribe(self):
+        while not self._stopped.is_set():
+            try:
+                pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(LIVE_CHANNEL)
+                while not self._stopped.is_set():
+                    message = pubsub.get_message(timeout=1.0)
+                    if message and message['type'] == 'message':
+                        self.loop.call_soon_threadsafe(self.broadcast, format_message(message['data']))
+                pubsub.close()
+            except RedisError as e:
+                logger.warning('Live location subscription failed, reconnecting: %s' % e)
+                time.sleep(RECONNECT_INTERVAL)
+
+    async def _handle_client(self, reader, writer):
+        try:
+            path = await asyncio.wait_for(self._read_request(reader), REQUEST_TIMEOUT)
+        except (asyncio.TimeoutError, ValueError, ConnectionError):
+            writer.close()
+            return
+
+        if path is None:
+            self._write_error(writer, '405 Method Not Allowed')
+            return
+        if path != LIVE_PATH:
+            self._write_error(writer, '404 Not Found')
+            return
+
+        writer.write(RESPONSE_HEADERS)
+        self.clients.add(writer)
+        try:
+            # clients aren't expected to send anything more, wait until they disconnect
+            while await reader.read(1024):
+                pass
+        except ConnectionError:
+            pass
+        finally:
+            self.clients.discard(writer)
+            writer.close()
+
+    async def _read_request(self, reader):
+        """
+        Read a request's headers and return its path, or None if it isn't a GET request.
+        """
+        request_line = await reader.readline()
+        parts = request_line.decode('latin-1').split()
+        if len(parts) != 3:
+            raise ValueError('Invalid request line')
+
+        while True:
+            line = await reader.readline()
+            if not line:
+                raise ValueError('Incomplete request')
+            if line in (b'\r\n', b'\n'):
+                break
+
+        method, target, version = parts
+        if method != 'GET':
+            return None
+        return urlsplit(target).path
+
+    def _write_error(self, writer, status):
+        writer.write((ERROR_RESPONSE % (status, len(status), status)).encode('latin-1'))
+        writer.close()
@@ -0,0 +1,59 @@
+import math
+
+from django.contrib.gis.db import models
+from django.db.models import Lookup
+
+# lower bound for the length of a degree of latitude, so that the bounding box is never too small
+METERS_PER_DEGREE = 110574.0
+
+
+def get_bbox_around(point, radius):
+    """
+    Return (xmin, ymin, xmax, ymax) of a WGS84 bounding box containing every point within radius meters of point.
+    """
+    lat_delta = radius / METERS_PER_DEGREE
+    max_lat = min(abs(point.y) + lat_delta, 89.9)
+    lon_delta = min(radius / (METERS_PER_DEGREE * math.cos(math.radians(max_lat))), 180.0)
+    return point.x - lon_delta, point.y - lat_delta, point.x + lon_delta, point.y + lat_delta
+
+
+@models.PointField.register_lookup
+class WithinDistance(Lookup):
+    """
+    Filter WGS84 points within the given distance in meters, for example coords__within_distance=(point, 500).
+
+    The bounding box comparison lets the spatial index be used, the exact distance is calculated on the spheroid
+    only for the points inside the bounding box.
+    """
+    lookup_name = 'within_distance'
+    prepare_rhs = False
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        point, radius = self.rhs
+        sql = (
+            '({lhs} && ST_MakeEnvelope(%s, %s, %s, %s, 4326) AND '
+            'ST_DWithin({lhs}::geography, ST_SetSRID(ST_MakePoint(%s, %s), 4326)::geography, %s))'
+        ).format(lhs=lhs)
+        params = lhs_params + list(get_bbox_around(point, radius)) + lhs_params + [point.x, point.y, radius]
+        return sql, params
+
+
+@models.IntegerField.register_lookup
+class HasAnyBit(Lookup):
+    """
+    Filter bitmasks having any of the bits of the given mask set, for example event_mask__has_any_bit=6.
+
+    Every bit is tested separately with a literal, so that partial indexes with a "(column & bit) <> 0" predicate can
+    be used.
+    """
+    lookup_name = 'has_any_bit'
+    prepare_rhs = False
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        bits = [1 << index for index in range(self.rhs.bit_length()) if self.rhs & (1 << index)]
+        if not bits:
+            return 'FALSE', []
+        sql = ' OR '.join('(%s & %d) <> 0' % (lhs, bit) for bit in bits)
+        return '(%s)' % sql, lhs_params * len(bits)
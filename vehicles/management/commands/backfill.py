@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from vehicles.importers import get_importer_by_id, get_importers
+from vehicles.importers.backfill import BackfillLoader, read_payloads
+
+
+class Command(BaseCommand):
+    help = 'Load archived payloads of an importer from JSON lines files, optionally gzipped.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('importer', help='ID of the importer whose format the payloads are in')
+        parser.add_argument('paths', nargs='+', metavar='path', help='JSON lines file with one payload per line')
+        parser.add_argument(
+            '--batch-size', type=int, default=100000,
+            help='Number of locations loaded in a single transaction (default 100000)',
+        )
+
+    def handle(self, *args, **options):
+        importer = get_importer_by_id(options['importer'])
+        if not importer:
+            raise CommandError('Unknown importer "%s", available importers: %s' % (
+                options['importer'], ', '.join(importer.id for importer in get_importers()) or 'none'
+            ))
+
+        loader = BackfillLoader(importer, batch_size=options['batch_size'])
+        vehicle_ids = loader.load(payload for path in options['paths'] for payload in read_payloads(path))
+
+        self.stdout.write('Loaded %(locations)d locations, %(new_locations)d new, %(ignored_locations)d ignored' %
+                          loader.stats)
+        self.stdout.write('Published new last locations for %d vehicles' % len(vehicle_ids))
@@ -0,0 +1,42 @@
+import logging
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from vehicles.constants import PUBLICATION_INTERVAL_SETTING
+from vehicles.importers import get_importers
+from vehicles.importers.daemon import IngestDaemon
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Run all registered importers and publication of delayed locations in a single process.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--db-workers', type=int, default=2,
+            help='Maximum number of concurrent database writes (default 2)',
+        )
+        parser.add_argument(
+            '--no-publication', action='store_true', default=False,
+            help="Don't publish delayed locations, for example when the celery task is used for that",
+        )
+
+    def handle(self, *args, **options):
+        importers = get_importers()
+        if not importers:
+            raise CommandError('No importers configured.')
+
+        publication_interval = None
+        if not options['no_publication']:
+            publication_interval = getattr(settings, PUBLICATION_INTERVAL_SETTING, 5.0)
+
+        daemon = IngestDaemon(importers, db_workers=options['db_workers'], publication_interval=publication_interval)
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            daemon.loop.add_signal_handler(signum, daemon.stop)
+
+        logger.info('Starting ingest, importers %s' % ', '.join(importer.id for importer in importers))
+        daemon.run_forever()
+        logger.info('Ingest stopped')
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from vehicles.partitions import drop_expired_location_partitions, ensure_location_partitions
+
+
+class Command(BaseCommand):
+    help = (
+        'Create upcoming monthly location partitions and drop the ones older than the retention period. Expired '
+        'locations outside the monthly partitions are deleted from the default partition.'
+    )
+
+    def handle(self, *args, **options):
+        for partition in ensure_location_partitions():
+            self.stdout.write('Created %s' % partition)
+        for partition in drop_expired_location_partitions():
+            self.stdout.write('Dropped %s' % partition)
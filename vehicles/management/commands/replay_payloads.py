@@ -0,0 +1,50 @@
+import json
+import time
+
+import dateutil.parser
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from vehicles.importers import get_importer_by_id, get_importers
+from vehicles.importers.capture import read_captured_payloads
+from vehicles.importers.fingerprints import FingerprintCache
+
+
+def parse_datetime(value):
+    try:
+        value = dateutil.parser.parse(value)
+    except ValueError:
+        raise CommandError('Invalid timestamp "%s".' % value)
+    # local timezone is assumed if no timezone is given
+    return value if value.tzinfo else timezone.make_aware(value)
+
+
+class Command(BaseCommand):
+    help = 'Replay captured payloads through an importer as fast as possible.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('importer', help='ID of the importer to replay the payloads through')
+        parser.add_argument('paths', nargs='+', metavar='path', help='Segment file or a directory of segment files')
+        parser.add_argument('--since', type=parse_datetime, help='Replay only payloads fetched at or after this')
+        parser.add_argument('--until', type=parse_datetime, help='Replay only payloads fetched before this')
+
+    def handle(self, *args, **options):
+        importer = get_importer_by_id(options['importer'])
+        if not importer:
+            raise CommandError('Unknown importer "%s", available importers: %s' % (
+                options['importer'], ', '.join(importer.id for importer in get_importers()) or 'none'
+            ))
+
+        # start from empty fingerprints like a new process would, without touching the shared ones
+        importer.fingerprints = FingerprintCache(importer.id)
+
+        count = 0
+        started = time.perf_counter()
+        for fetched_at, content in read_captured_payloads(options['paths'], options['since'], options['until']):
+            if options['verbosity'] > 1:
+                self.stdout.write('Replaying payload fetched at %s' % fetched_at.isoformat())
+            importer.replay_data(json.loads(content))
+            count += 1
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write('Replayed %d payloads in %.1f s' % (count, elapsed))
@@ -0,0 +1,29 @@
+import logging
+import signal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from vehicles.live import LiveLocationServer
+from vehicles.utils import get_redis_connection
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Serve newly published locations to Server-Sent Events clients.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='0.0.0.0', help='Address to listen on (default 0.0.0.0)')
+        parser.add_argument('--port', type=int, default=8001, help='Port to listen on (default 8001)')
+
+    def handle(self, *args, **options):
+        redis = get_redis_connection()
+        if not redis:
+            raise CommandError('Live locations need Redis, STREET_MAINTENANCE_REDIS_URL is not configured.')
+
+        server = LiveLocationServer(redis, host=options['host'], port=options['port'])
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            server.loop.add_signal_handler(signum, server.stop)
+
+        server.run_forever()
+        logger.info('Live location server stopped')
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vehicles', '0004_remove_location_is_latest'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingLocation',
+            fields=[
+                ('location', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='pending', serialize=False, to='vehicles.Location', verbose_name='location')),
+                ('timestamp', models.DateTimeField(db_index=True, verbose_name='timestamp')),
+                ('vehicle', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pending_locations', to='vehicles.Vehicle', verbose_name='vehicle')),
+            ],
+            options={
+                'verbose_name': 'pending location',
+                'verbose_name_plural': 'pending locations',
+                'ordering': ('timestamp',),
+            },
+        ),
+        # queue all locations newer than the current last locations, due ones will be published on the next run
+        migrations.RunSQL(
+            ['''
+            INSERT INTO vehicles_pendinglocation (location_id, vehicle_id, timestamp)
+            SELECT location.id, location.vehicle_id, location.timestamp
+            FROM vehicles_location AS location
+            JOIN vehicles_vehicle AS vehicle ON vehicle.id = location.vehicle_id
+            LEFT JOIN vehicles_location AS last_location ON last_location.id = vehicle.last_location_id
+            WHERE last_location.id IS NULL OR location.timestamp > last_location.timestamp
+            '''],
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Requires PostgreSQL 11 or newer.
+#
+# Unique constraints of a partitioned table must contain the partition key, so there can't be a unique constraint
+# on location ID alone, and therefore no foreign key constraints referencing locations either. Those are dropped
+# first, the related fields have db_constraint=False.
+PARTITION_LOCATION_SQL = '''
+DO $$
+DECLARE
+    constraint_row record;
+BEGIN
+    FOR constraint_row IN
+        SELECT conrelid::regclass AS table_name, conname FROM pg_constraint
+        WHERE confrelid = 'vehicles_location'::regclass AND contype = 'f'
+    LOOP
+        EXECUTE format('ALTER TABLE %s DROP CONSTRAINT %I', constraint_row.table_name, constraint_row.conname);
+    END LOOP;
+END $$;
+
+ALTER SEQUENCE vehicles_location_id_seq OWNED BY NONE;
+ALTER TABLE vehicles_location RENAME TO vehicles_location_old;
+
+CREATE TABLE vehicles_location (
+    id integer NOT NULL DEFAULT nextval('vehicles_location_id_seq'),
+    timestamp timestamp with time zone NOT NULL,
+    coords geometry(Point, 4326) NOT NULL,
+    vehicle_id integer NOT NULL
+) PARTITION BY RANGE (timestamp);
+
+CREATE TABLE vehicles_location_default PARTITION OF vehicles_location DEFAULT;
+
+-- monthly partitions from the oldest location to three months ahead, in UTC
+DO $$
+DECLARE
+    month_start timestamp;
+BEGIN
+    FOR month_start IN
+        SELECT generate_series(
+            date_trunc('month', coalesce((SELECT min(timestamp) FROM vehicles_location_old), now()) AT TIME ZONE 'UTC'),
+            date_trunc('month', now() AT TIME ZONE 'UTC') + interval '3 months',
+            interval '1 month'
+        )
+    LOOP
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF vehicles_location FOR VALUES FROM (%L) TO (%L)',
+            'vehicles_location_' || to_char(month_start, '"y"YYYY"m"MM'),
+            month_start || '+00',
+            (month_start + interval '1 month') || '+00'
+        );
+    END LOOP;
+END $$;
+
+INSERT INTO vehicles_location (id, timestamp, coords, vehicle_id)
+SELECT id, timestamp, coords, vehicle_id FROM vehicles_location_old;
+
+-- the old table goes first so that its constraint and index names can be reused
+DROP TABLE vehicles_location_old;
+
+ALTER SEQUENCE vehicles_location_id_seq OWNED BY vehicles_location.id;
+
+ALTER TABLE vehicles_location ADD CONSTRAINT vehicles_location_pkey PRIMARY KEY (id, timestamp);
+ALTER TABLE vehicles_location ADD CONSTRAINT vehicles_location_timestamp_vehicle_id_uniq UNIQUE (timestamp, vehicle_id);
+ALTER TABLE vehicles_location ADD CONSTRAINT vehicles_location_vehicle_id_fk_vehicles_vehicle_id
+    FOREIGN KEY (vehicle_id) REFERENCES vehicles_vehicle (id) DEFERRABLE INITIALLY DEFERRED;
+
+CREATE INDEX vehicles_location_timestamp_idx ON vehicles_location (timestamp);
+CREATE INDEX vehicles_location_vehicle_id_idx ON vehicles_location (vehicle_id);
+CREATE INDEX vehicles_location_coords_id ON vehicles_location USING GIST (coords);
+'''
+
+# Copies the locations back into a plain table and restores the foreign key constraints referencing them, including
+# the one of the events table recreated when 0007 was unapplied.
+UNPARTITION_LOCATION_SQL = '''
+ALTER SEQUENCE vehicles_location_id_seq OWNED BY NONE;
+ALTER TABLE vehicles_location RENAME TO vehicles_location_partitioned;
+
+CREATE TABLE vehicles_location (
+    id integer NOT NULL DEFAULT nextval('vehicles_location_id_seq'),
+    timestamp timestamp with time zone NOT NULL,
+    coords geometry(Point, 4326) NOT NULL,
+    vehicle_id integer NOT NULL
+);
+
+INSERT INTO vehicles_location (id, timestamp, coords, vehicle_id)
+SELECT id, timestamp, coords, vehicle_id FROM vehicles_location_partitioned;
+
+-- drops the partitions too
+DROP TABLE vehicles_location_partitioned;
+
+ALTER SEQUENCE vehicles_location_id_seq OWNED BY vehicles_location.id;
+
+ALTER TABLE vehicles_location ADD CONSTRAINT vehicles_location_pkey PRIMARY KEY (id);
+ALTER TABLE vehicles_location ADD CONSTRAINT vehicles_location_timestamp_vehicle_id_uniq UNIQUE (timestamp, vehicle_id);
+ALTER TABLE vehicles_location ADD CONSTRAINT vehicles_location_vehicle_id_fk_vehicles_vehicle_id
+    FOREIGN KEY (vehicle_id) REFERENCES vehicles_vehicle (id) DEFERRABLE INITIALLY DEFERRED;
+
+CREATE INDEX vehicles_location_timestamp_idx ON vehicles_location (timestamp);
+CREATE INDEX vehicles_location_vehicle_id_idx ON vehicles_location (vehicle_id);
+CREATE INDEX vehicles_location_coords_id ON vehicles_location USING GIST (coords);
+
+ALTER TABLE vehicles_vehicle ADD CONSTRAINT vehicles_vehicle_last_location_id_fk_vehicles_location_id
+    FOREIGN KEY (last_location_id) REFERENCES vehicles_location (id) DEFERRABLE INITIALLY DEFERRED;
+ALTER TABLE vehicles_pendinglocation ADD CONSTRAINT vehicles_pendinglocation_location_id_fk_vehicles_location_id
+    FOREIGN KEY (location_id) REFERENCES vehicles_location (id) DEFERRABLE INITIALLY DEFERRED;
+ALTER TABLE vehicles_location_events ADD CONSTRAINT vehicles_location_events_location_id_fk_vehicles_location_id
+    FOREIGN KEY (location_id) REFERENCES vehicles_location (id) DEFERRABLE INITIALLY DEFERRED;
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vehicles', '0005_pendinglocation'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL([PARTITION_LOCATION_SQL], [UNPARTITION_LOCATION_SQL]),
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name='vehicle',
+                    name='last_location',
+                    field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='last_location_vehicle', to='vehicles.Location', verbose_name='last_location'),
+                ),
+                migrations.AlterField(
+                    model_name='pendinglocation',
+                    name='location',
+                    field=models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='pending', serialize=False, to='vehicles.Location', verbose_name='location'),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+# event bits as they are defined in vehicles.events at the time of writing this migration
+EVENT_BITS_SQL = '''
+(VALUES
+    ('kv', 1), ('au', 2), ('su', 4), ('hi', 8), ('nt', 16), ('ln', 32), ('hs', 64), ('pe', 128), ('ps', 256),
+    ('hn', 512), ('hj', 1024), ('pn', 2048), ('ha', 4096)
+) AS bits (identifier, bit)
+'''
+
+BACKFILL_EVENT_MASK_SQL = '''
+UPDATE vehicles_location AS location SET event_mask = masks.event_mask
+FROM (
+    SELECT through.location_id, bit_or(bits.bit) AS event_mask
+    FROM vehicles_location_events AS through
+    JOIN vehicles_eventtype AS event_type ON event_type.id = through.eventtype_id
+    JOIN ''' + EVENT_BITS_SQL + ''' ON bits.identifier = event_type.identifier
+    GROUP BY through.location_id
+) AS masks
+WHERE location.id = masks.location_id
+'''
+
+RESTORE_EVENTS_SQL = '''
+INSERT INTO vehicles_location_events (location_id, eventtype_id)
+SELECT location.id, event_type.id
+FROM vehicles_location AS location
+JOIN ''' + EVENT_BITS_SQL + ''' ON (location.event_mask & bits.bit) <> 0
+JOIN vehicles_eventtype AS event_type ON event_type.identifier = bits.identifier
+'''
+
+# Locations are partitioned, so a foreign key constraint can't reference them and the events table is recreated
+# without one when this migration is unapplied. 0006 adds it back when it is unapplied in turn.
+CREATE_EVENTS_TABLE_SQL = '''
+CREATE TABLE vehicles_location_events (
+    id serial PRIMARY KEY,
+    location_id integer NOT NULL,
+    eventtype_id integer NOT NULL REFERENCES vehicles_eventtype (id) DEFERRABLE INITIALLY DEFERRED,
+    UNIQUE (location_id, eventtype_id)
+);
+CREATE INDEX vehicles_location_events_location_id_idx ON vehicles_location_events (location_id);
+CREATE INDEX vehicles_location_events_eventtype_id_idx ON vehicles_location_events (eventtype_id);
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vehicles', '0006_partition_location'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='location',
+            name='event_mask',
+            field=models.PositiveSmallIntegerField(default=0, verbose_name='event mask'),
+        ),
+        migrations.RunSQL([BACKFILL_EVENT_MASK_SQL], [RESTORE_EVENTS_SQL]),
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(['DROP TABLE vehicles_location_events'], [CREATE_EVENTS_TABLE_SQL]),
+            ],
+            state_operations=[
+                migrations.RemoveField(
+                    model_name='location',
+                    name='events',
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vehicles', '0007_location_event_mask'),
+    ]
+
+    operations = [
+        # vehicle first so that the index can be used for fetching a vehicle's locations in timestamp order
+        migrations.AlterUniqueTogether(
+            name='location',
+            unique_together=set([('vehicle', 'timestamp')]),
+        ),
+    ]
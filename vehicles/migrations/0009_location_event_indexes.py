@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+# event bits as they are defined in vehicles.events at the time of writing this migration
+EVENT_BITS = (
+    ('kv', 1), ('au', 2), ('su', 4), ('hi', 8), ('nt', 16), ('ln', 32), ('hs', 64), ('pe', 128), ('ps', 256),
+    ('hn', 512), ('hj', 1024), ('pn', 2048), ('ha', 4096)
+)
+
+# A partial index per event type, so that a location is in the indexes of its own events only. The predicates must
+# match the SQL generated by the has_any_bit lookup in vehicles.lookups to be usable.
+CREATE_INDEXES_SQL = [
+    'CREATE INDEX vehicles_location_event_{identifier} ON vehicles_location (vehicle_id, timestamp) '
+    'WHERE (event_mask & {bit}) <> 0'.format(identifier=identifier, bit=bit)
+    for identifier, bit in EVENT_BITS
+]
+
+DROP_INDEXES_SQL = [
+    'DROP INDEX vehicles_location_event_{identifier}'.format(identifier=identifier) for identifier, bit in EVENT_BITS
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vehicles', '0008_location_unique_vehicle_timestamp'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_INDEXES_SQL, DROP_INDEXES_SQL),
+    ]
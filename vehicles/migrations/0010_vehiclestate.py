@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vehicles', '0009_location_event_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VehicleState',
+            fields=[
+                ('vehicle', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='state', serialize=False, to='vehicles.Vehicle', verbose_name='vehicle')),
+                ('timestamp', models.DateTimeField(verbose_name='timestamp')),
+                ('coords', django.contrib.gis.db.models.fields.PointField(srid=4326, verbose_name='coordinates')),
+                ('event_mask', models.PositiveSmallIntegerField(default=0, verbose_name='event mask')),
+                ('data_source', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='vehicles.DataSource', verbose_name='data source')),
+            ],
+            options={
+                'verbose_name': 'vehicle state',
+                'verbose_name_plural': 'vehicle states',
+                'ordering': ('-timestamp', '-vehicle'),
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='vehiclestate',
+            index_together=set([('timestamp', 'vehicle')]),
+        ),
+        migrations.RunSQL(
+            ['''
+            INSERT INTO vehicles_vehiclestate (vehicle_id, data_source_id, timestamp, coords, event_mask)
+            SELECT vehicle.id, vehicle.data_source_id, location.timestamp, location.coords, location.event_mask
+            FROM vehicles_vehicle AS vehicle
+            JOIN vehicles_location AS location ON location.id = vehicle.last_location_id
+            '''],
+            migrations.RunSQL.noop,
+        ),
+    ]
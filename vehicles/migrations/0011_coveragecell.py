@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vehicles', '0010_vehiclestate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CoverageCell',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cell', models.CharField(max_length=12, verbose_name='cell')),
+                ('event', models.PositiveSmallIntegerField(verbose_name='event bit')),
+                ('timestamp', models.DateTimeField(verbose_name='timestamp')),
+                ('bounds', django.contrib.gis.db.models.fields.PolygonField(srid=4326, verbose_name='bounds')),
+            ],
+            options={
+                'verbose_name': 'coverage cell',
+                'verbose_name_plural': 'coverage cells',
+                'ordering': ('cell', 'event'),
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='coveragecell',
+            unique_together=set([('cell', 'event')]),
+        ),
+        # published locations are the ones not newer than their vehicle's last location
+        migrations.RunSQL(
+            ['''
+            INSERT INTO vehicles_coveragecell (cell, event, timestamp, bounds)
+            SELECT cell, event, timestamp, ST_SetSRID(ST_GeomFromGeoHash(cell), 4326) FROM (
+                SELECT ST_GeoHash(location.coords, 7) AS cell, 1 << event_bit AS event, max(location.timestamp) AS timestamp
+                FROM vehicles_vehiclestate AS state
+                JOIN vehicles_location AS location
+                    ON location.vehicle_id = state.vehicle_id AND location.timestamp <= state.timestamp
+                JOIN generate_series(0, 12) AS event_bit ON (location.event_mask & (1 << event_bit)) <> 0
+                GROUP BY 1, 2
+            ) AS covered
+            '''],
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -1,11 +1,136 @@
+import uuid
 from datetime import timedelta
 
 from django.conf import settings
 from django.contrib.gis.db import models
+from django.db import connection
 from django.utils.timezone import now
 from django.utils.translation import ugettext_lazy as _
 
+from . import lookups  # noqa: F401, registers the custom lookups
 from .constants import DELAY_SETTING
+from .events import decode_events, encode_events
+from .publication import publish_new_locations
+from .signals import locations_published
+
+
+# Thinning of a vehicle's location history so that consecutive locations are at least the given interval apart.
+# Walks the (vehicle_id, timestamp) index from one included location to the next, so the cost depends on the number of
+# included locations instead of all locations in the range. The walk can be limited by the depth of the recursion.
+THINNED_LOCATION_HISTORY_SQL = '''
+WITH RECURSIVE included AS (
+    (
+        SELECT *, 1 AS depth FROM vehicles_location
+        WHERE vehicle_id = %s{first_conditions}
+        ORDER BY timestamp LIMIT 1
+    )
+    UNION ALL
+    SELECT next.*, included.depth + 1 FROM included, LATERAL (
+        SELECT * FROM vehicles_location
+        WHERE vehicle_id = %s AND timestamp >= included.timestamp + %s{next_conditions}
+        ORDER BY timestamp LIMIT 1
+    ) AS next{depth_condition}
+)
+SELECT {columns} FROM included ORDER BY timestamp
+'''
+
+THINNED_LOCATION_COLUMNS = 'id, timestamp, coords, vehicle_id, event_mask'
+
+COVERAGE_VALUES_SQL = '''
+SELECT cell, event, timestamp, ST_XMin(bounds), ST_YMin(bounds), ST_XMax(bounds), ST_YMax(bounds)
+FROM vehicles_coveragecell WHERE {where} ORDER BY cell, event
+'''
+
+# columns of location history values, see Vehicle.get_location_history()
+LOCATION_VALUE_COLUMNS = 'timestamp, ST_X(coords), ST_Y(coords), event_mask'
+
+# Location histories of multiple vehicles given as arrays of vehicle IDs and last location timestamps, in a single
+# query. Each vehicle's locations are read from the (vehicle_id, timestamp) index backwards from its last location, so
+# with a limit only the latest locations of each vehicle are read.
+MULTI_VEHICLE_LOCATION_HISTORY_SQL = '''
+SELECT vehicle.id, location.timestamp, location.x, location.y, location.event_mask
+FROM unnest(%s::integer[], %s::timestamptz[]) AS vehicle (id, last_timestamp), LATERAL (
+    SELECT
+        vehicles_location.timestamp, ST_X(vehicles_location.coords) AS x, ST_Y(vehicles_location.coords) AS y,
+        vehicles_location.event_mask
+    FROM vehicles_location
+    WHERE
+        vehicles_location.vehicle_id = vehicle.id AND
+        vehicles_location.timestamp <= vehicle.last_timestamp{conditions}
+    ORDER BY vehicles_location.timestamp DESC{limit}
+) AS location
+ORDER BY vehicle.id, location.timestamp
+'''
+
+
+class PointX(models.Func):
+    """
+    X coordinate of a point field as a float, for annotating querysets.
+    """
+    function = 'ST_X'
+
+    def __init__(self, expression, **extra):
+        super().__init__(expression, output_field=models.FloatField(), **extra)
+
+
+class PointY(PointX):
+    function = 'ST_Y'
+
+
+def get_where_sql(queryset):
+    """
+    Return the WHERE clause of an unjoined queryset as (sql, params), for use in raw SQL selecting from its table.
+    """
+    query = queryset.query
+    return query.get_compiler(connection=connection).compile(query.where)
+
+
+def get_chunked_cursor(chunk_size):
+    """
+    Return a server-side cursor fetching rows in chunks, wrapped like the cursors of connection.cursor().
+
+    Server-side cursors only live in a transaction.
+    """
+    connection.validate_thread_sharing()
+    connection.ensure_connection()
+    with connection.wrap_database_errors:
+        cursor = connection.connection.cursor(name='streetmaintenance_%s' % uuid.uuid4().hex)
+    cursor.itersize = chunk_size
+    return connection.make_debug_cursor(cursor) if connection.queries_logged else connection.make_cursor(cursor)
+
+
+def iterate_query(sql, params, chunk_size=2000):
+    """
+    Yield rows of a raw SQL query fetched in chunks using a server-side cursor.
+
+    The whole result is never in memory, and the first rows are available before the query has finished. Unless the
+    connection is already in a transaction, one is begun for the cursor and committed when the generator is exhausted
+    or closed. It isn't an atomic block, because the generator may be consumed after the view has returned, for
+    example by a StreamingHttpResponse.
+    """
+    connection.ensure_connection()
+    manage_transaction = connection.get_autocommit()
+    if manage_transaction:
+        connection.set_autocommit(False)
+
+    failed = False
+    try:
+        with get_chunked_cursor(chunk_size) as cursor:
+            cursor.execute(sql, params)
+            for row in cursor:
+                yield row
+    except Exception:
+        failed = True
+        raise
+    finally:
+        if manage_transaction:
+            try:
+                if failed:
+                    connection.rollback()
+                else:
+                    connection.commit()
+            finally:
+                connection.set_autocommit(True)
 
 
 class DataSource(models.Model):
@@ -23,9 +148,10 @@ class DataSource(models.Model):
 class Vehicle(models.Model):
     data_source = models.ForeignKey(DataSource, related_name='vehicles', on_delete=models.PROTECT)
     origin_id = models.CharField(max_length=32, verbose_name=_('origin ID'), db_index=True)
+    # locations are partitioned, which doesn't allow foreign key constraints to them
     last_location = models.ForeignKey(
         'Location', verbose_name=_('last_location'), related_name='last_location_vehicle', null=True, blank=True,
-        on_delete=models.SET_NULL
+        on_delete=models.SET_NULL, db_constraint=False
     )
 
     class Meta:
@@ -46,6 +172,8 @@ class Vehicle(models.Model):
         delay_timestamp = now() - timedelta(seconds=delay)
         self.last_location = self.locations.filter(timestamp__lte=delay_timestamp).order_by('timestamp').last()
         self.save(update_fields=('last_location',))
+        VehicleState.update_for_vehicle(self)
+        locations_published.send(sender=Vehicle, vehicle_ids=[self.id])
 
     @property
     def available_locations(self):
@@ -54,13 +182,145 @@ class Vehicle(models.Model):
             locations = locations.filter(timestamp__lte=self.last_location.timestamp)
         return locations
 
+    def get_location_history(self, since=None, history=None, temporal_resolution=None, location_filter=None,
+                             values=False, after=None, limit=None, stream=False):
+        """
+        Return the vehicle's available locations in chronological order.
+
+        The locations can be limited to the ones not older than since, to the ones newer than after, to the ones
+        matching location_filter Q object and to the latest history locations or to the oldest limit locations. When
+        temporal_resolution is given, a location is included only if it is at least temporal_resolution seconds
+        after the previous included location, and after is considered to be the previous included location. That is
+        done in the database, so only the included locations are fetched.
+
+        With values=True (timestamp, x, y, event_mask) tuples are returned instead of Location objects. With
+        stream=True the tuples are returned as an iterator fetching them in chunks with a server-side cursor, see
+        iterate_query().
+        """
+        values = values or stream
+        locations = self.available_locations
+        if since:
+            locations = locations.filter(timestamp__gte=since)
+        if location_filter:
+            locations = locations.filter(location_filter)
+
+        if not temporal_resolution:
+            if stream and history:
+                # a streamed history is read in chronological order from its oldest location
+                start = self._get_history_start(locations, history)
+                if start:
+                    locations = locations.filter(timestamp__gte=start)
+                history = None
+            return self._get_unthinned_location_history(locations, history, values, after, limit, stream)
+
+        start = since
+        if after:
+            start = after + timedelta(seconds=temporal_resolution)
+        elif history:
+            start = self._get_history_start(locations, history) or since
+        return self._get_thinned_location_history(start, temporal_resolution, location_filter, values, limit, stream)
+
+    def _get_history_start(self, locations, history):
+        oldest = list(locations.order_by('-timestamp').values_list('timestamp', flat=True)[history - 1:history])
+        return oldest[0] if oldest else None
+
+    def _get_unthinned_location_history(self, locations, history, values, after, limit, stream):
+        if after:
+            locations = locations.filter(timestamp__gt=after)
+        if stream:
+            where_sql, params = get_where_sql(locations)
+            sql = 'SELECT %s FROM vehicles_location WHERE %s ORDER BY timestamp' % (LOCATION_VALUE_COLUMNS, where_sql)
+            if limit:
+                sql += ' LIMIT %d' % limit
+            return iterate_query(sql, params)
+        if values:
+            locations = locations.annotate(x=PointX('coords'), y=PointY('coords')).values_list(
+                'timestamp', 'x', 'y', 'event_mask'
+            )
+
+        if limit:
+            return list(locations.order_by('timestamp')[:limit])
+
+        locations = locations.order_by('-timestamp')
+        if history:
+            locations = locations[:history]
+        return list(reversed(locations))
+
+    def _get_thinned_location_history(self, start, temporal_resolution, location_filter, values, limit, stream):
+        conditions, params = [], []
+        if self.last_location:
+            conditions.append('timestamp <= %s')
+            params.append(self.last_location.timestamp)
+        if location_filter:
+            filter_sql, filter_params = get_where_sql(Location.objects.filter(location_filter))
+            conditions.append(filter_sql)
+            params.extend(filter_params)
+
+        first_conditions, first_params = list(conditions), [self.id] + params
+        if start:
+            first_conditions.append('timestamp >= %s')
+            first_params.append(start)
+
+        sql = THINNED_LOCATION_HISTORY_SQL.format(
+            first_conditions=''.join(' AND %s' % condition for condition in first_conditions),
+            next_conditions=''.join(' AND %s' % condition for condition in conditions),
+            depth_condition=' WHERE included.depth < %s' if limit else '',
+            columns=LOCATION_VALUE_COLUMNS if values else THINNED_LOCATION_COLUMNS,
+        )
+        params = first_params + [self.id, timedelta(seconds=temporal_resolution)] + params
+        if limit:
+            params.append(limit)
+
+        if stream:
+            return iterate_query(sql, params)
+        if not values:
+            return list(Location.objects.raw(sql, params))
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+    @classmethod
+    def iterate_location_histories(cls, vehicles, since=None, history=None, location_filter=None):
+        """
+        Yield (vehicle_id, timestamp, x, y, event_mask) tuples of the given vehicles' available locations.
+
+        The locations are ordered by vehicle ID and timestamp, and they are fetched with a single query regardless of
+        the number of vehicles. since, history and location_filter work like in get_location_history().
+        """
+        return iterate_query(*cls.get_location_histories_query(vehicles, since, history, location_filter))
+
+    @classmethod
+    def get_location_histories_query(cls, vehicles, since=None, history=None, location_filter=None):
+        """
+        Return (sql, params) of the query of iterate_location_histories().
+        """
+        vehicles = [vehicle for vehicle in vehicles if vehicle.last_location]
+        conditions, params = [], [
+            [vehicle.id for vehicle in vehicles], [vehicle.last_location.timestamp for vehicle in vehicles]
+        ]
+        if since:
+            conditions.append('vehicles_location.timestamp >= %s')
+            params.append(since)
+        if location_filter:
+            filter_sql, filter_params = get_where_sql(Location.objects.filter(location_filter))
+            conditions.append(filter_sql)
+            params.extend(filter_params)
+        if history:
+            params.append(history)
+
+        sql = MULTI_VEHICLE_LOCATION_HISTORY_SQL.format(
+            conditions=''.join(' AND (%s)' % condition for condition in conditions),
+            limit=' LIMIT %s' if history else '',
+        )
+        return sql, params
+
     @classmethod
     def update_last_locations(cls):
         """
         Update (if needed) delayed last location of all vehicles that aren't up to date.
 
-        If location delay is enabled this needs to be called periodically to
-        get locations actually updated in the API.
+        This goes through all locations, so normally publish_due_locations() from vehicles.publication
+        should be used instead to get delayed locations updated in the API.
         """
         vehicles_with_new_locations = cls.objects.annotate(
             latest_timestamp=models.Max('locations__timestamp')
@@ -85,32 +345,143 @@ class EventType(models.Model):
 
 
 class Location(models.Model):
+    """
+    A location of a vehicle.
+
+    The table is partitioned by timestamp, see vehicles.partitions.
+    """
     timestamp = models.DateTimeField(verbose_name=_('timestamp'), db_index=True)
     coords = models.PointField(verbose_name=_('coordinates'), srid=4326)
     vehicle = models.ForeignKey(Vehicle, verbose_name=_('vehicle'), related_name='locations', on_delete=models.PROTECT)
-    events = models.ManyToManyField(EventType, verbose_name=_('events'), related_name='locations', blank=True)
+    event_mask = models.PositiveSmallIntegerField(verbose_name=_('event mask'), default=0)
 
     class Meta:
         verbose_name = _('location')
         verbose_name_plural = _('locations')
-        unique_together = ('timestamp', 'vehicle')
+        unique_together = ('vehicle', 'timestamp')
         ordering = ('timestamp',)
 
     def __str__(self):
         return '%s %s %s' % (self.coords.y, self.coords.x, self.timestamp)
 
+    @property
+    def events(self):
+        """
+        Identifiers of the location's events.
+        """
+        return decode_events(self.event_mask)
+
+    @events.setter
+    def events(self, identifiers):
+        self.event_mask = encode_events(identifiers)
+
     def save(self, *args, **kwargs):
         super().save(*args, **kwargs)
 
-        if self.timestamp < self.vehicle.locations.last().timestamp:
-            # for some reason creating a location which isn't the latest, no further action required
-            return
+        # Publishing compares only against the vehicle's current last location, and locations inside the delay
+        # are put into the pending queue, so this is constant work regardless of the vehicle's history.
+        if publish_new_locations([(self.id, self.vehicle_id, self.timestamp)]):
+            self.vehicle.last_location = self
+
+
+class PendingLocation(models.Model):
+    """
+    A location which cannot be published yet because of the delay.
+
+    See vehicles.publication.
+    """
+    location = models.OneToOneField(
+        Location, verbose_name=_('location'), related_name='pending', primary_key=True, on_delete=models.CASCADE,
+        db_constraint=False
+    )
+    vehicle = models.ForeignKey(
+        Vehicle, verbose_name=_('vehicle'), related_name='pending_locations', on_delete=models.CASCADE
+    )
+    timestamp = models.DateTimeField(verbose_name=_('timestamp'), db_index=True)
+
+    class Meta:
+        verbose_name = _('pending location')
+        verbose_name_plural = _('pending locations')
+        ordering = ('timestamp',)
+
+    def __str__(self):
+        return str(self.location)
+
+
+class VehicleState(models.Model):
+    """
+    Published state of a vehicle, a copy of its last location.
 
-        delay = getattr(settings, DELAY_SETTING, 15 * 60)
-        if delay and self.timestamp > (now() - timedelta(seconds=delay)):
-            # the new location cannot be shown yet
+    Kept up to date by publication, see vehicles.publication, so that the list endpoint can be served from this
+    narrow table without touching the location table. Vehicles without a last location don't have a state.
+    """
+    vehicle = models.OneToOneField(
+        Vehicle, verbose_name=_('vehicle'), related_name='state', primary_key=True, on_delete=models.CASCADE
+    )
+    data_source = models.ForeignKey(
+        DataSource, verbose_name=_('data source'), related_name='+', on_delete=models.CASCADE
+    )
+    timestamp = models.DateTimeField(verbose_name=_('timestamp'))
+    coords = models.PointField(verbose_name=_('coordinates'), srid=4326)
+    event_mask = models.PositiveSmallIntegerField(verbose_name=_('event mask'), default=0)
+
+    class Meta:
+        verbose_name = _('vehicle state')
+        verbose_name_plural = _('vehicle states')
+        ordering = ('-timestamp', '-vehicle')
+        index_together = (('timestamp', 'vehicle'),)
+
+    def __str__(self):
+        return '%s %s' % (self.vehicle_id, self.timestamp)
+
+    def get_vehicle(self):
+        """
+        Return an unsaved Vehicle with its last location built from the state, for serializing.
+        """
+        last_location = Location(timestamp=self.timestamp, coords=self.coords, event_mask=self.event_mask)
+        return Vehicle(id=self.vehicle_id, data_source_id=self.data_source_id, last_location=last_location)
+
+    @classmethod
+    def update_for_vehicle(cls, vehicle):
+        if not vehicle.last_location:
+            cls.objects.filter(vehicle=vehicle).delete()
             return
+        location = vehicle.last_location
+        cls.objects.update_or_create(vehicle=vehicle, defaults={
+            'data_source_id': vehicle.data_source_id, 'timestamp': location.timestamp, 'coords': location.coords,
+            'event_mask': location.event_mask,
+        })
+
+
+class CoverageCell(models.Model):
+    """
+    Timestamp of the latest published location having an event in a grid cell.
+
+    Cells are geohashes of publication.COVERAGE_CELL_PRECISION characters, and every event type of a cell has a row of
+    its own. Kept up to date by publication from the newly published locations only, see vehicles.publication, so that
+    coverage can be served without scanning location histories.
+    """
+    cell = models.CharField(max_length=12, verbose_name=_('cell'))
+    event = models.PositiveSmallIntegerField(verbose_name=_('event bit'))
+    timestamp = models.DateTimeField(verbose_name=_('timestamp'))
+    bounds = models.PolygonField(verbose_name=_('bounds'), srid=4326)
+
+    class Meta:
+        verbose_name = _('coverage cell')
+        verbose_name_plural = _('coverage cells')
+        unique_together = ('cell', 'event')
+        ordering = ('cell', 'event')
 
-        # the new location can be shown normally
-        self.vehicle.last_location = self
-        self.vehicle.save(update_fields=('last_location',))
+    def __str__(self):
+        return '%s %s %s' % (self.cell, decode_events(self.event), self.timestamp)
+
+    @classmethod
+    def get_values(cls, cell_filter):
+        """
+        Return (cell, event_mask, timestamp, (xmin, ymin, xmax, ymax)) tuples of the cells matching cell_filter Q
+        object, ordered by cell and event.
+        """
+        where_sql, params = get_where_sql(cls.objects.filter(cell_filter))
+        with connection.cursor() as cursor:
+            cursor.execute(COVERAGE_VALUES_SQL.format(where=where_sql or 'TRUE'), params)
+            return [row[:3] + (row[3:],) for row in cursor.fetchall()]
@@ -0,0 +1,165 @@
+"""
+Monthly range partitions of the location table.
+
+Locations are partitioned by timestamp into UTC months, and rows not fitting any of the monthly partitions go to a
+default partition. Partitions are created some months ahead, and when a retention period is configured whole
+partitions older than that are dropped instead of deleting rows one by one. Only expired rows of the default partition
+have to be deleted separately.
+"""
+import logging
+from datetime import datetime
+
+import pytz
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils.timezone import now
+
+from .constants import LOCATION_RETENTION_MONTHS_SETTING
+from .signals import locations_published
+
+logger = logging.getLogger(__name__)
+
+PARENT_TABLE = 'vehicles_location'
+DEFAULT_PARTITION = 'vehicles_location_default'
+PARTITION_NAME_FORMAT = 'vehicles_location_y%Ym%m'
+MONTHS_AHEAD = 3
+
+GET_PARTITIONS_SQL = '''
+SELECT child.relname FROM pg_inherits
+JOIN pg_class AS parent ON parent.oid = pg_inherits.inhparent
+JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid
+WHERE parent.relname = %s
+'''
+
+# Rows of the new range might already be in the default partition, so the partition is filled from there before
+# attaching it.
+CREATE_PARTITION_SQL = '''
+CREATE TABLE {partition} (LIKE vehicles_location INCLUDING DEFAULTS INCLUDING CONSTRAINTS);
+WITH moved AS (
+    DELETE FROM vehicles_location_default WHERE timestamp >= %(start)s AND timestamp < %(end)s RETURNING *
+)
+INSERT INTO {partition} SELECT * FROM moved;
+ALTER TABLE vehicles_location ATTACH PARTITION {partition} FOR VALUES FROM (%(start)s) TO (%(end)s);
+'''
+
+# Foreign keys referencing locations cannot be used with a partitioned table, so references are cleared here.
+DROP_PARTITION_SQL = '''
+UPDATE vehicles_vehicle SET last_location_id = NULL WHERE last_location_id IN (SELECT id FROM {partition});
+DELETE FROM vehicles_vehiclestate WHERE vehicle_id IN (SELECT id FROM vehicles_vehicle WHERE last_location_id IS NULL);
+DELETE FROM vehicles_pendinglocation WHERE location_id IN (SELECT id FROM {partition});
+ALTER TABLE vehicles_location DETACH PARTITION {partition};
+DROP TABLE {partition};
+'''
+
+# Like DROP_PARTITION_SQL, for the rows of the default partition older than the cutoff.
+DELETE_EXPIRED_DEFAULT_ROWS_SQL = '''
+UPDATE vehicles_vehicle SET last_location_id = NULL WHERE last_location_id IN (
+    SELECT id FROM vehicles_location_default WHERE timestamp < %(cutoff)s
+);
+DELETE FROM vehicles_vehiclestate WHERE vehicle_id IN (SELECT id FROM vehicles_vehicle WHERE last_location_id IS NULL);
+DELETE FROM vehicles_pendinglocation WHERE location_id IN (
+    SELECT id FROM vehicles_location_default WHERE timestamp < %(cutoff)s
+);
+DELETE FROM vehicles_location_default WHERE timestamp < %(cutoff)s;
+'''
+
+
+def get_month_start(dt):
+    dt = dt.astimezone(pytz.utc)
+    return datetime(dt.year, dt.month, 1, tzinfo=pytz.utc)
+
+
+def add_months(month_start, months):
+    month_index = month_start.year * 12 + month_start.month - 1 + months
+    return month_start.replace(year=month_index // 12, month=month_index % 12 + 1)
+
+
+def get_partition_name(month_start):
+    return month_start.strftime(PARTITION_NAME_FORMAT)
+
+
+def get_location_partitions():
+    """
+    Return a dict of the existing monthly partitions, month start datetime as key and table name as value.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(GET_PARTITIONS_SQL, (PARENT_TABLE,))
+        names = [row[0] for row in cursor.fetchall()]
+
+    partitions = {}
+    for name in names:
+        if name == DEFAULT_PARTITION:
+            continue
+        try:
+            month_start = pytz.utc.localize(datetime.strptime(name, PARTITION_NAME_FORMAT))
+        except ValueError:
+            logger.warning('Unknown location partition %s' % name)
+            continue
+        partitions[month_start] = name
+
+    return partitions
+
+
+def ensure_location_partitions(start=None, end=None):
+    """
+    Create missing monthly partitions for months from start to end.
+
+    start defaults to the current month and end to MONTHS_AHEAD months from now. Returns names of the created
+    partitions.
+    """
+    month = get_month_start(start or now())
+    end = end or add_months(get_month_start(now()), MONTHS_AHEAD)
+    existing = get_location_partitions()
+    created = []
+
+    while month <= end:
+        if month not in existing:
+            partition = get_partition_name(month)
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(
+                    CREATE_PARTITION_SQL.format(partition=partition),
+                    {'start': month.isoformat(), 'end': add_months(month, 1).isoformat()},
+                )
+            logger.info('Created location partition %s' % partition)
+            created.append(partition)
+        month = add_months(month, 1)
+
+    return created
+
+
+def drop_expired_location_partitions(retention_months=None):
+    """
+    Drop monthly partitions whose every location is older than the retention period, and delete such locations from
+    the default partition.
+
+    retention_months defaults to the retention setting, no partitions are dropped if it is not set. Returns names
+    of the dropped partitions.
+    """
+    if retention_months is None:
+        retention_months = getattr(settings, LOCATION_RETENTION_MONTHS_SETTING, None)
+    if not retention_months:
+        return []
+
+    cutoff = add_months(get_month_start(now()), -retention_months)
+    dropped = []
+
+    for month_start, partition in sorted(get_location_partitions().items()):
+        if add_months(month_start, 1) > cutoff:
+            continue
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(DROP_PARTITION_SQL.format(partition=partition))
+            locations_published.send(sender=__name__, vehicle_ids=[])
+        logger.info('Dropped location partition %s' % partition)
+        dropped.append(partition)
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(DELETE_EXPIRED_DEFAULT_ROWS_SQL, {'cutoff': cutoff})
+        if cursor.rowcount:
+            locations_published.send(sender=__name__, vehicle_ids=[])
+            logger.info('Deleted %d expired locations from %s' % (cursor.rowcount, DEFAULT_PARTITION))
+
+    return dropped
+
+
+def manage_location_partitions():
+    return ensure_location_partitions(), drop_expired_location_partitions()
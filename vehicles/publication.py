@@ -0,0 +1,194 @@
+"""
+Publication of delayed locations.
+
+A location is published when it becomes the last location of its vehicle. Locations newer than the delay cannot be
+published right away, so they are put into a time-ordered queue of pending locations from which they are promoted
+when they come due. This way the cost of a publication run depends only on the number of newly due locations.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.utils.timezone import now
+
+from .constants import DELAY_SETTING
+from .events import EVENT_IDENTIFIERS
+from .signals import locations_published
+
+logger = logging.getLogger(__name__)
+
+# length of the geohashes used as coverage cells, 7 characters being about 150 x 150 meters at the equator and
+# 75 meters wide and 150 meters high in Turku
+COVERAGE_CELL_PRECISION = 7
+
+# Record the events of newly published locations in coverage cells, so that the cost depends only on the number of
+# new locations. Locations are given by a CTE called "published_locations" with columns timestamp, coords,
+# event_mask.
+UPDATE_COVERAGE_SQL = '''
+, coverage AS (
+    INSERT INTO vehicles_coveragecell (cell, event, timestamp, bounds)
+    SELECT cell, event, timestamp, ST_SetSRID(ST_GeomFromGeoHash(cell), 4326) FROM (
+        SELECT ST_GeoHash(coords, {precision}) AS cell, 1 << event_bit AS event, max(timestamp) AS timestamp
+        FROM published_locations
+        JOIN generate_series(0, {max_bit}) AS event_bit ON (event_mask & (1 << event_bit)) <> 0
+        GROUP BY 1, 2
+    ) AS covered
+    ON CONFLICT (cell, event) DO UPDATE SET timestamp = EXCLUDED.timestamp
+    WHERE vehicles_coveragecell.timestamp < EXCLUDED.timestamp
+)
+'''.format(precision=COVERAGE_CELL_PRECISION, max_bit=len(EVENT_IDENTIFIERS) - 1)
+
+# Set the latest candidate of each vehicle as the vehicle's last location, unless the vehicle already has a newer
+# last location, copy it to the vehicle's state and record all the candidates in coverage. Candidates are given by a
+# CTE called "candidates" with columns location_id, vehicle_id, timestamp. The current last location is compared by
+# the timestamp in the vehicle's state, because looking it up by ID alone would go through every location partition.
+PUBLISH_CANDIDATES_SQL = '''
+, published AS (
+    UPDATE vehicles_vehicle AS vehicle SET last_location_id = candidate.location_id
+    FROM (
+        SELECT DISTINCT ON (vehicle_id) location_id, vehicle_id, timestamp FROM candidates
+        ORDER BY vehicle_id, timestamp DESC
+    ) AS candidate
+    LEFT JOIN vehicles_vehiclestate AS current_state ON current_state.vehicle_id = candidate.vehicle_id
+    WHERE vehicle.id = candidate.vehicle_id AND (
+        current_state.timestamp IS NULL OR candidate.timestamp > current_state.timestamp
+    )
+    RETURNING vehicle.id, vehicle.data_source_id, candidate.location_id, candidate.timestamp
+), state AS (
+    INSERT INTO vehicles_vehiclestate (vehicle_id, data_source_id, timestamp, coords, event_mask)
+    SELECT published.id, published.data_source_id, location.timestamp, location.coords, location.event_mask
+    FROM published
+    JOIN vehicles_location AS location
+        ON location.id = published.location_id AND location.timestamp = published.timestamp
+    ON CONFLICT (vehicle_id) DO UPDATE SET
+        data_source_id = EXCLUDED.data_source_id, timestamp = EXCLUDED.timestamp, coords = EXCLUDED.coords,
+        event_mask = EXCLUDED.event_mask
+), published_locations AS (
+    SELECT location.timestamp, location.coords, location.event_mask
+    FROM candidates
+    JOIN vehicles_location AS location
+        ON location.id = candidates.location_id AND location.timestamp = candidates.timestamp
+)
+''' + UPDATE_COVERAGE_SQL + '''
+SELECT id FROM published
+'''
+
+PUBLISH_NEW_LOCATIONS_SQL = '''
+WITH candidates AS (
+    SELECT * FROM unnest(%s::integer[], %s::integer[], %s::timestamptz[]) AS new (location_id, vehicle_id, timestamp)
+)
+''' + PUBLISH_CANDIDATES_SQL
+
+PUBLISH_DUE_LOCATIONS_SQL = '''
+WITH candidates AS (
+    DELETE FROM vehicles_pendinglocation WHERE timestamp <= %s
+    RETURNING location_id, vehicle_id, timestamp
+)
+''' + PUBLISH_CANDIDATES_SQL
+
+# Latest locations not newer than the given timestamp of the given vehicles, each fetched from the
+# (vehicle_id, timestamp) index.
+PUBLISH_LATEST_LOCATIONS_SQL = '''
+WITH candidates AS (
+    SELECT latest.* FROM unnest(%s::integer[]) AS vehicle (id), LATERAL (
+        SELECT id AS location_id, vehicle_id, timestamp FROM vehicles_location
+        WHERE vehicle_id = vehicle.id AND timestamp <= %s
+        ORDER BY timestamp DESC LIMIT 1
+    ) AS latest
+)
+''' + PUBLISH_CANDIDATES_SQL
+
+ENQUEUE_LOCATIONS_SQL = '''
+INSERT INTO vehicles_pendinglocation (location_id, vehicle_id, timestamp)
+SELECT * FROM unnest(%s::integer[], %s::integer[], %s::timestamptz[])
+ON CONFLICT DO NOTHING
+'''
+
+
+def get_delay():
+    """
+    Return the publication delay in seconds, 0 meaning no delay.
+    """
+    return getattr(settings, DELAY_SETTING, 15 * 60) or 0
+
+
+def get_publication_cutoff():
+    """
+    Return the timestamp published locations cannot be newer than, or None if there is no delay.
+    """
+    delay = get_delay()
+    return now() - timedelta(seconds=delay) if delay else None
+
+
+def publish_new_locations(locations):
+    """
+    Publish the given new locations, or put them into the queue if they cannot be published yet.
+
+    locations should be an iterable of (location_id, vehicle_id, timestamp) tuples. Uses at most two queries
+    regardless of the number of locations. Returns IDs of the vehicles whose last location was changed.
+    """
+    cutoff = get_publication_cutoff()
+
+    due = []
+    pending = []
+    for location in locations:
+        if cutoff and location[2] > cutoff:
+            pending.append(location)
+        else:
+            due.append(location)
+
+    vehicle_ids = []
+
+    with connection.cursor() as cursor:
+        if pending:
+            cursor.execute(ENQUEUE_LOCATIONS_SQL, [list(column) for column in zip(*pending)])
+        if due:
+            cursor.execute(PUBLISH_NEW_LOCATIONS_SQL, [list(column) for column in zip(*due)])
+            vehicle_ids = [row[0] for row in cursor.fetchall()]
+
+    # due locations are visible in location histories even if they didn't become last locations
+    if due:
+        locations_published.send(sender=__name__, vehicle_ids=vehicle_ids)
+
+    return vehicle_ids
+
+
+def publish_due_locations():
+    """
+    Promote pending locations that have come due.
+
+    Returns IDs of the vehicles whose last location was changed.
+    """
+    cutoff = get_publication_cutoff() or now()
+
+    with connection.cursor() as cursor:
+        cursor.execute(PUBLISH_DUE_LOCATIONS_SQL, (cutoff,))
+        vehicle_ids = [row[0] for row in cursor.fetchall()]
+
+    if vehicle_ids:
+        locations_published.send(sender=__name__, vehicle_ids=vehicle_ids)
+
+    logger.debug('Published new last locations for %d vehicles' % len(vehicle_ids))
+    return vehicle_ids
+
+
+def publish_latest_locations(vehicle_ids):
+    """
+    Publish the latest due location of each of the given vehicles, unless a vehicle already has a newer one.
+
+    Meant for publishing once after locations have been loaded in bulk without publish_new_locations(). Locations
+    that aren't due yet must have been put into the queue. Returns IDs of the vehicles whose last location was
+    changed.
+    """
+    cutoff = get_publication_cutoff() or now()
+
+    with connection.cursor() as cursor:
+        cursor.execute(PUBLISH_LATEST_LOCATIONS_SQL, (list(vehicle_ids), cutoff))
+        vehicle_ids = [row[0] for row in cursor.fetchall()]
+
+    # location histories have changed even if no last location did
+    locations_published.send(sender=__name__, vehicle_ids=vehicle_ids)
+
+    logger.debug('Published new last locations for %d vehicles' % len(vehicle_ids))
+    return vehicle_ids
@@ -0,0 +1,360 @@
+"""
+Fast rendering of the vehicle API.
+
+JSON responses are exactly the same bytes as the DRF serializers with JSONRenderer produce, but they are rendered from
+plain value tuples instead of model instances and nested serializers. The compact polyline and GeoJSON formats are
+rendered the same way, in a single pass over the locations. Event lists are rendered once per event mask and UTC
+offsets of the local time zone are looked up once per 15 minutes of timestamps.
+"""
+import itertools
+import json
+import math
+from datetime import timedelta
+from operator import itemgetter
+
+from django.utils import timezone
+
+from .events import DECODED_EVENT_MASKS
+
+VEHICLE_JSON = '{"id":%d,"last_location":%s,"location_history":[%s]}'
+LOCATION_JSON = '{"timestamp":"%s","coords":[%r,%r],"events":%s}'
+VEHICLE_HISTORY_START_JSON = '%s{"id":%d,"last_location":%s,"location_history":['
+
+POLYLINE_VEHICLE_JSON = '{"id":%d,"last_location":%s,"location_history":%s}'
+POLYLINE_HISTORY_JSON = '{"start":%s,"polyline":%s,"timestamps":[%s],"events":[%s]}'
+POLYLINE_FACTOR = 1e5
+
+FEATURE_COLLECTION_JSON = '{"type":"FeatureCollection","features":[%s]}'
+POINT_FEATURE_JSON = (
+    '{"type":"Feature","geometry":{"type":"Point","coordinates":[%r,%r]},'
+    '"properties":{"vehicle_id":%d,"kind":"last_location","timestamp":"%s","events":%s}}'
+)
+HISTORY_POINT_FEATURE_JSON = (
+    '{"type":"Feature","geometry":{"type":"Point","coordinates":[%r,%r]},'
+    '"properties":{"vehicle_id":%d,"kind":"location_history","timestamps":["%s"],"events":[%s]}}'
+)
+HISTORY_LINE_FEATURE_JSON = (
+    '{"type":"Feature","geometry":{"type":"LineString","coordinates":[%s]},'
+    '"properties":{"vehicle_id":%d,"kind":"location_history","timestamps":[%s],"events":[%s]}}'
+)
+
+COVERAGE_CELL_JSON = '{"cell":"%s","event":"%s","timestamp":"%s","bbox":[%r,%r,%r,%r]}'
+COVERAGE_FEATURE_JSON = (
+    '{"type":"Feature","geometry":{"type":"Polygon","coordinates":[[[%r,%r],[%r,%r],[%r,%r],[%r,%r],[%r,%r]]]},'
+    '"properties":{"cell":"%s","event":"%s","timestamp":"%s"}}'
+)
+
+# the length of a period during which the UTC offset is assumed not to change, in seconds. Time zone transitions
+# happen at full quarters of an hour.
+OFFSET_PERIOD = 15 * 60
+
+_events_json = {}
+
+
+def get_events_json(mask):
+    try:
+        return _events_json[mask]
+    except KeyError:
+        events_json = _events_json[mask] = json.dumps(DECODED_EVENT_MASKS[mask], separators=(',', ':'))
+        return events_json
+
+
+class LocalTimeFormatter:
+    """
+    Format aware datetimes as ISO 8601 in the current time zone, like datetime.isoformat() of a local time does.
+    """
+
+    def __init__(self):
+        self._offsets = {}
+
+    def get_offset(self, timestamp):
+        period = int(timestamp.timestamp()) // OFFSET_PERIOD
+        try:
+            return self._offsets[period]
+        except KeyError:
+            pass
+
+        offset = timezone.localtime(timestamp).utcoffset()
+        minutes = int(offset.total_seconds()) // 60
+        if minutes:
+            suffix = '%s%02d:%02d' % ('-' if minutes < 0 else '+', abs(minutes) // 60, abs(minutes) % 60)
+        else:
+            # UTC is rendered as "Z" by DRF
+            suffix = 'Z'
+        self._offsets[period] = offset, suffix
+        return offset, suffix
+
+    def format(self, timestamp):
+        offset, suffix = self.get_offset(timestamp)
+        # the offset is from UTC, so the timestamp must be in UTC too
+        local = timestamp.astimezone(timezone.utc) + offset
+        representation = '%04d-%02d-%02dT%02d:%02d:%02d' % (
+            local.year, local.month, local.day, local.hour, local.minute, local.second
+        )
+        if local.microsecond:
+            representation += '.%06d' % local.microsecond
+        return representation + suffix
+
+
+def render_locations(locations, formatter):
+    """
+    Render (timestamp, x, y, event_mask) tuples as a comma separated string of location objects.
+    """
+    format_timestamp = formatter.format
+    return ','.join([
+        LOCATION_JSON % (format_timestamp(timestamp), x, y, get_events_json(event_mask))
+        for timestamp, x, y, event_mask in locations
+    ])
+
+
+def render_vehicle(vehicle_id, last_location, location_history, formatter):
+    return VEHICLE_JSON % (vehicle_id, render_locations((last_location,), formatter), render_locations(
+        location_history, formatter
+    ))
+
+
+def render_vehicle_list(vehicles):
+    """
+    Render the list endpoint response from (vehicle_id, last_location) pairs.
+
+    last_location should be a (timestamp, x, y, event_mask) tuple.
+    """
+    formatter = LocalTimeFormatter()
+    return ('[%s]' % ','.join([
+        render_vehicle(vehicle_id, last_location, (), formatter) for vehicle_id, last_location in vehicles
+    ])).encode('utf-8')
+
+
+def render_vehicle_detail(vehicle_id, last_location, location_history):
+    """
+    Render the detail endpoint response.
+
+    last_location and the items of location_history should be (timestamp, x, y, event_mask) tuples.
+    """
+    return render_vehicle(vehicle_id, last_location, location_history, LocalTimeFormatter()).encode('utf-8')
+
+
+def get_location_values(location):
+    return location.timestamp, location.coords.x, location.coords.y, location.event_mask
+
+
+def encode_polyline_value(value):
+    """
+    Encode an integer as in Google's encoded polyline algorithm format.
+    """
+    value = ~(value << 1) if value < 0 else value << 1
+    chunks = []
+    while value >= 0x20:
+        chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+        value >>= 5
+    chunks.append(chr(value + 63))
+    return ''.join(chunks)
+
+
+def round_coordinate(value):
+    # rounds halves up like the reference implementation of the polyline algorithm
+    return int(math.floor(value * POLYLINE_FACTOR + 0.5))
+
+
+def render_polyline_history(locations, formatter):
+    """
+    Render (timestamp, x, y, event_mask) tuples as a compact location history object.
+
+    Coordinates are a Google encoded polyline with precision 5, timestamps are whole seconds from the previous
+    location (the first from start) and events are [count, events] runs of consecutive locations.
+    """
+    polyline = []
+    timestamps = []
+    event_runs = []
+    start = None
+    previous_lat = previous_lng = previous_seconds = 0
+    run_mask, run_length = None, 0
+
+    for timestamp, x, y, event_mask in locations:
+        lat, lng = round_coordinate(y), round_coordinate(x)
+        polyline.append(encode_polyline_value(lat - previous_lat))
+        polyline.append(encode_polyline_value(lng - previous_lng))
+        previous_lat, previous_lng = lat, lng
+
+        seconds = int(round(timestamp.timestamp()))
+        if start is None:
+            start = formatter.format(timestamp)
+            previous_seconds = seconds
+        timestamps.append(str(seconds - previous_seconds))
+        previous_seconds = seconds
+
+        if event_mask == run_mask:
+            run_length += 1
+        else:
+            if run_length:
+                event_runs.append('[%d,%s]' % (run_length, get_events_json(run_mask)))
+            run_mask, run_length = event_mask, 1
+
+    if run_length:
+        event_runs.append('[%d,%s]' % (run_length, get_events_json(run_mask)))
+
+    return POLYLINE_HISTORY_JSON % (
+        json.dumps(start), json.dumps(''.join(polyline)), ','.join(timestamps), ','.join(event_runs)
+    )
+
+
+def render_vehicle_detail_polyline(vehicle_id, last_location, location_history):
+    """
+    Render the detail endpoint response with the location history in the compact polyline format.
+    """
+    formatter = LocalTimeFormatter()
+    return (POLYLINE_VEHICLE_JSON % (
+        vehicle_id, render_locations((last_location,), formatter), render_polyline_history(location_history, formatter)
+    )).encode('utf-8')
+
+
+def render_point_feature(vehicle_id, location, formatter):
+    timestamp, x, y, event_mask = location
+    return POINT_FEATURE_JSON % (x, y, vehicle_id, formatter.format(timestamp), get_events_json(event_mask))
+
+
+def render_history_feature(vehicle_id, locations, formatter):
+    if len(locations) == 1:
+        timestamp, x, y, event_mask = locations[0]
+        return HISTORY_POINT_FEATURE_JSON % (
+            x, y, vehicle_id, formatter.format(timestamp), get_events_json(event_mask)
+        )
+
+    format_timestamp = formatter.format
+    coordinates = []
+    timestamps = []
+    events = []
+    for timestamp, x, y, event_mask in locations:
+        coordinates.append('[%r,%r]' % (x, y))
+        timestamps.append('"%s"' % format_timestamp(timestamp))
+        events.append(get_events_json(event_mask))
+
+    return HISTORY_LINE_FEATURE_JSON % (','.join(coordinates), vehicle_id, ','.join(timestamps), ','.join(events))
+
+
+def render_vehicle_list_geojson(vehicles):
+    """
+    Render the list endpoint response as a GeoJSON FeatureCollection of the vehicles' last locations.
+    """
+    formatter = LocalTimeFormatter()
+    return (FEATURE_COLLECTION_JSON % ','.join([
+        render_point_feature(vehicle_id, last_location, formatter) for vehicle_id, last_location in vehicles
+    ])).encode('utf-8')
+
+
+def render_vehicle_detail_geojson(vehicle_id, last_location, location_history):
+    """
+    Render the detail endpoint response as a GeoJSON FeatureCollection.
+
+    The collection contains a Point feature of the last location and, if there is any location history, a
+    LineString feature of it, or a Point feature if there is only one location in the history.
+    """
+    formatter = LocalTimeFormatter()
+    features = [render_point_feature(vehicle_id, last_location, formatter)]
+    location_history = list(location_history)
+    if location_history:
+        features.append(render_history_feature(vehicle_id, location_history, formatter))
+    return (FEATURE_COLLECTION_JSON % ','.join(features)).encode('utf-8')
+
+
+def thin_locations(locations, temporal_resolution):
+    """
+    Yield (vehicle_id, timestamp, x, y, event_mask) tuples at least temporal_resolution seconds apart per vehicle.
+
+    The locations must be ordered by vehicle and timestamp.
+    """
+    resolution = timedelta(seconds=temporal_resolution)
+    previous_vehicle_id = next_timestamp = None
+
+    for location in locations:
+        vehicle_id, timestamp = location[:2]
+        if vehicle_id != previous_vehicle_id or timestamp >= next_timestamp:
+            previous_vehicle_id, next_timestamp = vehicle_id, timestamp + resolution
+            yield location
+
+
+def render_vehicle_history_start(prefix, vehicle_id, last_location, formatter):
+    return VEHICLE_HISTORY_START_JSON % (prefix, vehicle_id, render_locations((last_location,), formatter))
+
+
+def iterate_location_chunks(location_history, formatter, chunk_size, start=''):
+    """
+    Yield the location history and the end of a vehicle object rendered in chunks of at most chunk_size locations,
+    the first chunk starting with start.
+    """
+    chunk = [start]
+    format_timestamp = formatter.format
+    separator = ''
+
+    for timestamp, x, y, event_mask in location_history:
+        chunk.append(separator + LOCATION_JSON % (format_timestamp(timestamp), x, y, get_events_json(event_mask)))
+        separator = ','
+        if len(chunk) >= chunk_size:
+            yield ''.join(chunk).encode('utf-8')
+            chunk = []
+
+    chunk.append(']}')
+    yield ''.join(chunk).encode('utf-8')
+
+
+def render_vehicle_detail_stream(vehicle_id, last_location, location_history, chunk_size=1000):
+    """
+    Render the detail endpoint response incrementally, yielding bytes.
+
+    The content is the same as render_vehicle_detail() renders, but at most chunk_size locations of location_history
+    are rendered at a time, so it can be any iterable of (timestamp, x, y, event_mask) tuples. The beginning of the
+    response is yielded before location_history is read, so the response starts without waiting for the locations.
+    """
+    formatter = LocalTimeFormatter()
+    yield render_vehicle_history_start('', vehicle_id, last_location, formatter).encode('utf-8')
+    yield from iterate_location_chunks(location_history, formatter, chunk_size)
+
+
+def render_vehicle_histories(vehicles, locations, chunk_size=1000):
+    """
+    Render the multi-vehicle history endpoint response incrementally, yielding bytes.
+
+    vehicles should be (vehicle_id, last_location) pairs ordered by vehicle ID, last_location being a
+    (timestamp, x, y, event_mask) tuple. locations should be (vehicle_id, timestamp, x, y, event_mask) tuples ordered
+    by vehicle ID and timestamp. At most chunk_size locations are rendered at a time.
+    """
+    formatter = LocalTimeFormatter()
+    groups = itertools.groupby(locations, key=itemgetter(0))
+    group_vehicle_id, group = next(groups, (None, ()))
+
+    yield b'['
+    for index, (vehicle_id, last_location) in enumerate(vehicles):
+        location_history = ()
+        if vehicle_id == group_vehicle_id:
+            location_history = (location[1:] for location in group)
+        yield from iterate_location_chunks(location_history, formatter, chunk_size, start=render_vehicle_history_start(
+            ',' if index else '', vehicle_id, last_location, formatter
+        ))
+        if vehicle_id == group_vehicle_id:
+            group_vehicle_id, group = next(groups, (None, ()))
+    yield b']'
+
+
+def render_coverage(cells):
+    """
+    Render the coverage endpoint response from (cell, event_mask, timestamp, (xmin, ymin, xmax, ymax)) tuples.
+    """
+    format_timestamp = LocalTimeFormatter().format
+    return ('[%s]' % ','.join([
+        COVERAGE_CELL_JSON % ((cell, DECODED_EVENT_MASKS[event_mask][0], format_timestamp(timestamp)) + bounds)
+        for cell, event_mask, timestamp, bounds in cells
+    ])).encode('utf-8')
+
+
+def render_coverage_geojson(cells):
+    """
+    Render the coverage endpoint response as a GeoJSON FeatureCollection of the cells as Polygon features.
+    """
+    format_timestamp = LocalTimeFormatter().format
+    features = []
+    for cell, event_mask, timestamp, (x_min, y_min, x_max, y_max) in cells:
+        features.append(COVERAGE_FEATURE_JSON % (
+            x_min, y_min, x_max, y_min, x_max, y_max, x_min, y_max, x_min, y_min,
+            cell, DECODED_EVENT_MASKS[event_mask][0], format_timestamp(timestamp),
+        ))
+    return (FEATURE_COLLECTION_JSON % ','.join(features)).encode('utf-8')
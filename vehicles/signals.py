@@ -0,0 +1,6 @@
+from django.dispatch import Signal
+
+# Sent when published data changes, vehicle_ids being IDs of the vehicles whose last location was changed. It can be
+# empty when only location histories changed. The data is visible to others only after the current transaction has
+# been committed.
+locations_published = Signal(providing_args=['vehicle_ids'])
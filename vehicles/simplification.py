@@ -0,0 +1,85 @@
+"""
+Simplification of location histories with the Ramer-Douglas-Peucker algorithm.
+
+Every run of consecutive locations with the same events is simplified separately and the first and last locations of
+a run are always kept, so the spans of maintenance stay exact. Distances are calculated in meters on a local
+equirectangular projection, which is accurate enough for the extent of a single vehicle's history.
+"""
+import itertools
+import math
+from operator import itemgetter
+
+EARTH_RADIUS = 6371008.8  # mean radius in meters
+
+
+def project(locations):
+    """
+    Project (timestamp, x, y, event_mask) tuples in WGS84 to (x, y) tuples in meters.
+    """
+    if not locations:
+        return []
+    latitudes = [location[2] for location in locations]
+    scale = math.radians(1) * EARTH_RADIUS
+    x_scale = scale * math.cos(math.radians((min(latitudes) + max(latitudes)) / 2))
+    return [(location[1] * x_scale, location[2] * scale) for location in locations]
+
+
+def get_distance_to_segment(point, start, end):
+    dx, dy = end[0] - start[0], end[1] - start[1]
+    length_squared = dx * dx + dy * dy
+    if length_squared:
+        # projection of the point onto the segment, clamped to the segment's end points
+        t = max(0.0, min(1.0, ((point[0] - start[0]) * dx + (point[1] - start[1]) * dy) / length_squared))
+    else:
+        t = 0.0
+    return math.hypot(point[0] - start[0] - t * dx, point[1] - start[1] - t * dy)
+
+
+def simplify_run(points, first, last, tolerance, keep):
+    """
+    Mark points from first to last needed to keep the simplified line within tolerance of them.
+    """
+    keep[first] = keep[last] = True
+    stack = [(first, last)]
+
+    while stack:
+        first, last = stack.pop()
+        max_distance, max_index = -1.0, None
+        for index in range(first + 1, last):
+            distance = get_distance_to_segment(points[index], points[first], points[last])
+            if distance > max_distance:
+                max_distance, max_index = distance, index
+
+        if max_index is not None and max_distance > tolerance:
+            keep[max_index] = True
+            stack.append((first, max_index))
+            stack.append((max_index, last))
+
+
+def get_simplified_indices(locations, tolerance):
+    """
+    Return indices of the locations kept when simplifying (timestamp, x, y, event_mask) tuples with the given
+    tolerance in meters.
+    """
+    points = project(locations)
+    keep = [False] * len(locations)
+
+    run_start = 0
+    for index in range(1, len(locations) + 1):
+        if index == len(locations) or locations[index][3] != locations[run_start][3]:
+            simplify_run(points, run_start, index - 1, tolerance, keep)
+            run_start = index
+
+    return [index for index, kept in enumerate(keep) if kept]
+
+
+def simplify_location_histories(locations, tolerance):
+    """
+    Yield simplified (vehicle_id, timestamp, x, y, event_mask) tuples ordered by vehicle and timestamp.
+
+    Only the history of one vehicle at a time is held in memory.
+    """
+    for vehicle_id, group in itertools.groupby(locations, key=itemgetter(0)):
+        history = list(group)
+        for index in get_simplified_indices([location[1:] for location in history], tolerance):
+            yield history[index]
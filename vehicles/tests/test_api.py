@@ -1,11 +1,21 @@
+import json
+import re
 from datetime import datetime, timedelta
 
 import pytest
+from django.contrib.gis.geos import Point
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
+from rest_framework.test import APIClient
 
+from vehicles.api import encode_cursor
 from vehicles.factories import LocationFactory, VehicleFactory
-from vehicles.models import EventType, Location
-from vehicles.tests.utils import get_detail, get_list, get_location_data_from_obj, TWO_YEARS_IN_SECONDS
+from vehicles.models import Location
+from vehicles.tests.utils import (
+    get_detail, get_detail_url, get_list, get_location_data_from_obj, TWO_YEARS_IN_SECONDS, VEHICLE_LIST_URL
+)
 
 
 @pytest.fixture(autouse=True)
@@ -20,17 +30,11 @@ def vehicle():
 
 @pytest.fixture
 def locations_for_vehicle(vehicle):
-    locations = LocationFactory.create_batch(10, vehicle=vehicle)
-
-    for location in locations:
-        location.events.add(EventType.objects.get(identifier='au'))
-        location.events.add(EventType.objects.get(identifier='hi'))
+    LocationFactory.create_batch(10, vehicle=vehicle, events=['au', 'hi'])
 
 
 def test_list_and_detail_endpoint(vehicle, locations_for_vehicle):
     last_location = Location.objects.last()
-    last_location.events.add(EventType.objects.get(identifier='au'))
-    last_location.events.add(EventType.objects.get(identifier='hi'))
 
     expected_data = {
         'location_history': [],
@@ -119,6 +123,25 @@ def test_temporal_resolution(vehicle):
     assert len(data['location_history']) == 5
 
 
+@pytest.mark.parametrize('params, expected_offsets', (
+    ({'history': 10, 'temporal_resolution': 5}, [0, 7, 15, 30]),
+    ({'history': 6, 'temporal_resolution': 5}, [7, 15, 30]),
+    ({'since': '2000-02-18T10:00:03+02:00', 'temporal_resolution': 5}, [3, 8, 15, 30]),
+    ({'history': 10, 'temporal_resolution': 1}, [0, 1, 3, 4, 7, 8, 9, 15, 16, 30]),
+))
+def test_temporal_resolution_with_irregular_timestamps(vehicle, params, expected_offsets):
+    base_datetime = timezone.make_aware(datetime(2000, 2, 18, 10, 00))
+    for offset in (0, 1, 3, 4, 7, 8, 9, 15, 16, 30):
+        LocationFactory.create(vehicle=vehicle, timestamp=base_datetime + timedelta(seconds=offset))
+
+    data = get_detail(vehicle, params)
+
+    expected_timestamps = [
+        timezone.localtime(base_datetime + timedelta(seconds=offset)).isoformat() for offset in expected_offsets
+    ]
+    assert [location['timestamp'] for location in data['location_history']] == expected_timestamps
+
+
 def test_delay_in_list(settings):
     settings.STREET_MAINTENANCE_DELAY = TWO_YEARS_IN_SECONDS
 
@@ -143,3 +166,345 @@ def test_delay_in_detail(vehicle, settings):
 
     data = get_detail(vehicle, {'history': 100})
     assert len(data['location_history']) == 4
+
+
+@pytest.fixture
+def vehicles_around_turku():
+    vehicles = {}
+    for name, coords in (('center', (22.2670, 60.4518)), ('near', (22.2770, 60.4518)), ('far', (22.4000, 60.5000))):
+        vehicles[name] = VehicleFactory.create()
+        LocationFactory.create(vehicle=vehicles[name], coords=Point(*coords))
+    return vehicles
+
+
+@pytest.mark.parametrize('params, expected_vehicles', (
+    ({'bbox': '22.26,60.45,22.27,60.46'}, {'center'}),
+    ({'bbox': '22.26,60.45,22.28,60.46'}, {'center', 'near'}),
+    ({'bbox': '23.0,61.0,23.1,61.1'}, set()),
+    ({'near': '22.2670,60.4518', 'radius': 100}, {'center'}),
+    ({'near': '22.2670,60.4518', 'radius': 1000}, {'center', 'near'}),
+    ({'near': '22.2670,60.4518', 'radius': 20000}, {'center', 'near', 'far'}),
+    ({'bbox': '22.26,60.45,22.28,60.46', 'near': '22.2770,60.4518', 'radius': 100}, {'near'}),
+))
+def test_spatial_filters_in_list(vehicles_around_turku, params, expected_vehicles):
+    data = get_list(params)
+    assert {vehicle['id'] for vehicle in data} == {vehicles_around_turku[name].id for name in expected_vehicles}
+
+
+@pytest.mark.parametrize('params', (
+    {'bbox': '22.26,60.45,22.28,60.46'},
+    {'near': '22.2670,60.4518', 'radius': 1000},
+))
+@pytest.mark.parametrize('temporal_resolution', (None, 1))
+def test_spatial_filters_in_detail(vehicle, params, temporal_resolution):
+    base_datetime = timezone.make_aware(datetime(2000, 2, 18, 10, 00))
+    for offset, coords in enumerate(((22.2670, 60.4518), (22.4000, 60.5000), (22.2770, 60.4518), (22.4, 60.5))):
+        LocationFactory.create(vehicle=vehicle, timestamp=base_datetime + timedelta(seconds=offset),
+                               coords=Point(*coords))
+    params = dict(params, history=10)
+    if temporal_resolution:
+        params['temporal_resolution'] = temporal_resolution
+
+    data = get_detail(vehicle, params)
+
+    assert [location['coords'] for location in data['location_history']] == [[22.2670, 60.4518], [22.2770, 60.4518]]
+    # the last location is not affected by the filters
+    assert data['last_location']['coords'] == [22.4, 60.5]
+
+
+@pytest.mark.parametrize('params', (
+    {'bbox': '22.26,60.45,22.28'},
+    {'bbox': '22.28,60.45,22.26,60.46'},
+    {'bbox': 'foo'},
+    {'near': '22.2670,60.4518'},
+    {'near': '22.2670', 'radius': 100},
+    {'near': '22.2670,60.4518', 'radius': -1},
+    {'radius': 100},
+))
+def test_invalid_spatial_filters(params):
+    response = APIClient().get(VEHICLE_LIST_URL, params)
+    assert response.status_code == 400
+
+
+def test_event_filter_in_list():
+    vehicles = {}
+    for name, events in (('plowing', ['au']), ('salting', ['su', 'hi']), ('washing', ['pe']), ('idle', [])):
+        vehicles[name] = VehicleFactory.create()
+        LocationFactory.create(vehicle=vehicles[name], events=events)
+
+    data = get_list({'event': 'au,su'})
+    assert {vehicle['id'] for vehicle in data} == {vehicles['plowing'].id, vehicles['salting'].id}
+
+    data = get_list({'event': 'pe'})
+    assert {vehicle['id'] for vehicle in data} == {vehicles['washing'].id}
+
+
+@pytest.mark.parametrize('temporal_resolution', (None, 1))
+def test_event_filter_in_detail(vehicle, temporal_resolution):
+    base_datetime = timezone.make_aware(datetime(2000, 2, 18, 10, 00))
+    for offset, events in enumerate((['au'], [], ['su', 'hi'], ['pe'], ['au', 'su'], [])):
+        LocationFactory.create(vehicle=vehicle, timestamp=base_datetime + timedelta(seconds=offset), events=events)
+    params = {'history': 10, 'event': 'au,su'}
+    if temporal_resolution:
+        params['temporal_resolution'] = temporal_resolution
+
+    data = get_detail(vehicle, params)
+
+    assert [location['events'] for location in data['location_history']] == [['au'], ['su', 'hi'], ['au', 'su']]
+    assert data['last_location']['events'] == []
+
+
+def test_event_filter_with_history(vehicle):
+    base_datetime = timezone.make_aware(datetime(2000, 2, 18, 10, 00))
+    for offset, events in enumerate((['au'], ['su'], ['au'], [], ['au'])):
+        LocationFactory.create(vehicle=vehicle, timestamp=base_datetime + timedelta(seconds=offset), events=events)
+
+    data = get_detail(vehicle, {'history': 2, 'event': 'au'})
+
+    expected_timestamps = [
+        timezone.localtime(base_datetime + timedelta(seconds=offset)).isoformat() for offset in (2, 4)
+    ]
+    assert [location['timestamp'] for location in data['location_history']] == expected_timestamps
+
+
+def test_invalid_event_filter():
+    response = APIClient().get(VEHICLE_LIST_URL, {'event': 'au,foo'})
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize('params, expected_offsets', (
+    ({'history': 10, 'simplify': 10}, [0, 5, 6, 9]),
+    ({'history': 10, 'simplify': 1}, [0, 1, 2, 3, 5, 6, 9]),
+    ({'page_size': 4, 'simplify': 10}, [0, 3]),
+))
+def test_simplify_in_detail(vehicle, params, expected_offsets):
+    base_datetime = timezone.make_aware(datetime(2000, 2, 18, 10, 00))
+    # a straight line along a latitude with a 5 meter bump at offset 2 and an event change after offset 5
+    for offset in range(10):
+        LocationFactory.create(
+            vehicle=vehicle, timestamp=base_datetime + timedelta(seconds=offset), events=['au'] if offset < 6 else [],
+            coords=Point(22.25 + offset * 0.001, 60.45 + (0.000045 if offset == 2 else 0)),
+        )
+
+    data = get_detail(vehicle, params)
+
+    expected_timestamps = [
+        timezone.localtime(base_datetime + timedelta(seconds=offset)).isoformat() for offset in expected_offsets
+    ]
+    assert [location['timestamp'] for location in data['location_history']] == expected_timestamps
+
+
+@pytest.mark.parametrize('params', (
+    {'history': 10, 'simplify': 'foo'},
+    {'history': 10, 'simplify': -1},
+    {'history': 10, 'simplify': 'inf'},
+    {'history': 10, 'simplify': 1, 'stream': 1},
+))
+def test_invalid_simplify(vehicle, params):
+    response = APIClient().get(get_detail_url(vehicle), params)
+    assert response.status_code == 400
+
+
+def get_pages(url, params):
+    """
+    Return the data of every page of a paginated response by following the next links.
+    """
+    api_client = APIClient()
+    pages = []
+    response = api_client.get(url, params)
+    while True:
+        assert response.status_code == 200
+        pages.append(json.loads(response.content.decode('utf-8')))
+        if not response.has_header('Link'):
+            return pages
+        next_url = re.match(r'<(.*)>; rel="next"', response['Link']).group(1)
+        response = api_client.get(next_url)
+
+
+def test_list_pagination():
+    base_datetime = timezone.make_aware(datetime(2000, 2, 18, 10, 00))
+    vehicles = VehicleFactory.create_batch(7)
+    for vehicle, offset in zip(vehicles, (0, 1, 2, 2, 2, 3, 4)):
+        LocationFactory.create(vehicle=vehicle, timestamp=base_datetime + timedelta(seconds=offset))
+
+    pages = get_pages(VEHICLE_LIST_URL, {'page_size': 2})
+
+    assert [len(page) for page in pages] == [2, 2, 2, 1]
+    expected_ids = [vehicle.id for vehicle in sorted(
+        vehicles, key=lambda vehicle: (vehicle.last_location.timestamp, vehicle.id), reverse=True
+    )]
+    assert [vehicle['id'] for page in pages for vehicle in page] == expected_ids
+
+
+def test_list_pagination_with_filters():
+    base_datetime = timezone.make_aware(datetime(2000, 2, 18, 10, 00))
+    for offset in range(6):
+        LocationFactory.create(timestamp=base_datetime + timedelta(seconds=offset), events=['au'] if offset % 2 else [])
+
+    pages = get_pages(VEHICLE_LIST_URL, {'page_size': 2, 'event': 'au'})
+
+    assert [[vehicle['last_location']['events'] for vehicle in page] for page in pages] == [[['au'], ['au']], [['au']]]
+
+
+@pytest.mark.parametrize('params, expected_pages', (
+    ({'page_size': 4}, [[0, 1, 3, 4], [7, 8, 9, 15], [16, 30]]),
+    ({'page_size': 5}, [[0, 1, 3, 4, 7], [8, 9, 15, 16, 30]]),
+    ({'page_size': 3, 'since': '2000-02-18T10:00:08+02:00'}, [[8, 9, 15], [16, 30]]),
+    ({'page_size': 2, 'temporal_resolution': 5}, [[0, 7], [15, 30]]),
+    ({'page_size': 3, 'temporal_resolution': 5, 'since': '2000-02-18T10:00:03+02:00'}, [[3, 8, 15], [30]]),
+))
+def test_location_history_pagination(vehicle, params, expected_pages):
+    base_datetime = timezone.make_aware(datetime(2000, 2, 18, 10, 00))
+    for offset in (0, 1, 3, 4, 7, 8, 9, 15, 16, 30):
+        LocationFactory.create(vehicle=vehicle, timestamp=base_datetime + timedelta(seconds=offset))
+
+    pages = get_pages(get_detail_url(vehicle), params)
+
+    expected_timestamps = [
+        [timezone.localtime(base_datetime + timedelta(seconds=offset)).isoformat() for offset in page]
+        for page in expected_pages
+    ]
+    assert [[location['timestamp'] for location in page['location_history']] for page in pages] == expected_timestamps
+
+
+def test_page_size_is_bounded(vehicle, settings):
+    settings.STREET_MAINTENANCE_MAX_PAGE_SIZE = 3
+    LocationFactory.create_batch(5, vehicle=vehicle)
+
+    data = get_detail(vehicle, {'page_size': 100})
+
+    assert len(data['location_history']) == 3
+
+
+@pytest.mark.parametrize('params', (
+    {'page_size': 0},
+    {'page_size': 'foo'},
+    {'cursor': 'foo'},
+    {'cursor': '!!!'},
+    {'page_size': 2, 'history': 3},
+))
+def test_invalid_pagination(vehicle, params):
+    LocationFactory.create(vehicle=vehicle)
+    response = APIClient().get(get_detail_url(vehicle), params)
+    assert response.status_code == 400
+
+
+def test_cursors_are_not_interchangeable(vehicle):
+    LocationFactory.create_batch(3, vehicle=vehicle)
+    api_client = APIClient()
+
+    list_cursor = encode_cursor(timezone.now(), vehicle.id)
+    detail_cursor = encode_cursor(timezone.now())
+
+    assert api_client.get(get_detail_url(vehicle), {'cursor': list_cursor}).status_code == 400
+    assert api_client.get(VEHICLE_LIST_URL, {'cursor': detail_cursor}).status_code == 400
+
+
+VEHICLE_HISTORY_URL = reverse('v1:vehicle-history')
+
+
+def get_histories(params):
+    response = APIClient().get(VEHICLE_HISTORY_URL, params)
+    assert response.status_code == 200
+    return json.loads(b''.join(response.streaming_content).decode('utf-8'))
+
+
+@pytest.fixture
+def vehicles_with_histories():
+    base_datetime = timezone.make_aware(datetime(2000, 2, 18, 10, 00))
+    vehicles = VehicleFactory.create_batch(4)
+    for index, vehicle in enumerate(vehicles):
+        for offset in (0, 1, 3, 4, 7, 8, 9, 15, 16, 30)[index:]:
+            LocationFactory.create(vehicle=vehicle, timestamp=base_datetime + timedelta(seconds=offset + index),
+                                   events=['au'] if offset % 2 else ['su'])
+    # a vehicle without published locations
+    VehicleFactory.create(data_source=vehicles[0].data_source)
+    return vehicles
+
+
+@pytest.mark.parametrize('params', (
+    {'history': 3},
+    {'history': 100},
+    {'since': '2000-02-18T10:00:08+02:00'},
+    {'since': '2000-02-18T10:00:08+02:00', 'history': 4},
+    {'history': 100, 'temporal_resolution': 5},
+    {'since': '2000-02-18T10:00:03+02:00', 'temporal_resolution': 5},
+    {'history': 5, 'event': 'au'},
+    {'history': 100, 'simplify': 10},
+))
+def test_multi_vehicle_history_matches_details(vehicles_with_histories, params):
+    ids = ','.join(str(vehicle.id) for vehicle in vehicles_with_histories[1:])
+
+    data = get_histories(dict(params, ids=ids))
+
+    assert data == [get_detail(vehicle, params) for vehicle in vehicles_with_histories[1:]]
+
+
+def test_multi_vehicle_history_by_data_source(vehicles_with_histories):
+    data_source = vehicles_with_histories[0].data_source
+
+    data = get_histories({'data_source': data_source.id, 'history': 2})
+
+    assert [vehicle['id'] for vehicle in data] == [vehicles_with_histories[0].id]
+    assert len(data[0]['location_history']) == 2
+
+
+def test_multi_vehicle_history_query_count(vehicles_with_histories):
+    query_counts = []
+    for vehicles in (vehicles_with_histories[:1], vehicles_with_histories):
+        with CaptureQueriesContext(connection) as context:
+            get_histories({'ids': ','.join(str(vehicle.id) for vehicle in vehicles), 'history': 100})
+        query_counts.append(len(context))
+
+    assert query_counts[0] == query_counts[1]
+
+
+@pytest.mark.parametrize('params', (
+    {'history': 3},
+    {'ids': '1,foo', 'history': 3},
+    {'ids': '1,2'},
+    {'ids': '1,2', 'history': 3, 'page_size': 10},
+))
+def test_invalid_multi_vehicle_history(params):
+    response = APIClient().get(VEHICLE_HISTORY_URL, params)
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize('params', (
+    {},
+    {'history': 3},
+    {'since': '2000-02-18T09:59:58+02:00'},
+    {'history': 3, 'temporal_resolution': 1},
+    {'history': 3, 'format': 'geojson'},
+))
+def test_detail_query_count_does_not_depend_on_vehicle_lifetime(params):
+    end = timezone.make_aware(datetime(2000, 2, 18, 10, 00))
+    query_counts = []
+
+    for location_count in (5, 50):
+        vehicle = VehicleFactory.create()
+        for offset in range(location_count, 0, -1):
+            LocationFactory.create(vehicle=vehicle, timestamp=end - timedelta(seconds=offset - 1), events=['au'])
+
+        with CaptureQueriesContext(connection) as context:
+            response = APIClient().get(get_detail_url(vehicle), params)
+        assert response.status_code == 200
+        assert not any('eventtype' in query['sql'] for query in context.captured_queries)
+        query_counts.append(len(context))
+
+    assert query_counts[0] == query_counts[1]
+
+
+@pytest.mark.parametrize('params', (
+    {},
+    {'since': '2000-02-18T10:00:00+02:00', 'event': 'au'},
+    {'bbox': '20,60,23,62'},
+    {'page_size': 1},
+))
+def test_list_does_not_touch_locations(vehicles_with_histories, params):
+    with CaptureQueriesContext(connection) as context:
+        response = APIClient().get(VEHICLE_LIST_URL, params)
+
+    assert response.status_code == 200
+    assert len(context) == 1
+    assert 'vehicles_location' not in context.captured_queries[0]['sql']
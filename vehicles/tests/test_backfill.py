@@ -0,0 +1,140 @@
+import gzip
+import json
+from datetime import datetime
+
+import pytest
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.utils import timezone
+
+from vehicles import importers
+from vehicles.importers.backfill import BackfillLoader, read_payloads
+from vehicles.importers.kuntoturku import KuntoTurkuImporter
+from vehicles.importers.maponturku import MaponImporter
+from vehicles.models import CoverageCell, Location, PendingLocation, Vehicle
+from vehicles.tests.test_importers import FETCHED_DATA_1, FETCHED_DATA_2
+
+
+@pytest.fixture(autouse=True)
+def default_settings(settings):
+    settings.STREET_MAINTENANCE_DELAY = 15 * 60
+    settings.STREET_MAINTENANCE_IGNORE_LOCATIONS_WITHOUT_EVENTS = True
+
+
+@pytest.fixture
+def importer(monkeypatch):
+    importer = KuntoTurkuImporter({'URL': 'https://api.dummy.com/v1/'})
+    monkeypatch.setattr(importers, '_importers', {importer.id: importer})
+    return importer
+
+
+def write_payloads(path, payloads):
+    with gzip.open(str(path), 'wt', encoding='utf-8') as f:
+        for payload in payloads:
+            f.write(json.dumps(payload) + '\n')
+    return str(path)
+
+
+def test_read_payloads(tmpdir):
+    path = tmpdir.join('payloads.jsonl')
+    path.write(json.dumps(FETCHED_DATA_1) + '\n\n' + json.dumps(FETCHED_DATA_2) + '\n')
+
+    assert list(read_payloads(str(path))) == [FETCHED_DATA_1, FETCHED_DATA_2]
+    assert list(read_payloads(write_payloads(tmpdir.join('payloads.jsonl.gz'), [FETCHED_DATA_1]))) == [FETCHED_DATA_1]
+
+
+@pytest.mark.parametrize('batch_size', (1, 100))
+def test_backfill(importer, batch_size):
+    loader = BackfillLoader(importer, batch_size=batch_size)
+
+    vehicle_ids = loader.load([FETCHED_DATA_1, FETCHED_DATA_2])
+
+    assert loader.stats == {'locations': 4, 'ignored_locations': 0, 'new_locations': 3}
+    assert set(vehicle_ids) == set(Vehicle.objects.values_list('id', flat=True))
+    vehicle = Vehicle.objects.get(origin_id='456')
+    assert vehicle.locations.count() == 2
+    assert vehicle.last_location == vehicle.locations.last()
+    assert vehicle.last_location.timestamp == timezone.make_aware(datetime(2017, 2, 18, 13, 15))
+    assert vehicle.last_location.events == ['hi', 'pe']
+
+
+def test_backfill_is_idempotent(importer):
+    BackfillLoader(importer).load([FETCHED_DATA_1, FETCHED_DATA_2])
+    loader = BackfillLoader(importer)
+
+    loader.load([FETCHED_DATA_1, FETCHED_DATA_2])
+
+    assert loader.stats['new_locations'] == 0
+    assert Location.objects.count() == 3
+
+
+def test_backfill_queues_locations_inside_delay(importer):
+    timestamp = timezone.localtime(timezone.now().replace(microsecond=0))
+    payload = [dict(FETCHED_DATA_1[0], last_location=dict(
+        FETCHED_DATA_1[0]['last_location'], timestamp=timestamp.strftime('%Y-%m-%d %H:%M:%S')
+    ))]
+
+    BackfillLoader(importer).load([FETCHED_DATA_1, payload])
+
+    vehicle = Vehicle.objects.get(origin_id='123')
+    assert vehicle.locations.count() == 2
+    assert vehicle.last_location.timestamp == timezone.make_aware(datetime(2017, 2, 18, 12, 00))
+    assert PendingLocation.objects.get().timestamp == timestamp
+
+
+def test_backfill_cutoff_is_checked_for_every_batch(importer, settings):
+    timestamp = timezone.localtime(timezone.now().replace(microsecond=0))
+    payload = [dict(FETCHED_DATA_1[0], last_location=dict(
+        FETCHED_DATA_1[0]['last_location'], timestamp=timestamp.strftime('%Y-%m-%d %H:%M:%S')
+    ))]
+    loader = BackfillLoader(importer)
+
+    # as if the location had come due while the backfill was running
+    settings.STREET_MAINTENANCE_DELAY = None
+    loader.load([payload])
+
+    assert not PendingLocation.objects.exists()
+    assert Vehicle.objects.get().last_location.timestamp == timestamp
+
+
+def test_backfill_records_due_locations_in_coverage(importer):
+    timestamp = timezone.localtime(timezone.now().replace(microsecond=0))
+    payload = [dict(FETCHED_DATA_1[0], last_location=dict(
+        FETCHED_DATA_1[0]['last_location'], timestamp=timestamp.strftime('%Y-%m-%d %H:%M:%S'),
+        coords='(22.26 60.45)',
+    ))]
+
+    BackfillLoader(importer).load([FETCHED_DATA_1, payload])
+
+    # the location inside the delay is recorded only when it is published
+    assert set(CoverageCell.objects.values_list('timestamp', flat=True)) == {
+        timezone.make_aware(datetime(2017, 2, 18, 12, 00)), timezone.make_aware(datetime(2017, 2, 18, 13, 00))
+    }
+
+
+def test_mapon_archived_records_are_not_filtered_by_age():
+    importer = MaponImporter({'URL': 'https://api.dummy.com/v1/'})
+    payload = {'data': {'units': [{
+        'unit_id': 1, 'last_update': '2017-02-18T10:00:00Z', 'lat': 60.45, 'lng': 22.26,
+        'io_din': [{'state': 1, 'label': 'Auraus'}],
+    }]}}
+
+    assert list(importer.get_location_records(payload)) == []
+    assert len(list(importer.get_archived_location_records(payload))) == 1
+
+
+def test_backfill_command(importer, tmpdir):
+    paths = [
+        write_payloads(tmpdir.join('1.jsonl.gz'), [FETCHED_DATA_1]),
+        write_payloads(tmpdir.join('2.jsonl.gz'), [FETCHED_DATA_2]),
+    ]
+
+    call_command('backfill', 'kuntoturku', *paths, batch_size=2)
+
+    assert Location.objects.count() == 3
+    assert Vehicle.objects.filter(last_location__isnull=False).count() == 2
+
+
+def test_backfill_command_unknown_importer(importer, tmpdir):
+    with pytest.raises(CommandError):
+        call_command('backfill', 'foo', write_payloads(tmpdir.join('1.jsonl.gz'), [FETCHED_DATA_1]))
@@ -0,0 +1,108 @@
+import gzip
+import json
+import os
+from datetime import datetime, timedelta
+from unittest.mock import Mock
+
+import pytest
+import pytz
+from django.core.management import call_command
+
+from vehicles import importers
+from vehicles.importers.capture import get_payload_capture, PayloadCapture, read_captured_payloads
+from vehicles.importers.http import FeedSession
+from vehicles.importers.kuntoturku import KuntoTurkuImporter
+from vehicles.importers.maponturku import MaponImporter
+from vehicles.models import Location, Vehicle
+from vehicles.tests.test_importers import FETCHED_DATA_1, FETCHED_DATA_2
+
+START = datetime(2017, 2, 18, 10, 0, tzinfo=pytz.utc)
+
+
+@pytest.fixture(autouse=True)
+def default_settings(settings):
+    settings.STREET_MAINTENANCE_DELAY = None
+
+
+def capture_payloads(directory, payloads, **kwargs):
+    capture = PayloadCapture(str(directory), **kwargs)
+    for index, payload in enumerate(payloads):
+        capture.write(json.dumps(payload), fetched_at=START + timedelta(seconds=index))
+    capture.close()
+
+
+def test_payload_capture_is_disabled_by_default(settings):
+    settings.STREET_MAINTENANCE_CAPTURE_DIRECTORY = None
+    assert get_payload_capture('kuntoturku') is None
+
+
+def test_feed_session_captures_payloads(tmpdir):
+    capture = PayloadCapture(str(tmpdir))
+    session = FeedSession(timeout=1, capture=capture)
+    content = json.dumps(FETCHED_DATA_1)
+    session.session.get = Mock(return_value=Mock(status_code=200, headers={}, text=content,
+                                                 json=Mock(return_value=FETCHED_DATA_1)))
+
+    assert session.get_json('https://api.dummy.com/v1/') == FETCHED_DATA_1
+    capture.close()
+
+    assert [payload for fetched_at, payload in read_captured_payloads([str(tmpdir)])] == [content]
+
+
+def test_segments_are_rotated(tmpdir):
+    payloads = [{'index': index} for index in range(5)]
+
+    capture_payloads(tmpdir, payloads, segment_size=100)
+
+    assert len(tmpdir.listdir()) == 3
+    assert [
+        (fetched_at, json.loads(content)) for fetched_at, content in read_captured_payloads([str(tmpdir)])
+    ] == [(START + timedelta(seconds=index), payload) for index, payload in enumerate(payloads)]
+
+
+def test_read_payload_range(tmpdir):
+    capture_payloads(tmpdir, [{'index': index} for index in range(5)], segment_duration=2)
+
+    payloads = read_captured_payloads([str(tmpdir)], since=START + timedelta(seconds=1),
+                                      until=START + timedelta(seconds=4))
+    assert [json.loads(content)['index'] for fetched_at, content in payloads] == [1, 2, 3]
+
+
+def test_read_truncated_segment(tmpdir):
+    path = str(tmpdir.join('20170218T100000000000Z.jsonl.gz'))
+    with gzip.open(path, 'wt', encoding='utf-8') as f:
+        f.write(json.dumps({'fetched_at': '2017-02-18T10:00:00.000000Z', 'content': '[]'}) + '\n')
+        f.flush()
+    with open(path, 'rb+') as f:
+        f.truncate(os.path.getsize(path) - 4)
+
+    assert [content for fetched_at, content in read_captured_payloads([path])] == ['[]']
+
+
+def test_replay_payloads(tmpdir, monkeypatch):
+    importer = KuntoTurkuImporter({'URL': 'https://api.dummy.com/v1/'})
+    monkeypatch.setattr(importers, '_importers', {importer.id: importer})
+    capture_payloads(tmpdir, [FETCHED_DATA_1, FETCHED_DATA_2])
+
+    call_command('replay_payloads', 'kuntoturku', str(tmpdir))
+
+    assert Vehicle.objects.count() == 2
+    assert Location.objects.count() == 3
+
+
+def test_replay_old_mapon_payloads(tmpdir, monkeypatch):
+    importer = MaponImporter({'URL': 'https://api.dummy.com/v1/'})
+    monkeypatch.setattr(importers, '_importers', {importer.id: importer})
+    capture_payloads(tmpdir, [
+        {'data': {'units': [
+            {'unit_id': 1, 'last_update': '2017-02-18T10:00:00Z', 'lat': 60.45, 'lng': 22.26,
+             'io_din': [{'state': 1, 'label': 'Auraus'}]},
+        ]}},
+    ])
+
+    # the live import would skip locations this old as stale
+    call_command('replay_payloads', 'maponturku', str(tmpdir))
+
+    location = Location.objects.get()
+    assert location.vehicle.origin_id == '1'
+    assert location.timestamp == START
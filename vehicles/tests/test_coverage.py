@@ -0,0 +1,112 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from django.contrib.gis.geos import Point
+from django.core.urlresolvers import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from vehicles.factories import LocationFactory, VehicleFactory
+from vehicles.models import CoverageCell
+from vehicles.publication import publish_due_locations
+
+COVERAGE_URL = reverse('v1:vehicle-coverage')
+
+BBOX = '22.2,60.4,22.3,60.5'
+
+
+@pytest.fixture(autouse=True)
+def default_settings(settings):
+    settings.STREET_MAINTENANCE_DELAY = None
+
+
+def get_coverage(params):
+    response = APIClient().get(COVERAGE_URL, params)
+    assert response.status_code == 200
+    return json.loads(response.content.decode('utf-8'))
+
+
+def create_location(timestamp, events, coords=(22.26, 60.45), vehicle=None):
+    return LocationFactory.create(
+        vehicle=vehicle or VehicleFactory.create(), timestamp=timestamp, events=events, coords=Point(*coords)
+    )
+
+
+def test_coverage():
+    base_datetime = timezone.make_aware(datetime(2000, 2, 18, 10, 00))
+    vehicle = VehicleFactory.create()
+    create_location(base_datetime, ['au'], vehicle=vehicle)
+    create_location(base_datetime + timedelta(seconds=1), ['au', 'su'], vehicle=vehicle)
+    # an older location of another vehicle doesn't replace the timestamp
+    create_location(base_datetime - timedelta(seconds=1), ['au'])
+    create_location(base_datetime, ['hi'], coords=(22.28, 60.45))
+    create_location(base_datetime, [], coords=(22.29, 60.45))
+
+    data = get_coverage({'bbox': BBOX})
+
+    timestamp = timezone.localtime(base_datetime).isoformat()
+    newer_timestamp = timezone.localtime(base_datetime + timedelta(seconds=1)).isoformat()
+    assert [(cell['event'], cell['timestamp']) for cell in data] == [
+        ('au', newer_timestamp), ('su', newer_timestamp), ('hi', timestamp)
+    ]
+    assert data[0]['cell'] == data[1]['cell'] != data[2]['cell']
+    assert all(len(cell['cell']) == 7 for cell in data)
+    x_min, y_min, x_max, y_max = data[0]['bbox']
+    assert x_min < 22.26 < x_max and y_min < 60.45 < y_max
+
+
+@pytest.mark.parametrize('params, expected_events', (
+    ({'bbox': BBOX, 'event': 'su,hi'}, ['su', 'hi']),
+    ({'bbox': BBOX, 'since': '2000-02-18T10:00:00+02:00'}, ['au', 'su']),
+    ({'bbox': '22.27,60.4,22.3,60.5'}, ['hi']),
+    ({'bbox': '22.3,60.4,22.4,60.5'}, []),
+))
+def test_coverage_filters(params, expected_events):
+    base_datetime = timezone.make_aware(datetime(2000, 2, 18, 10, 00))
+    create_location(base_datetime, ['au', 'su'])
+    create_location(base_datetime - timedelta(hours=1), ['hi'], coords=(22.28, 60.45))
+
+    data = get_coverage(params)
+
+    assert [cell['event'] for cell in data] == expected_events
+
+
+def test_coverage_respects_delay(settings):
+    settings.STREET_MAINTENANCE_DELAY = 60 * 60
+    create_location(timezone.now() - timedelta(minutes=30), ['au'])
+
+    assert get_coverage({'bbox': BBOX}) == []
+
+    settings.STREET_MAINTENANCE_DELAY = 10 * 60
+    publish_due_locations()
+
+    assert [cell['event'] for cell in get_coverage({'bbox': BBOX})] == ['au']
+
+
+def test_coverage_geojson():
+    create_location(timezone.make_aware(datetime(2000, 2, 18, 10, 00)), ['au'])
+    cell = CoverageCell.objects.get()
+
+    response = APIClient().get(COVERAGE_URL, {'bbox': BBOX, 'format': 'geojson'})
+
+    assert response.status_code == 200
+    feature = json.loads(response.content.decode('utf-8'))['features'][0]
+    assert feature['properties']['cell'] == cell.cell
+    assert feature['properties']['event'] == 'au'
+    assert Point(22.26, 60.45, srid=4326).within(cell.bounds)
+    x_min, y_min, x_max, y_max = cell.bounds.extent
+    assert feature['geometry']['coordinates'] == [
+        [[x_min, y_min], [x_max, y_min], [x_max, y_max], [x_min, y_max], [x_min, y_min]]
+    ]
+
+
+@pytest.mark.parametrize('params, expected_status', (
+    ({}, 400),
+    ({'bbox': '22.3,60.4,22.2,60.5'}, 400),
+    ({'bbox': BBOX, 'event': 'foo'}, 400),
+    ({'bbox': BBOX, 'format': 'polyline'}, 406),
+))
+def test_invalid_coverage(params, expected_status):
+    response = APIClient().get(COVERAGE_URL, params)
+    assert response.status_code == expected_status
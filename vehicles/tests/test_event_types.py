@@ -1,4 +1,8 @@
+import pytest
+
 from vehicles.constants import EVENT_TYPES
+from vehicles.events import decode_events, encode_events
+from vehicles.factories import LocationFactory
 from vehicles.models import EventType
 from vehicles.utils import populate_event_types
 
@@ -36,3 +40,22 @@ def test_other_event_types_arent_affected_by_populate_event_types():
     new_event_type = EventType.objects.get(identifier='xxx')
     assert new_event_type.name_fi == 'uusi tyyppi'
     assert new_event_type.name_en == 'new type'
+
+
+def test_event_mask_encoding():
+    assert encode_events([]) == 0
+    assert decode_events(0) == []
+
+    mask = encode_events(['hi', 'au', 'ha'])
+    assert decode_events(mask) == ['au', 'hi', 'ha']  # in the order of EVENT_TYPES
+
+    with pytest.raises(ValueError):
+        encode_events(['xxx'])
+
+
+def test_location_events():
+    location = LocationFactory.create(events=['su', 'au'])
+    location.refresh_from_db()
+
+    assert location.events == ['au', 'su']
+    assert location.event_mask == encode_events(['au', 'su'])
@@ -1,14 +1,22 @@
+import asyncio
+import threading
+import time
 from datetime import datetime
 from unittest.mock import Mock
 
 import pytest
 from django.conf import ImproperlyConfigured
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
 from vehicles.importers import get_importer_by_id, register_importer, register_importers_from_settings
 from vehicles.importers.base import BaseVehicleImporter
+from vehicles.importers.daemon import IngestDaemon
+from vehicles.importers.fingerprints import FingerprintCache
+from vehicles.importers.http import FeedSession
 from vehicles.importers.kuntoturku import KuntoTurkuImporter
-from vehicles.models import DataSource, Vehicle
+from vehicles.models import DataSource, Location, Vehicle
 
 FETCHED_DATA_1 = [
     {
@@ -100,6 +108,30 @@ def test_automatic_registering():
     assert importer.settings['URL'] == 'https://api.dummy.com/v1/'
 
 
+def test_registering_makes_no_queries():
+    from vehicles import importers
+    importers._importers = {}
+
+    with CaptureQueriesContext(connection) as context:
+        register_importers_from_settings()
+        KuntoTurkuImporter({'URL': 'https://api.dummy.com/v1/'})
+
+    assert len(context) == 0
+    assert not DataSource.objects.exists()
+
+
+def test_data_source_is_created_on_first_import():
+    importer = KuntoTurkuImporter({'URL': 'https://api.dummy.com/v1/'})
+    importer.fetch_data = Mock(return_value=FETCHED_DATA_1)
+
+    importer.run()
+    assert DataSource.objects.filter(id=KuntoTurkuImporter.id).count() == 1
+
+    with CaptureQueriesContext(connection) as context:
+        importer.data_source
+    assert len(context) == 0
+
+
 def test_kunto_turku_importer_url_required():
     with pytest.raises(ImproperlyConfigured):
         # URL missing
@@ -124,7 +156,7 @@ def test_kunto_turku_importer_basic_import():
     assert location.timestamp == timezone.make_aware(datetime(2017, 2, 18, 12, 00, 00))
     assert round(location.coords.x) == 20
     assert round(location.coords.y) == 60
-    assert {event.identifier for event in location.events.all()} == {'au'}
+    assert location.events == ['au']
 
 
 def test_kuntoturku_importer_two_imports():
@@ -151,9 +183,166 @@ def test_kuntoturku_importer_two_imports():
     # should not be affected
     old_location = second_vehicle.locations.first()
     assert old_location.timestamp == timezone.make_aware(datetime(2017, 2, 18, 13, 00, 00))
-    assert {event.identifier for event in old_location.events.all()} == {'au'}
+    assert old_location.events == ['au']
 
     # should be the new location
     new_location = second_vehicle.locations.last()
     assert new_location.timestamp == timezone.make_aware(datetime(2017, 2, 18, 13, 15, 00))
-    assert {event.identifier for event in new_location.events.all()} == {'pe', 'hi'}
+    assert set(new_location.events) == {'pe', 'hi'}
+
+
+def _get_fetched_data(num_of_vehicles):
+    return [
+        {
+            'id': i,
+            'machine_type': 'kuorma-auto',
+            'last_location': {
+                'timestamp': '2017-02-18 12:00:00',
+                'coords': '(20.2325767544403 60.3134866561725)',
+                'events': ['Auraus', 'Hiekoitus'],
+            }
+        } for i in range(num_of_vehicles)
+    ]
+
+
+def _count_update_models_queries(importer, vehicle_data):
+    with CaptureQueriesContext(connection) as context:
+        importer.update_models(vehicle_data)
+    return len(context.captured_queries)
+
+
+def test_importer_number_of_queries_does_not_depend_on_number_of_vehicles():
+    importer = KuntoTurkuImporter({'URL': 'https://api.dummy.com/v1/'})
+
+    num_of_queries = _count_update_models_queries(importer, _get_fetched_data(2))
+    assert _count_update_models_queries(importer, _get_fetched_data(50)) == num_of_queries
+
+    assert Vehicle.objects.count() == 50
+    assert Location.objects.count() == 50
+    for vehicle in Vehicle.objects.all():
+        assert vehicle.last_location.events == ['au', 'hi']
+
+
+def test_importer_skips_unchanged_locations():
+    importer = KuntoTurkuImporter({'URL': 'https://api.dummy.com/v1/'})
+
+    importer.fetch_data = Mock(return_value=FETCHED_DATA_1)
+    importer.run()
+    assert importer.stats['unchanged_locations'] == 0
+    assert importer.stats['new_locations'] == 2
+
+    with CaptureQueriesContext(connection) as context:
+        importer.run()
+    assert len(context.captured_queries) == 0
+    assert importer.stats['unchanged_locations'] == 2
+    assert importer.stats['new_locations'] == 0
+
+    importer.fetch_data = Mock(return_value=FETCHED_DATA_2)
+    importer.run()
+    assert importer.stats['unchanged_locations'] == 1
+    assert importer.stats['new_locations'] == 1
+
+
+def test_fingerprints_are_shared_through_redis():
+    redis_data = {}
+    redis = Mock()
+    redis.hmset.side_effect = lambda key, mapping: redis_data.update(mapping)
+    redis.hmget.side_effect = lambda key, fields: [
+        redis_data[field].encode('utf-8') if field in redis_data else None for field in fields
+    ]
+    importer = KuntoTurkuImporter({'URL': 'https://api.dummy.com/v1/'})
+    records = list(importer.get_location_records(FETCHED_DATA_1))
+
+    FingerprintCache('kuntoturku', redis).update(records)
+
+    # a new cache, for example in a restarted worker, gets the fingerprints from Redis
+    assert FingerprintCache('kuntoturku', redis).filter_changed(records) == []
+
+
+def test_feed_session_conditional_requests():
+    session = FeedSession(timeout=1)
+    response = Mock(status_code=200, headers={'ETag': '"abc"', 'Last-Modified': 'Sat, 18 Feb 2017 12:00:00 GMT'})
+    response.json.return_value = FETCHED_DATA_1
+    session.session.get = Mock(return_value=response)
+
+    assert session.get_json('https://api.dummy.com/v1/') == FETCHED_DATA_1
+
+    # validators aren't used before the data has been confirmed to be processed
+    session.get_json('https://api.dummy.com/v1/')
+    assert session.session.get.call_args[1]['headers'] == {}
+
+    session.confirm()
+    session.session.get = Mock(return_value=Mock(status_code=304))
+
+    assert session.get_json('https://api.dummy.com/v1/') is None
+    assert session.session.get.call_args[1]['headers'] == {
+        'If-None-Match': '"abc"',
+        'If-Modified-Since': 'Sat, 18 Feb 2017 12:00:00 GMT',
+    }
+
+
+def test_importer_run_not_modified():
+    importer = KuntoTurkuImporter({'URL': 'https://api.dummy.com/v1/'})
+    importer.http.session.get = Mock(return_value=Mock(status_code=304))
+
+    importer.run()
+
+    assert Vehicle.objects.count() == 0
+
+
+def test_ingest_daemon_runs_importer():
+    importer = KuntoTurkuImporter({'URL': 'https://api.dummy.com/v1/'})
+    importer.fetch_data = Mock(return_value=FETCHED_DATA_1)
+    loop = asyncio.new_event_loop()
+    daemon = IngestDaemon([importer], loop=loop)
+
+    try:
+        loop.run_until_complete(daemon._run_importer(importer))
+    finally:
+        loop.close()
+
+    assert Vehicle.objects.count() == 2
+
+
+def wait_for_lock_wait(cursor, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        cursor.execute('SELECT count(*) FROM pg_locks WHERE NOT granted')
+        if cursor.fetchone()[0]:
+            return
+        time.sleep(0.05)
+    raise AssertionError('Nothing started waiting for a lock')
+
+
+def test_import_finds_vehicle_committed_concurrently():
+    importer = KuntoTurkuImporter({'URL': 'https://api.dummy.com/v1/'})
+    importer.fetch_data = Mock(return_value=FETCHED_DATA_1)
+    errors = []
+
+    def run_importer():
+        try:
+            importer.run()
+        except Exception as e:
+            errors.append(e)
+        finally:
+            connection.close()
+
+    other_connection = connection.get_new_connection(connection.get_connection_params())
+    try:
+        with other_connection.cursor() as cursor:
+            cursor.execute(
+                'INSERT INTO vehicles_vehicle (data_source_id, origin_id) VALUES (%s, %s)',
+                (importer.data_source.id, '123')
+            )
+            thread = threading.Thread(target=run_importer)
+            thread.start()
+            # the vehicle is committed only after the import has started waiting for it
+            wait_for_lock_wait(cursor)
+            other_connection.commit()
+            thread.join(timeout=10)
+    finally:
+        other_connection.close()
+
+    assert errors == []
+    assert Vehicle.objects.count() == 2
+    assert Vehicle.objects.get(origin_id='123').locations.count() == 1
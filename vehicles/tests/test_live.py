@@ -0,0 +1,103 @@
+import asyncio
+import json
+from datetime import timedelta
+
+import pytest
+from django.utils import timezone
+
+from vehicles import live
+from vehicles.factories import LocationFactory, VehicleFactory
+from vehicles.publication import publish_due_locations
+from vehicles.tests.utils import get_list
+
+
+class FakeRedis:
+    def __init__(self):
+        self.published = []
+
+    def publish(self, channel, message):
+        self.published.append((channel, message))
+
+
+@pytest.fixture
+def live_publisher(monkeypatch):
+    live_publisher = live.LivePublisher(FakeRedis())
+    monkeypatch.setattr(live, '_live_publisher', live_publisher)
+    return live_publisher
+
+
+def get_published_vehicles(live_publisher):
+    return [json.loads(message.decode('utf-8')) for channel, message in live_publisher.redis.published]
+
+
+def test_publication_publishes_live_locations(live_publisher, settings):
+    settings.STREET_MAINTENANCE_DELAY = None
+    vehicle = VehicleFactory.create()
+    LocationFactory.create(vehicle=vehicle)
+
+    assert live_publisher.redis.published[0][0] == live.LIVE_CHANNEL
+    assert get_published_vehicles(live_publisher) == [get_list()]
+
+
+def test_live_locations_respect_delay(live_publisher, settings):
+    settings.STREET_MAINTENANCE_DELAY = 60 * 60
+    vehicle = VehicleFactory.create()
+    LocationFactory.create(vehicle=vehicle, timestamp=timezone.now() - timedelta(minutes=10))
+
+    assert live_publisher.redis.published == []
+
+    settings.STREET_MAINTENANCE_DELAY = 5 * 60
+    publish_due_locations()
+
+    vehicles = get_published_vehicles(live_publisher)
+    assert len(vehicles) == 1
+    assert [vehicle_data['id'] for vehicle_data in vehicles[0]] == [vehicle.id]
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+def test_live_server_streams_messages(loop):
+    server = live.LiveLocationServer(None, host='127.0.0.1', port=0, loop=loop)
+
+    async def run_client():
+        port = await server.start()
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(b'GET /v1/vehicles/live/?foo=bar HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        headers = await reader.readuntil(b'retry: 5000\n\n')
+        while not server.clients:
+            await asyncio.sleep(0.01)
+
+        server.broadcast(live.format_message(b'[{"id":1}]'))
+        message = await reader.readuntil(b'\n\n')
+
+        writer.close()
+        while server.clients:
+            await asyncio.sleep(0.01)
+        server._server.close()
+        return headers, message
+
+    headers, message = loop.run_until_complete(run_client())
+
+    assert headers.startswith(b'HTTP/1.1 200 OK\r\n')
+    assert b'Content-Type: text/event-stream\r\n' in headers
+    assert message == b'event: vehicles\ndata: [{"id":1}]\n\n'
+
+
+def test_live_server_unknown_path(loop):
+    server = live.LiveLocationServer(None, host='127.0.0.1', port=0, loop=loop)
+
+    async def run_client():
+        port = await server.start()
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(b'GET /v1/vehicles/ HTTP/1.1\r\n\r\n')
+        response = await reader.read()
+        server._server.close()
+        return response
+
+    assert loop.run_until_complete(run_client()).startswith(b'HTTP/1.1 404 Not Found\r\n')
+    assert not server.clients
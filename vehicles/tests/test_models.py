@@ -1,6 +1,13 @@
+from datetime import timedelta
+
+import pytest
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
 from vehicles.factories import LocationFactory, VehicleFactory
+from vehicles.models import iterate_query, Location, PendingLocation, Vehicle, VehicleState
+from vehicles.publication import publish_due_locations
 from vehicles.tests.utils import TWO_YEARS_IN_SECONDS
 
 
@@ -50,3 +57,136 @@ def test_last_locations_with_delay(settings):
     vehicle.update_last_location()
 
     assert vehicle.last_location == location_2
+
+
+def test_publish_due_locations(settings):
+    settings.STREET_MAINTENANCE_DELAY = 60
+
+    vehicle = VehicleFactory.create()
+    old_location = LocationFactory.create(vehicle=vehicle, timestamp=timezone.now() - timedelta(minutes=10))
+    new_location = LocationFactory.create(vehicle=vehicle, timestamp=timezone.now() - timedelta(seconds=30))
+
+    assert vehicle.last_location == old_location
+    assert PendingLocation.objects.get().location == new_location
+
+    # not due yet
+    assert publish_due_locations() == []
+    vehicle.refresh_from_db()
+    assert vehicle.last_location == old_location
+
+    settings.STREET_MAINTENANCE_DELAY = 10
+
+    assert publish_due_locations() == [vehicle.id]
+    vehicle.refresh_from_db()
+    assert vehicle.last_location == new_location
+    assert PendingLocation.objects.count() == 0
+
+
+def test_publish_due_locations_does_not_replace_newer_last_location(settings):
+    settings.STREET_MAINTENANCE_DELAY = 60
+
+    vehicle = VehicleFactory.create()
+    pending_location = LocationFactory.create(vehicle=vehicle, timestamp=timezone.now() - timedelta(seconds=30))
+
+    settings.STREET_MAINTENANCE_DELAY = None
+    newer_location = LocationFactory.create(vehicle=vehicle, timestamp=timezone.now() - timedelta(seconds=20))
+    assert vehicle.last_location == newer_location
+
+    assert publish_due_locations() == []
+    vehicle.refresh_from_db()
+    assert vehicle.last_location == newer_location
+    assert not PendingLocation.objects.filter(location=pending_location).exists()
+
+
+@pytest.mark.parametrize('delay', (None, 60))
+def test_location_save_number_of_queries(settings, delay):
+    settings.STREET_MAINTENANCE_DELAY = delay
+
+    vehicle = VehicleFactory.create()
+    LocationFactory.create_batch(20, vehicle=vehicle, year=2000)
+    location = LocationFactory.build(vehicle=vehicle, timestamp=timezone.now() - timedelta(seconds=30))
+
+    # one insert and one publishing / queueing query no matter how many locations the vehicle has
+    with CaptureQueriesContext(connection) as context:
+        location.save()
+    assert len(context.captured_queries) == 2
+
+    assert (vehicle.last_location == location) == (delay is None)
+
+
+def assert_state_matches_last_location(vehicle):
+    vehicle.refresh_from_db()
+    state = VehicleState.objects.get(vehicle=vehicle)
+    assert state.data_source_id == vehicle.data_source_id
+    assert (state.timestamp, state.coords, state.event_mask) == (
+        vehicle.last_location.timestamp, vehicle.last_location.coords, vehicle.last_location.event_mask
+    )
+
+
+def test_vehicle_state_follows_publication(settings):
+    settings.STREET_MAINTENANCE_DELAY = 60 * 60
+    vehicle = VehicleFactory.create()
+
+    LocationFactory.create(vehicle=vehicle, timestamp=timezone.now() - timedelta(minutes=30))
+    assert not VehicleState.objects.exists()
+
+    LocationFactory.create(vehicle=vehicle, year=2000, events=['au'])
+    assert_state_matches_last_location(vehicle)
+
+    settings.STREET_MAINTENANCE_DELAY = 10 * 60
+    publish_due_locations()
+    assert_state_matches_last_location(vehicle)
+
+    settings.STREET_MAINTENANCE_DELAY = 60 * 60
+    vehicle.update_last_location()
+    assert_state_matches_last_location(vehicle)
+    assert VehicleState.objects.count() == 1
+
+
+def get_rows_read(plan, table):
+    """
+    Return the number of rows read from the table and its partitions in an EXPLAIN ANALYZE JSON plan.
+    """
+    rows = 0
+    if plan.get('Relation Name', '').startswith(table):
+        rows = plan['Actual Rows'] * plan['Actual Loops']
+    return rows + sum(get_rows_read(subplan, table) for subplan in plan.get('Plans', ()))
+
+
+def test_multi_vehicle_location_history_reads_only_the_latest_locations(settings):
+    settings.STREET_MAINTENANCE_DELAY = None
+    base_datetime = timezone.now() - timedelta(hours=1)
+    for vehicle in VehicleFactory.create_batch(2):
+        for offset in range(50):
+            LocationFactory.create(vehicle=vehicle, timestamp=base_datetime + timedelta(seconds=offset))
+    vehicles = list(Vehicle.objects.select_related('last_location').order_by('id'))
+
+    locations = list(Vehicle.iterate_location_histories(vehicles, history=3))
+
+    assert [location[:2] for location in locations] == [
+        (vehicle.id, base_datetime + timedelta(seconds=offset)) for vehicle in vehicles for offset in (47, 48, 49)
+    ]
+
+    # the tables are tiny, so make the planner use the index like it would with a long history
+    sql, params = Vehicle.get_location_histories_query(vehicles, history=3)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute('SET LOCAL enable_seqscan = off')
+        cursor.execute('EXPLAIN (ANALYZE, FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0][0]['Plan']
+
+    # a few more than 3 per vehicle if the locations happen to span two partitions
+    assert get_rows_read(plan, 'vehicles_location') <= 2 * 5
+
+
+def test_closing_iterated_query_ends_its_transaction():
+    LocationFactory.create_batch(3)
+
+    rows = iterate_query('SELECT id FROM vehicles_location ORDER BY id', [], chunk_size=1)
+    assert next(rows)
+    assert connection.in_atomic_block is False
+    rows.close()
+
+    assert connection.in_atomic_block is False
+    assert connection.get_autocommit()
+    # other queries aren't affected
+    assert Location.objects.count() == 3
@@ -0,0 +1,70 @@
+from datetime import datetime
+
+import pytz
+
+from vehicles.factories import LocationFactory, VehicleFactory
+from vehicles.models import Location, VehicleState
+from vehicles.partitions import (
+    add_months, drop_expired_location_partitions, ensure_location_partitions, get_location_partitions
+)
+
+
+def test_add_months():
+    month_start = datetime(2017, 11, 1, tzinfo=pytz.utc)
+
+    assert add_months(month_start, 1) == datetime(2017, 12, 1, tzinfo=pytz.utc)
+    assert add_months(month_start, 2) == datetime(2018, 1, 1, tzinfo=pytz.utc)
+    assert add_months(month_start, -11) == datetime(2016, 12, 1, tzinfo=pytz.utc)
+
+
+def test_upcoming_partitions_exist():
+    ensure_location_partitions()
+    partitions = get_location_partitions()
+
+    assert ensure_location_partitions() == []
+    assert len(partitions) >= 4
+
+
+def test_partition_creation_moves_locations_from_default_partition():
+    location = LocationFactory.create(timestamp=datetime(2000, 1, 15, tzinfo=pytz.utc))
+
+    ensure_location_partitions(start=datetime(2000, 1, 1, tzinfo=pytz.utc), end=datetime(2000, 2, 1, tzinfo=pytz.utc))
+
+    partitions = get_location_partitions().values()
+    assert 'vehicles_location_y2000m01' in partitions
+    assert 'vehicles_location_y2000m02' in partitions
+    assert Location.objects.get() == location
+
+
+def test_drop_expired_partitions(settings):
+    settings.STREET_MAINTENANCE_DELAY = None
+    settings.STREET_MAINTENANCE_LOCATION_RETENTION_MONTHS = 12
+
+    ensure_location_partitions(start=datetime(2001, 1, 1, tzinfo=pytz.utc), end=datetime(2001, 1, 1, tzinfo=pytz.utc))
+    vehicle = VehicleFactory.create()
+    LocationFactory.create(vehicle=vehicle, timestamp=datetime(2001, 1, 15, tzinfo=pytz.utc))
+    assert vehicle.last_location
+
+    assert 'vehicles_location_y2001m01' in drop_expired_location_partitions()
+
+    assert not Location.objects.exists()
+    vehicle.refresh_from_db()
+    assert vehicle.last_location is None
+    assert not VehicleState.objects.exists()
+
+
+def test_delete_expired_locations_from_default_partition(settings):
+    settings.STREET_MAINTENANCE_DELAY = None
+    settings.STREET_MAINTENANCE_LOCATION_RETENTION_MONTHS = 12
+
+    # no partition is ever created for these months
+    vehicle = VehicleFactory.create()
+    LocationFactory.create(vehicle=vehicle, timestamp=datetime(1990, 1, 15, tzinfo=pytz.utc))
+    kept_location = LocationFactory.create(timestamp=datetime(2090, 1, 15, tzinfo=pytz.utc))
+
+    drop_expired_location_partitions()
+
+    assert list(Location.objects.all()) == [kept_location]
+    vehicle.refresh_from_db()
+    assert vehicle.last_location is None
+    assert not VehicleState.objects.filter(vehicle=vehicle).exists()
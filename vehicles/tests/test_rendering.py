@@ -0,0 +1,292 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+import pytz
+from django.contrib.gis.geos import Point
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from vehicles.api import VehicleSerializer
+from vehicles.factories import LocationFactory, VehicleFactory
+from vehicles.models import Vehicle
+from vehicles.rendering import LocalTimeFormatter, render_polyline_history, render_vehicle_detail_stream
+from vehicles.tests.utils import get_detail_url, VEHICLE_LIST_URL
+
+
+@pytest.fixture(autouse=True)
+def default_settings(settings):
+    settings.STREET_MAINTENANCE_DELAY = None
+
+
+@pytest.fixture
+def vehicle():
+    return VehicleFactory.create()
+
+
+@pytest.fixture
+def vehicles():
+    vehicles = VehicleFactory.create_batch(3)
+    timestamps = (
+        datetime(2017, 1, 18, 12, 0, tzinfo=pytz.utc),
+        datetime(2017, 3, 26, 0, 59, 59, 999999, tzinfo=pytz.utc),
+        datetime(2017, 3, 26, 1, 0, 0, 1000, tzinfo=pytz.utc),
+        datetime(2017, 7, 18, 12, 30, 15, 123456, tzinfo=pytz.utc),
+    )
+    events = ([], ['au'], ['su', 'hi'], ['kv', 'au', 'ha'])
+    for i, vehicle in enumerate(vehicles):
+        for j, timestamp in enumerate(timestamps):
+            LocationFactory.create(
+                vehicle=vehicle, timestamp=timestamp + timedelta(seconds=i), events=events[(i + j) % len(events)],
+                coords=Point(22.2 + i / 3.0 + j / 7.0, 60.4 + i / 11.0),
+            )
+    return vehicles
+
+
+def render_with_serializers(data, many=False, location_history=()):
+    context = {'location_history': location_history}
+    return JSONRenderer().render(VehicleSerializer(data, many=many, context=context).data)
+
+
+@pytest.mark.parametrize('time_zone', ('Europe/Helsinki', 'UTC', 'America/St_Johns'))
+def test_list_matches_serializers(vehicles, settings, time_zone):
+    settings.TIME_ZONE = time_zone
+
+    response = APIClient().get(VEHICLE_LIST_URL)
+
+    expected_vehicles = Vehicle.objects.exclude(last_location__isnull=True).select_related('last_location')[:10]
+    assert response.status_code == 200
+    assert response['Content-Type'] == 'application/json'
+    assert response.content == render_with_serializers(expected_vehicles, many=True)
+
+
+@pytest.mark.parametrize('params', (
+    {},
+    {'history': 10},
+    {'history': 2},
+    {'since': '2017-03-01T00:00:00Z'},
+    {'history': 10, 'temporal_resolution': 60 * 60 * 24 * 30},
+))
+@pytest.mark.parametrize('time_zone', ('Europe/Helsinki', 'UTC'))
+def test_detail_matches_serializers(vehicles, settings, params, time_zone):
+    settings.TIME_ZONE = time_zone
+    vehicle = vehicles[1]
+
+    response = APIClient().get(get_detail_url(vehicle), params)
+
+    vehicle = Vehicle.objects.get(id=vehicle.id)
+    location_history = []
+    if params:
+        history_params = dict(params)
+        if 'since' in history_params:
+            history_params['since'] = pytz.utc.localize(datetime(2017, 3, 1))
+        location_history = vehicle.get_location_history(**history_params)
+
+    assert response.status_code == 200
+    assert response.content == render_with_serializers(vehicle, location_history=location_history)
+
+
+def test_local_time_formatter_around_dst_change(settings):
+    settings.TIME_ZONE = 'Europe/Helsinki'
+    formatter = LocalTimeFormatter()
+    start = datetime(2017, 10, 29, 0, 0, tzinfo=pytz.utc)
+
+    for minutes in range(0, 4 * 60, 7):
+        timestamp = start + timedelta(minutes=minutes, microseconds=minutes)
+        local = timestamp.astimezone(pytz.timezone('Europe/Helsinki'))
+        assert formatter.format(timestamp) == local.isoformat()
+
+
+def test_local_time_formatter_with_non_utc_timestamps(settings):
+    settings.TIME_ZONE = 'Europe/Helsinki'
+    formatter = LocalTimeFormatter()
+    timestamp = pytz.timezone('America/New_York').localize(datetime(2017, 2, 18, 5, 30))
+
+    assert formatter.format(timestamp) == '2017-02-18T12:30:00+02:00'
+    assert formatter.format(timestamp.astimezone(pytz.utc)) == '2017-02-18T12:30:00+02:00'
+
+
+def decode_polyline(polyline):
+    values = []
+    value = shift = 0
+    for char in polyline:
+        chunk = ord(char) - 63
+        value |= (chunk & 0x1f) << shift
+        shift += 5
+        if not chunk & 0x20:
+            values.append(~(value >> 1) if value & 1 else value >> 1)
+            value = shift = 0
+
+    points = []
+    lat = lng = 0
+    for lat_delta, lng_delta in zip(values[::2], values[1::2]):
+        lat += lat_delta
+        lng += lng_delta
+        points.append((round(lat / 1e5, 5), round(lng / 1e5, 5)))
+    return points
+
+
+def test_polyline_encoding():
+    # the example from Google's documentation of the algorithm, with (timestamp, x, y, event_mask) locations
+    timestamp = datetime(2017, 1, 18, 12, 0, tzinfo=pytz.utc)
+    locations = [
+        (timestamp, -120.2, 38.5, 0),
+        (timestamp + timedelta(seconds=5), -120.95, 40.7, 2),
+        (timestamp + timedelta(seconds=12), -126.453, 43.252, 2),
+    ]
+    history = json.loads(render_polyline_history(locations, LocalTimeFormatter()))
+
+    assert history['polyline'] == '_p~iF~ps|U_ulLnnqC_mqNvxq`@'
+    assert history['timestamps'] == [0, 5, 7]
+    assert history['events'] == [[1, []], [2, ['au']]]
+
+
+def test_polyline_format(vehicle, settings):
+    settings.TIME_ZONE = 'UTC'
+    base_datetime = datetime(2017, 1, 18, 12, 0, tzinfo=pytz.utc)
+    for offset, coords, events in (
+        (0, (22.26701, 60.45182), ['au']),
+        (4, (22.26711, 60.45182), ['au']),
+        (10, (22.26721, 60.45192), []),
+        (20, (22.26731, 60.45202), ['su']),
+    ):
+        LocationFactory.create(vehicle=vehicle, timestamp=base_datetime + timedelta(seconds=offset),
+                               coords=Point(*coords), events=events)
+
+    response = APIClient().get(get_detail_url(vehicle), {'history': 10, 'format': 'polyline'})
+
+    assert response.status_code == 200
+    assert response['Content-Type'] == 'application/json'
+    data = json.loads(response.content.decode('utf-8'))
+    assert data['id'] == vehicle.id
+    assert data['last_location'] == {'timestamp': '2017-01-18T12:00:20Z', 'coords': [22.26731, 60.45202],
+                                     'events': ['su']}
+    history = data['location_history']
+    assert decode_polyline(history.pop('polyline')) == [
+        (60.45182, 22.26701), (60.45182, 22.26711), (60.45192, 22.26721), (60.45202, 22.26731)
+    ]
+    assert history == {
+        'start': '2017-01-18T12:00:00Z',
+        'timestamps': [0, 4, 6, 10],
+        'events': [[2, ['au']], [1, []], [1, ['su']]],
+    }
+
+
+def test_polyline_format_without_history(vehicle):
+    LocationFactory.create(vehicle=vehicle)
+
+    response = APIClient().get(get_detail_url(vehicle), {'format': 'polyline'})
+
+    assert response.status_code == 200
+    data = json.loads(response.content.decode('utf-8'))
+    assert data['location_history'] == {'start': None, 'polyline': '', 'timestamps': [], 'events': []}
+
+
+def test_polyline_format_is_not_available_in_list(vehicles):
+    response = APIClient().get(VEHICLE_LIST_URL, {'format': 'polyline'})
+    assert response.status_code == 406
+
+
+@pytest.mark.parametrize('history_length', (0, 1, 3))
+def test_geojson_format_in_detail(vehicle, settings, history_length):
+    settings.TIME_ZONE = 'UTC'
+    base_datetime = datetime(2017, 1, 18, 12, 0, tzinfo=pytz.utc)
+    for offset, events in enumerate((['au'], [], ['su', 'hi'])):
+        LocationFactory.create(vehicle=vehicle, timestamp=base_datetime + timedelta(seconds=offset),
+                               coords=Point(22.2 + offset, 60.4), events=events)
+    params = {'format': 'geojson'}
+    if history_length:
+        params['history'] = history_length
+
+    response = APIClient().get(get_detail_url(vehicle), params)
+
+    assert response.status_code == 200
+    assert response['Content-Type'] == 'application/geo+json'
+    data = json.loads(response.content.decode('utf-8'))
+    assert data['type'] == 'FeatureCollection'
+    assert data['features'][0] == {
+        'type': 'Feature',
+        'geometry': {'type': 'Point', 'coordinates': [22.2 + 2, 60.4]},
+        'properties': {'vehicle_id': vehicle.id, 'kind': 'last_location', 'timestamp': '2017-01-18T12:00:02Z',
+                       'events': ['su', 'hi']},
+    }
+
+    if not history_length:
+        assert len(data['features']) == 1
+        return
+
+    history = data['features'][1]
+    assert history['geometry']['type'] == ('LineString' if history_length > 1 else 'Point')
+    expected_offsets = range(3 - history_length, 3)
+    if history_length > 1:
+        assert history['geometry']['coordinates'] == [[22.2 + offset, 60.4] for offset in expected_offsets]
+    assert history['properties'] == {
+        'vehicle_id': vehicle.id,
+        'kind': 'location_history',
+        'timestamps': ['2017-01-18T12:00:0%dZ' % offset for offset in expected_offsets],
+        'events': [(['au'], [], ['su', 'hi'])[offset] for offset in expected_offsets],
+    }
+
+
+def test_geojson_format_in_list(vehicles):
+    response = APIClient().get(VEHICLE_LIST_URL, {'format': 'geojson'})
+
+    assert response.status_code == 200
+    data = json.loads(response.content.decode('utf-8'))
+    assert data['type'] == 'FeatureCollection'
+    assert {feature['properties']['vehicle_id'] for feature in data['features']} == {
+        vehicle.id for vehicle in vehicles
+    }
+    for feature in data['features']:
+        assert feature['geometry']['type'] == 'Point'
+        assert feature['properties']['kind'] == 'last_location'
+
+
+@pytest.mark.parametrize('params', (
+    {},
+    {'history': 10},
+    {'history': 2},
+    {'since': '2017-03-01T00:00:00Z'},
+    {'since': '2017-03-01T00:00:00Z', 'history': 1},
+    {'history': 10, 'temporal_resolution': 60 * 60 * 24 * 30},
+    {'history': 2, 'event': 'au'},
+))
+def test_streamed_detail_matches_detail(vehicles, params):
+    vehicle = vehicles[1]
+    api_client = APIClient()
+
+    response = api_client.get(get_detail_url(vehicle), dict(params, stream=1))
+
+    assert response.status_code == 200
+    assert response.streaming
+    assert b''.join(response.streaming_content) == api_client.get(get_detail_url(vehicle), params).content
+
+
+def test_streamed_detail_starts_before_reading_locations():
+    last_location = (datetime(2017, 1, 18, 12, 0, tzinfo=pytz.utc), 22.2, 60.4, 0)
+
+    def location_history():
+        raise AssertionError('The location history was read before the first chunk was sent.')
+        yield  # makes this a generator
+
+    chunks = render_vehicle_detail_stream(123, last_location, location_history())
+
+    assert next(chunks).startswith(b'{"id":123,"last_location":{"timestamp":')
+    with pytest.raises(AssertionError):
+        next(chunks)
+
+
+@pytest.mark.parametrize('params', (
+    {'stream': 'yes'},
+    {'stream': 1, 'page_size': 10},
+))
+def test_invalid_streamed_detail(vehicle, params):
+    LocationFactory.create(vehicle=vehicle)
+    response = APIClient().get(get_detail_url(vehicle), params)
+    assert response.status_code == 400
+
+
+def test_streamed_detail_is_json_only(vehicle):
+    LocationFactory.create(vehicle=vehicle)
+    response = APIClient().get(get_detail_url(vehicle), {'stream': 1, 'history': 1, 'format': 'geojson'})
+    assert response.status_code == 406
@@ -0,0 +1,106 @@
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from vehicles import cache
+from vehicles.factories import LocationFactory, VehicleFactory
+from vehicles.publication import publish_due_locations
+from vehicles.tests.utils import get_detail_url, VEHICLE_LIST_URL
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value.encode('utf-8') if isinstance(value, str) else value
+
+    def incr(self, key):
+        self.data[key] = int(self.data.get(key, 0)) + 1
+
+
+@pytest.fixture(autouse=True)
+def default_settings(settings):
+    settings.STREET_MAINTENANCE_DELAY = None
+
+
+@pytest.fixture
+def response_cache(monkeypatch):
+    response_cache = cache.ResponseCache(FakeRedis())
+    monkeypatch.setattr(cache, '_response_cache', response_cache)
+    return response_cache
+
+
+@pytest.fixture
+def vehicle():
+    vehicle = VehicleFactory.create()
+    LocationFactory.create_batch(3, vehicle=vehicle)
+    return vehicle
+
+
+@pytest.mark.parametrize('url_getter, params', (
+    (lambda vehicle: VEHICLE_LIST_URL, {'limit': 5}),
+    (get_detail_url, {'history': 3}),
+))
+def test_cached_response(response_cache, vehicle, url_getter, params):
+    api_client = APIClient()
+    url = url_getter(vehicle)
+    response = api_client.get(url, params)
+    assert response.status_code == 200
+
+    with CaptureQueriesContext(connection) as context:
+        cached_response = api_client.get(url, params)
+
+    assert len(context) == 0
+    assert cached_response.status_code == 200
+    assert cached_response.content == response.content
+    assert cached_response['Content-Type'] == response['Content-Type']
+    assert cached_response['ETag'] == response['ETag']
+
+    other_response = api_client.get(url, dict(params, since='2000-01-01'))
+    assert other_response['ETag'] != response['ETag']
+
+
+def test_not_modified(response_cache, vehicle):
+    api_client = APIClient()
+    etag = api_client.get(VEHICLE_LIST_URL)['ETag']
+
+    with CaptureQueriesContext(connection) as context:
+        response = api_client.get(VEHICLE_LIST_URL, HTTP_IF_NONE_MATCH=etag)
+
+    assert len(context) == 0
+    assert response.status_code == 304
+    assert response.content == b''
+    assert response['ETag'] == etag
+
+
+def test_publication_invalidates_responses(response_cache, vehicle, settings):
+    api_client = APIClient()
+    response = api_client.get(VEHICLE_LIST_URL)
+
+    LocationFactory.create(vehicle=vehicle, timestamp=timezone.now())
+
+    new_response = api_client.get(VEHICLE_LIST_URL, HTTP_IF_NONE_MATCH=response['ETag'])
+    assert new_response.status_code == 200
+    assert new_response['ETag'] != response['ETag']
+    assert new_response.content != response.content
+
+    settings.STREET_MAINTENANCE_DELAY = 60 * 60
+    LocationFactory.create(vehicle=vehicle, timestamp=timezone.now())
+    assert api_client.get(VEHICLE_LIST_URL)['ETag'] == new_response['ETag']
+
+    settings.STREET_MAINTENANCE_DELAY = None
+    publish_due_locations()
+    assert api_client.get(VEHICLE_LIST_URL)['ETag'] != new_response['ETag']
+
+
+def test_no_caching_without_redis(vehicle, monkeypatch):
+    monkeypatch.setattr(cache, '_response_cache', cache.ResponseCache())
+    response = APIClient().get(VEHICLE_LIST_URL)
+    assert response.status_code == 200
+    assert not response.has_header('ETag')
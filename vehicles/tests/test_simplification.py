@@ -0,0 +1,39 @@
+from vehicles.simplification import get_simplified_indices, simplify_location_histories
+
+
+def make_locations(coords, event_masks=None):
+    return [
+        (index, x, y, event_masks[index] if event_masks else 0) for index, (x, y) in enumerate(coords)
+    ]
+
+
+def test_straight_line_is_simplified_to_its_ends():
+    locations = make_locations([(22.25 + index * 0.001, 60.45) for index in range(10)])
+    assert get_simplified_indices(locations, 1) == [0, 9]
+
+
+def test_turning_back_is_kept():
+    # a vehicle driving 200 meters east and returning half way along the same street
+    locations = make_locations([(22.25, 60.45), (22.252, 60.45), (22.254, 60.45), (22.252, 60.45)])
+    assert get_simplified_indices(locations, 10) == [0, 2, 3]
+
+
+def test_event_changes_are_kept():
+    locations = make_locations(
+        [(22.25 + index * 0.001, 60.45) for index in range(8)], event_masks=[0, 0, 2, 2, 2, 6, 6, 0]
+    )
+    assert get_simplified_indices(locations, 1000) == [0, 1, 2, 4, 5, 6, 7]
+
+
+def test_empty_and_single_locations():
+    assert get_simplified_indices([], 1) == []
+    assert get_simplified_indices(make_locations([(22.25, 60.45)]), 1) == [0]
+
+
+def test_location_histories_are_simplified_per_vehicle():
+    locations = [
+        (vehicle_id,) + location
+        for vehicle_id in (1, 2)
+        for location in make_locations([(22.25 + index * 0.001, 60.45) for index in range(5)])
+    ]
+    assert [location[:2] for location in simplify_location_histories(locations, 1)] == [(1, 0), (1, 4), (2, 0), (2, 4)]
@@ -32,5 +32,5 @@ def get_location_data_from_obj(obj):
     return {
         'coords': [obj.coords.x, obj.coords.y],
         'timestamp': timezone.localtime(obj.timestamp).isoformat(),
-        'events': [ev.identifier for ev in obj.events.all()],
+        'events': obj.events,
     }
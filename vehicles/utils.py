@@ -1,7 +1,20 @@
-from .constants import EVENT_TYPES
+import redis
+from django.conf import settings
+
+from .constants import EVENT_TYPES, REDIS_URL_SETTING
 from .models import EventType
 
 
 def populate_event_types():
     for event_type in EVENT_TYPES:
         EventType.objects.update_or_create(identifier=event_type['identifier'], defaults=event_type)
+
+
+def get_redis_connection():
+    """
+    Return a Redis connection based on the Redis URL setting, or None if Redis isn't configured.
+    """
+    url = getattr(settings, REDIS_URL_SETTING, None)
+    if not url:
+        return None
+    return redis.StrictRedis.from_url(url)